@@ -99,6 +99,11 @@ class Application(object):
     :param before_render: Called right before rendering.
     :param after_render: Called right after rendering.
 
+    :param metrics_handler: Callable that receives a
+        :class:`~prompt_toolkit.metrics.Timing` instance for every completion,
+        auto suggestion and validation of the buffers while the application
+        is running. (Nothing is measured when this is `None`.)
+
     I/O:
 
     :param input: :class:`~prompt_toolkit.input.Input` instance.
@@ -129,6 +134,7 @@ class Application(object):
 
                  on_reset=None, on_invalidate=None,
                  before_render=None, after_render=None,
+                 metrics_handler=None,
 
                  # I/O.
                  input=None, output=None):
@@ -161,6 +167,7 @@ class Application(object):
         assert on_invalidate is None or callable(on_invalidate)
         assert before_render is None or callable(before_render)
         assert after_render is None or callable(after_render)
+        assert metrics_handler is None or callable(metrics_handler)
 
         assert output is None or isinstance(output, Output)
         assert input is None or isinstance(input, Input)
@@ -198,6 +205,7 @@ class Application(object):
         self.on_reset = Event(self, on_reset)
         self.before_render = Event(self, before_render)
         self.after_render = Event(self, after_render)
+        self.metrics_handler = metrics_handler
 
         # I/O.
         self.output = output or get_default_output()
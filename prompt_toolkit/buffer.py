@@ -11,23 +11,28 @@ from .cache import FastDictCache
 from .clipboard import ClipboardData
 from .completion import CompleteEvent, get_common_complete_suffix, Completer, Completion, DummyCompleter
 from .document import Document
-from .eventloop import ensure_future, Return, From, consume_async_generator
+from .eventloop import ensure_future, Return, From, consume_async_generator, call_from_executor
 from .filters import to_filter
 from .history import History, InMemoryHistory
+from .metrics import start_timing
 from .search import SearchDirection, SearchState
 from .selection import SelectionType, SelectionState, PasteMode
+from .undo import UndoStack
 from .utils import Event, test_callable_args, to_str
 from .validation import ValidationError, Validator
 
+from contextlib import contextmanager
 from functools import wraps
 from six.moves import range
 
+import bisect
 import os
 import re
 import shlex
 import six
 import subprocess
 import tempfile
+import time
 
 __all__ = [
     'EditReadOnlyBuffer',
@@ -128,6 +133,242 @@ class YankNthArgState(object):
             self.previous_inserted_word)
 
 
+# Where `Buffer._search` found a match: in the current input, further in the
+# history, or in the history after wrapping around.
+_SEARCH_CURRENT = 'CURRENT'
+_SEARCH_HISTORY = 'HISTORY'
+_SEARCH_WRAPPED = 'WRAPPED'
+
+
+def _find(string, sub, position, ignore_case):
+    " Return the first occurrence of `sub` in `string`, from `position`. "
+    if ignore_case:
+        match = re.compile(re.escape(sub), re.IGNORECASE).search(string, position)
+        return match.start() if match else None
+    else:
+        result = string.find(sub, position)
+        return result if result >= 0 else None
+
+
+def _find_backwards(string, sub, end, ignore_case):
+    " Return the last occurrence of `sub` in `string`, that ends before `end`. "
+    if ignore_case:
+        result = None
+        for match in re.compile('(?=%s)' % re.escape(sub), re.IGNORECASE).finditer(string, 0, end):
+            result = match.start()
+        return result
+    else:
+        result = string.rfind(sub, 0, end)
+        return result if result >= 0 else None
+
+
+class _WorkingLines(object):
+    """
+    The working lines of a :class:`.Buffer`: the history strings, followed by
+    the input line. This behaves like a list, but only the lines that were
+    edited are stored. The other lines are read from the history, so that
+    creating it doesn't copy the history.
+
+    Strings that the history loads later on are inserted at the start (see
+    `history_string_loaded`). Strings that are appended to the history are
+    not added. The edited lines are keyed by their distance to the end, which
+    doesn't change when strings are inserted at the start.
+
+    :param history: :class:`~prompt_toolkit.history.History` instance.
+    :param text: The input line.
+    """
+    def __init__(self, history, text):
+        self.history = history
+        self._strings = history.get_strings()
+        self._count = len(self._strings)  # Number of history strings.
+        self._edited = {0: text}  # Maps distance to the end to the line.
+
+    def __repr__(self):
+        return '%s(len=%r, edited=%r)' % (
+            self.__class__.__name__, len(self), len(self._edited))
+
+    def __len__(self):
+        return self._count + 1
+
+    def _get_index(self, index):
+        " Turn `index` into a valid, positive index. "
+        if index < 0:
+            index += self._count + 1
+
+        if not 0 <= index <= self._count:
+            raise IndexError('working line index out of range')
+
+        return index
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+
+            count = self._count
+            result = self._strings[start:min(stop, count)]
+            if stop > count:
+                result.append(None)  # Input line, set below.
+
+            for distance, line in self._edited.items():
+                i = count - distance
+                if start <= i < stop:
+                    result[i - start] = line
+
+            return result
+        else:
+            index = self._get_index(index)
+            try:
+                return self._edited[self._count - index]
+            except KeyError:
+                return self._strings[index]
+
+    def __setitem__(self, index, value):
+        self._edited[self._count - self._get_index(index)] = value
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def history_string_loaded(self):
+        " Called when the history loaded a string. (It's inserted at the start.) "
+        self._strings = self.history.get_strings()
+        self._count += 1
+
+
+class _HistorySearchIndex(object):
+    """
+    Index for searching through the working lines of a :class:`.Buffer`.
+
+    The lines are grouped in blocks that are joined into one string, so that
+    searching through the history takes a few `str.find` calls, rather than a
+    search in every single entry. The blocks are counted from the end of the
+    list, because new history entries are inserted at the start. This way, a
+    block stays valid while the history is loading. Only a block with a
+    changed line (and the oldest block, when it grew) is joined again.
+
+    :param lines: The working lines. (A `_WorkingLines` instance.)
+    """
+    block_size = 1000
+    separator = '\x00'
+
+    def __init__(self, lines):
+        self.lines = lines
+        self._blocks = {}  # Maps block number to (line count, text, line starts).
+
+    def invalidate(self, index):
+        " Call this when the line at `index` changed. "
+        self._blocks.pop(self._get_block_number(index), None)
+
+    def _get_block(self, number):
+        """
+        Return a (first line index, text, line starts) tuple for the block.
+        """
+        lines = self.lines
+        end = len(lines) - number * self.block_size
+        start = max(0, end - self.block_size)
+
+        block = self._blocks.get(number)
+
+        if block is None or block[0] != end - start:
+            block_lines = lines[start:end]
+            starts = []
+            position = 0
+
+            for line in block_lines:
+                starts.append(position)
+                position += len(line) + 1
+
+            block = (end - start, self.separator.join(block_lines), starts)
+            self._blocks[number] = block
+
+        return start, block[1], block[2]
+
+    def _get_block_number(self, index):
+        return (len(self.lines) - 1 - index) // self.block_size
+
+    def find(self, sub, start, end, ignore_case=False):
+        """
+        Find the first occurrence of `sub` in the lines from `start` until
+        `end`. Return a (line index, position) tuple or `None`.
+        """
+        if start >= end:
+            return
+
+        if self.separator in sub:
+            return self._find_in_lines(sub, range(start, end), ignore_case)
+
+        pattern = re.compile(re.escape(sub), re.IGNORECASE) if ignore_case else None
+
+        for number in range(self._get_block_number(start), self._get_block_number(end - 1) - 1, -1):
+            first, text, starts = self._get_block(number)
+
+            text_start = starts[start - first] if start > first else 0
+            text_end = (starts[end - first] - 1) if end - first < len(starts) else len(text)
+
+            if pattern:
+                match = pattern.search(text, text_start, text_end)
+                position = match.start() if match else -1
+            else:
+                position = text.find(sub, text_start, text_end)
+
+            if position >= 0:
+                i = bisect.bisect_right(starts, position) - 1
+                return first + i, position - starts[i]
+
+    def find_backwards(self, sub, start, end, ignore_case=False):
+        """
+        Find the last occurrence of `sub` in the lines from `start` until
+        `end`. Return a (line index, position) tuple or `None`.
+        """
+        if start >= end:
+            return
+
+        if self.separator in sub:
+            return self._find_in_lines(sub, range(end - 1, start - 1, -1), ignore_case, last=True)
+
+        pattern = re.compile('(?=%s)' % re.escape(sub), re.IGNORECASE) if ignore_case else None
+
+        for number in range(self._get_block_number(end - 1), self._get_block_number(start) + 1):
+            first, text, starts = self._get_block(number)
+
+            text_start = starts[start - first] if start > first else 0
+            text_end = (starts[end - first] - 1) if end - first < len(starts) else len(text)
+
+            if pattern:
+                # Search in a growing window at the end, to avoid going
+                # through the whole block when the match is close.
+                position = -1
+                window = 4096
+
+                while position < 0:
+                    window_start = max(text_start, text_end - window)
+                    for match in pattern.finditer(text, window_start, text_end):
+                        position = match.start()
+
+                    if window_start == text_start:
+                        break
+                    window *= 4
+            else:
+                position = text.rfind(sub, text_start, text_end)
+
+            if position >= 0:
+                i = bisect.bisect_right(starts, position) - 1
+                return first + i, position - starts[i]
+
+    def _find_in_lines(self, sub, indexes, ignore_case, last=False):
+        " Search line by line. (For a `sub` that contains the separator.) "
+        flags = re.IGNORECASE if ignore_case else 0
+        pattern = re.compile('(?=%s)' % re.escape(sub), flags)
+
+        for i in indexes:
+            positions = [m.start() for m in pattern.finditer(self.lines[i])]
+            if positions:
+                return i, (positions[-1] if last else positions[0])
+
+
 class Buffer(object):
     """
     The core data structure that holds the text and cursor position of the
@@ -146,6 +387,16 @@ class Buffer(object):
         by their name instead of by reference.
     :param accept_handler: Callback that takes this buffer as input. Called when
         the buffer input is accepted. (Usually when the user presses `enter`.)
+    :param max_undo_size: Maximum number of characters that the undo and redo
+        stacks can keep for the edits. The oldest states are dropped first.
+        (`None` for no limit.)
+    :param completion_batch_interval: While completions are streaming in,
+        `on_completions_changed` is fired once for a batch of completions. When
+        the event loop is busy, a batch is postponed at most this number of
+        seconds.
+    :param completion_first_batch_time: Like `completion_batch_interval`, but
+        for the first batch: the number of seconds after starting the
+        completion. (The first completions are shown within this time.)
 
     Events:
 
@@ -182,7 +433,8 @@ class Buffer(object):
                  accept_handler=None, read_only=False, multiline=True,
                  on_text_changed=None, on_text_insert=None,
                  on_cursor_position_changed=None, on_completions_changed=None,
-                 on_suggestion_set=None):
+                 on_suggestion_set=None, max_undo_size=10000000,
+                 completion_batch_interval=.05, completion_first_batch_time=.01):
 
         # Accept both filters and booleans as input.
         enable_history_search = to_filter(enable_history_search)
@@ -205,6 +457,9 @@ class Buffer(object):
         assert on_suggestion_set is None or callable(on_suggestion_set)
         assert document is None or isinstance(document, Document)
         assert accept_handler is None or (callable(accept_handler) and test_callable_args(accept_handler, [None]))
+        assert max_undo_size is None or isinstance(max_undo_size, int)
+        assert isinstance(completion_batch_interval, (float, int))
+        assert isinstance(completion_first_batch_time, (float, int))
 
         self.completer = completer or DummyCompleter()
         self.auto_suggest = auto_suggest
@@ -212,6 +467,9 @@ class Buffer(object):
         self.tempfile_suffix = tempfile_suffix
         self.name = name
         self.accept_handler = accept_handler
+        self.max_undo_size = max_undo_size
+        self.completion_batch_interval = completion_batch_interval
+        self.completion_first_batch_time = completion_first_batch_time
 
         # Filters. (Usually, used by the key bindings to drive the buffer.)
         self.complete_while_typing = complete_while_typing
@@ -237,8 +495,23 @@ class Buffer(object):
         self.on_completions_changed = Event(self, on_completions_changed)
         self.on_suggestion_set = Event(self, on_suggestion_set)
 
-        # Document cache. (Avoid creating new Document instances.)
-        self._document_cache = FastDictCache(Document, size=10)
+        # The changes of the current batch edit. (See `batch_edit`.)
+        self._batch_changes = None
+
+        # Document cache. (Avoid creating new Document instances.) The keys
+        # contain a version number of the text, instead of the text itself.
+        # (Hashing and comparing the text is slow for big documents.)
+        self._document_cache = FastDictCache(self._create_document, size=10)
+        self._text_version = 0
+
+        # A document for the current text, of which the new documents share
+        # the cache. (Or `None` if we don't have one yet.)
+        self._text_document = None
+
+        # The `CompleteEvent` of the completions that are being retrieved, or
+        # `None`. It is cancelled when the completion state is replaced.
+        self._complete_state = None
+        self._complete_event = None
 
         # Create completer / auto suggestion / validation coroutines.
         self._async_suggester = self._create_auto_suggest_coroutine()
@@ -251,7 +524,8 @@ class Buffer(object):
         # Attach callback for new history entries.
         def new_history_item(sender):
             # Insert the new string into `_working_lines`.
-            self._working_lines.insert(0, self.history.get_strings()[0])
+            # (This keeps the history search index valid.)
+            self._working_lines.history_string_loaded()
             self.__working_index += 1
 
         self.history.get_item_loaded_event().add_handler(new_history_item)
@@ -296,6 +570,11 @@ class Buffer(object):
         # State of complete browser
         self.complete_state = None  # For interactive completion through Ctrl-N/Ctrl-P.
 
+        # The last completions that were retrieved, when the completer can
+        # narrow them down: (narrowing completer, document, completions).
+        # (See `Completer.narrow_completions`.)
+        self._previous_completions = None
+
         # State of Emacs yank-nth-arg completion.
         self.yank_nth_arg_state = None  # for yank-nth-arg.
 
@@ -310,18 +589,26 @@ class Buffer(object):
         # browse through it.)
         self.history_search_text = None
 
-        # Undo/redo stacks
-        self._undo_stack = []  # Stack of (text, cursor_position)
-        self._redo_stack = []
+        # The last search: (origin, search text, input text, result). (Used
+        # for narrowing down an incremental search.)
+        self._last_search = None
+
+        # Undo/redo stacks. (Stacks of (text, cursor_position) states.)
+        self._undo_stack = UndoStack(
+            max_size=self.max_undo_size, group_inserts=True)
+        self._redo_stack = UndoStack(max_size=self.max_undo_size)
 
         #: The working lines. Similar to history, except that this can be
         #: modified. The user can press arrow_up and edit previous entries.
-        #: Ctrl-C should reset this, and copy the whole history back in here.
+        #: Ctrl-C should reset this, and read the whole history again.
         #: Enter should process the current command and append to the real
         #: history.
-        self._working_lines = self.history.get_strings()[:]
-        self._working_lines.append(document.text)
+        self._working_lines = _WorkingLines(self.history, document.text)
         self.__working_index = len(self._working_lines) - 1
+        self._new_text_version(document)
+
+        # Index for searching through the working lines.
+        self._history_search_index = _HistorySearchIndex(self._working_lines)
 
     # <getters/setters>
 
@@ -332,6 +619,7 @@ class Buffer(object):
 
         original_value = working_lines[working_index]
         working_lines[working_index] = value
+        self._history_search_index.invalidate(working_index)
 
         # Return True when this text has been changed.
         if len(value) != len(original_value):
@@ -340,10 +628,32 @@ class Buffer(object):
             # character by character to see whether the strings are different.
             # (Some benchmarking showed significant differences for big
             # documents. >100,000 of lines.)
-            return True
-        elif value != original_value:
-            return True
-        return False
+            changed = True
+        else:
+            changed = value != original_value
+
+        if changed:
+            self._new_text_version()
+        return changed
+
+    def _new_text_version(self, document=None):
+        """
+        Called when the current text changes. `document` is an optional
+        :class:`~prompt_toolkit.document.Document` with the new text, of which
+        the cache will be shared.
+        """
+        self._text_version += 1
+        self._text_document = document
+
+    def _create_document(self, text_version, cursor_position, selection_state):
+        " Create a Document for the current text. (Called by the document cache.) "
+        if self._text_document is None:
+            self._text_document = Document(
+                self.text, cursor_position, selection_state)
+            return self._text_document
+        else:
+            return self._text_document._with_cursor_position(
+                cursor_position, selection_state)
 
     def _set_cursor_position(self, value):
         """ Set cursor position. Return whether it changed. """
@@ -414,12 +724,28 @@ class Buffer(object):
     def working_index(self, value):
         if self.__working_index != value:
             self.__working_index = value
+            self._new_text_version()
             # Make sure to reset the cursor position, otherwise we end up in
             # situations where the cursor position is out of the bounds of the
             # text.
             self.cursor_position = 0
             self._text_changed()
 
+    @property
+    def complete_state(self):
+        " :class:`.CompletionState` instance or `None`. "
+        return self._complete_state
+
+    @complete_state.setter
+    def complete_state(self, value):
+        # The completions that are being retrieved for the previous state are
+        # not needed anymore. Tell the completer to stop.
+        if value is not self._complete_state and self._complete_event is not None:
+            self._complete_event.cancel()
+            self._complete_event = None
+
+        self._complete_state = value
+
     def _text_changed(self):
         # Remove any validation errors and complete state.
         self.validation_error = None
@@ -431,6 +757,13 @@ class Buffer(object):
         self.suggestion = None
         self.preferred_column = None
 
+        # During a batch edit, fire the event when the batch is done.
+        if self._batch_changes is not None:
+            self._batch_changes.add('text')
+        else:
+            self._fire_text_changed()
+
+    def _fire_text_changed(self):
         # fire 'on_text_changed' event.
         self.on_text_changed.fire()
 
@@ -456,7 +789,10 @@ class Buffer(object):
         # new position of the cursor determines the end of the selection.
 
         # fire 'on_cursor_position_changed' event.
-        self.on_cursor_position_changed.fire()
+        if self._batch_changes is not None:
+            self._batch_changes.add('cursor')
+        else:
+            self.on_cursor_position_changed.fire()
 
     @property
     def document(self):
@@ -465,7 +801,7 @@ class Buffer(object):
         current text, cursor position and selection state.
         """
         return self._document_cache[
-            self.text, self.cursor_position, self.selection_state]
+            self._text_version, self.cursor_position, self.selection_state]
 
     @document.setter
     def document(self, value):
@@ -505,6 +841,11 @@ class Buffer(object):
         text_changed = self._set_text(value.text)
         cursor_position_changed = self._set_cursor_position(value.cursor_position)
 
+        # Share the cache of this document with the documents that we create
+        # for the new text.
+        if text_changed:
+            self._text_document = value
+
         # Now handle change events. (We do this when text/cursor position is
         # both set and consistent.)
         if text_changed:
@@ -514,6 +855,15 @@ class Buffer(object):
         if cursor_position_changed:
             self._cursor_position_changed()
 
+    def _replace_range(self, start, end, data, cursor_position):
+        """
+        Replace ``text[start:end]`` by `data` and set the new cursor position.
+        (The line indexes of the new document are derived from the current
+        document, rather than computed again from the whole text.)
+        """
+        self.document = self.document._replace_range(
+            start, end, data, cursor_position)
+
     @property
     def is_returnable(self):
         """
@@ -528,16 +878,18 @@ class Buffer(object):
         Safe current state (input text and cursor position), so that we can
         restore it by calling undo.
         """
+        # Within a batch edit, the state is only saved at the start.
+        if self._batch_changes is not None:
+            return
+
         # Safe if the text is different from the text at the top of the stack
         # is different. If the text is the same, just update the cursor position.
-        if self._undo_stack and self._undo_stack[-1][0] == self.text:
-            self._undo_stack[-1] = (self._undo_stack[-1][0], self.cursor_position)
-        else:
-            self._undo_stack.append((self.text, self.cursor_position))
+        # (The undo stack takes care of that.)
+        self._undo_stack.push(self.text, self.cursor_position)
 
         # Saving anything to the undo stack, clears the redo stack.
         if clear_redo_stack:
-            self._redo_stack = []
+            self._redo_stack.clear()
 
     def transform_lines(self, line_index_iterator, transform_callback):
         """
@@ -553,7 +905,9 @@ class Buffer(object):
         :param transform_callback: callable that takes the original text of a
                                    line, and return the new text for this line.
 
-        :returns: The new text.
+        :returns: The new text. (The buffer itself is not changed. Apply the
+            result within `batch_edit`, together with the new cursor
+            position, like `indent` does.)
         """
         # Split lines
         lines = self.text.split('\n')
@@ -576,10 +930,12 @@ class Buffer(object):
         document = self.document
         a = document.cursor_position + document.get_start_of_line_position()
         b = document.cursor_position + document.get_end_of_line_position()
-        self.text = (
-            document.text[:a] +
-            transform_callback(document.text[a:b]) +
-            document.text[b:])
+
+        with self.batch_edit():
+            self.text = (
+                document.text[:a] +
+                transform_callback(document.text[a:b]) +
+                document.text[b:])
 
     def transform_region(self, from_, to, transform_callback):
         """
@@ -592,11 +948,12 @@ class Buffer(object):
         """
         assert from_ < to
 
-        self.text = ''.join([
-            self.text[:from_] +
-            transform_callback(self.text[from_:to]) +
-            self.text[to:]
-        ])
+        with self.batch_edit():
+            self.text = ''.join([
+                self.text[:from_] +
+                transform_callback(self.text[from_:to]) +
+                self.text[to:]
+            ])
 
     def cursor_left(self, count=1):
         self.cursor_position += self.document.get_cursor_left_position(count=count)
@@ -665,11 +1022,11 @@ class Buffer(object):
         if self.cursor_position > 0:
             deleted = self.text[self.cursor_position - count:self.cursor_position]
 
-            new_text = self.text[:self.cursor_position - count] + self.text[self.cursor_position:]
             new_cursor_position = self.cursor_position - len(deleted)
 
             # Set new Document atomically.
-            self.document = Document(new_text, new_cursor_position)
+            self._replace_range(new_cursor_position, self.cursor_position, '',
+                                new_cursor_position)
 
         return deleted
 
@@ -679,8 +1036,9 @@ class Buffer(object):
         """
         if self.cursor_position < len(self.text):
             deleted = self.document.text_after_cursor[:count]
-            self.text = self.text[:self.cursor_position] + \
-                self.text[self.cursor_position + len(deleted):]
+            self._replace_range(self.cursor_position,
+                                self.cursor_position + len(deleted), '',
+                                self.cursor_position)
             return deleted
         else:
             return ''
@@ -691,12 +1049,13 @@ class Buffer(object):
         the current line.
         """
         if not self.document.on_last_line:
-            self.cursor_position += self.document.get_end_of_line_position()
-            self.delete()
+            with self.batch_edit():
+                self.cursor_position += self.document.get_end_of_line_position()
+                self.delete()
 
-            # Remove spaces.
-            self.text = (self.document.text_before_cursor + separator +
-                         self.document.text_after_cursor.lstrip(' '))
+                # Remove spaces.
+                self.text = (self.document.text_before_cursor + separator +
+                             self.document.text_after_cursor.lstrip(' '))
 
     def join_selected_lines(self, separator=' '):
         """
@@ -1085,10 +1444,8 @@ class Buffer(object):
             overwritten_text = otext[ocpos:ocpos + len(data)]
             if '\n' in overwritten_text:
                 overwritten_text = overwritten_text[:overwritten_text.find('\n')]
-
-            text = otext[:ocpos] + data + otext[ocpos + len(overwritten_text):]
         else:
-            text = otext[:ocpos] + data + otext[ocpos:]
+            overwritten_text = ''
 
         if move_cursor:
             cpos = self.cursor_position + len(data)
@@ -1099,21 +1456,66 @@ class Buffer(object):
         # (Set text and cursor position at the same time. Otherwise, setting
         # the text will fire a change event before the cursor position has been
         # set. It works better to have this atomic.)
-        self.document = Document(text, cpos)
+        self._replace_range(ocpos, ocpos + len(overwritten_text), data, cpos)
 
         # Fire 'on_text_insert' event.
         if fire_event:  # XXX: rename to `start_complete`.
-            self.on_text_insert.fire()
+            if self._batch_changes is not None:
+                self._batch_changes.add('insert')
+            else:
+                self._fire_text_insert()
 
-            # Only complete when "complete_while_typing" is enabled.
-            if self.completer and self.complete_while_typing():
-                ensure_future(self._async_completer())
+    def _fire_text_insert(self):
+        self.on_text_insert.fire()
 
-            # Call auto_suggest.
-            if self.auto_suggest:
-                ensure_future(self._async_suggester())
+        # Only complete when "complete_while_typing" is enabled.
+        if self.completer and self.complete_while_typing():
+            ensure_future(self._async_completer())
+
+        # Call auto_suggest.
+        if self.auto_suggest:
+            ensure_future(self._async_suggester())
+
+    @contextmanager
+    def batch_edit(self):
+        """
+        Context manager for applying many edits at once. Within the block, the
+        change events are not fired, and the asynchronous completion,
+        suggestion and validation are not started. They happen once, when the
+        block is left. The whole batch becomes one undo step. ::
+
+            with buffer.batch_edit():
+                for i in range(10):
+                    buffer.insert_text('line %i\n' % i)
+
+        Batches can be nested. The events fire when the outermost one is done.
+        """
+        if self._batch_changes is not None:
+            yield
+            return
+
+        self.save_to_undo_stack()
+        self._batch_changes = set()
+
+        try:
+            yield
+        finally:
+            changes = self._batch_changes
+            self._batch_changes = None
+
+            if 'text' in changes:
+                self._fire_text_changed()
+            if 'cursor' in changes:
+                self.on_cursor_position_changed.fire()
+            if 'insert' in changes:
+                self._fire_text_insert()
 
     def undo(self):
+        # Push the current state first, so that the last insert is grouped
+        # with the preceding ones.
+        if self._undo_stack:
+            self._undo_stack.push(self.text, self.cursor_position)
+
         # Pop from the undo-stack until we find a text that if different from
         # the current text. (The current logic of `save_to_undo_stack` will
         # cause that the top of the undo stack is usually the same as the
@@ -1123,7 +1525,7 @@ class Buffer(object):
 
             if text != self.text:
                 # Push current text to redo stack.
-                self._redo_stack.append((self.text, self.cursor_position))
+                self._redo_stack.push(self.text, self.cursor_position)
 
                 # Set new text/cursor_position.
                 self.document = Document(text, cursor_position=pos)
@@ -1191,11 +1593,17 @@ class Buffer(object):
             document = self.document
 
             if self.validator:
+                timing = start_timing('validation', self.validator)
+
                 try:
                     yield self.validator.get_validate_future(self.document)
                 except ValidationError as e:
                     error = e
 
+                if timing is not None:
+                    timing.finish(cancelled=self.document != document)
+                    timing.report()
+
                 # If the document changed during the validation, try again.
                 if self.document != document:
                     result = yield From(coroutine())
@@ -1236,61 +1644,128 @@ class Buffer(object):
         text = search_state.text
         direction = search_state.direction
         ignore_case = search_state.ignore_case()
+        index = self._history_search_index
 
-        def search_once(working_index, document):
+        def search_once(working_index, document, resume=None):
             """
             Do search one time.
-            Return (working_index, document) or `None`
+            Return (working_index, document, segment) or `None`
+
+            :param resume: The (working_index, cursor_position, segment) of the
+                previous search from the same position, for a prefix of
+                `text`. (There is no match of `text` before that one.)
             """
             if direction == SearchDirection.FORWARD:
-                # Try find at the current input.
-                new_index = document.find(
-                   text, include_current_position=include_current_position,
-                   ignore_case=ignore_case)
-
-                if new_index is not None:
-                    return (working_index,
-                            Document(document.text, document.cursor_position + new_index))
+                if resume is None or resume[2] == _SEARCH_CURRENT:
+                    # Try find at the current input. (Use the search matches of
+                    # the document, so that going to the next match doesn't
+                    # search the text again.)
+                    matches = document.get_search_matches(text, ignore_case=ignore_case)
+                    if resume is None:
+                        start = document.cursor_position + (0 if include_current_position else 1)
+                    else:
+                        start = resume[1]
+                    i = bisect.bisect_left(matches, start)
+
+                    if i < len(matches):
+                        return (working_index, document._with_cursor_position(matches[i]), _SEARCH_CURRENT)
+
+                    history_start = working_index + 1
                 else:
-                    # No match, go forward in the history. (Include len+1 to wrap around.)
-                    # (Here we should always include all cursor positions, because
-                    # it's a different line.)
-                    for i in range(working_index + 1, len(self._working_lines) + 1):
-                        i %= len(self._working_lines)
-
-                        document = Document(self._working_lines[i], 0)
-                        new_index = document.find(text, include_current_position=True,
-                                                  ignore_case=ignore_case)
-                        if new_index is not None:
-                            return (i, Document(document.text, new_index))
+                    # Continue in the history entry of the previous match.
+                    i, position, segment = resume
+                    new_index = _find(self._working_lines[i], text, position, ignore_case)
+
+                    if new_index is not None:
+                        return (i, Document(self._working_lines[i], new_index), segment)
+                    elif segment == _SEARCH_WRAPPED:
+                        return
+
+                    history_start = i + 1
+
+                # No match, go forward in the history. (Wrap around to the
+                # first entry.)
+                # (Here we should always include all cursor positions, because
+                # it's a different line.)
+                for start, end, segment in [
+                        (history_start, len(self._working_lines), _SEARCH_HISTORY),
+                        (0, 1, _SEARCH_WRAPPED)]:
+                    result = index.find(text, start, end, ignore_case)
+
+                    if result is not None:
+                        i, new_index = result
+                        return (i, Document(self._working_lines[i], new_index), segment)
             else:
-                # Try find at the current input.
-                new_index = document.find_backwards(
-                    text, ignore_case=ignore_case)
-
-                if new_index is not None:
-                    return (working_index,
-                            Document(document.text, document.cursor_position + new_index))
+                if resume is None or resume[2] == _SEARCH_CURRENT:
+                    # Try find at the current input. (The match has to end before
+                    # the cursor.)
+                    matches = document.get_search_matches(text, ignore_case=ignore_case)
+                    end = document.cursor_position - len(text)
+                    if resume is not None:
+                        end = min(end, resume[1])
+                    i = bisect.bisect_right(matches, end) - 1
+
+                    if i >= 0:
+                        return (working_index, document._with_cursor_position(matches[i]), _SEARCH_CURRENT)
+
+                    history_end = working_index
                 else:
-                    # No match, go back in the history. (Include -1 to wrap around.)
-                    for i in range(working_index - 1, -2, -1):
-                        i %= len(self._working_lines)
-
-                        document = Document(self._working_lines[i], len(self._working_lines[i]))
-                        new_index = document.find_backwards(
-                            text, ignore_case=ignore_case)
-                        if new_index is not None:
-                            return (i, Document(document.text, len(document.text) + new_index))
+                    # Continue in the history entry of the previous match.
+                    i, position, segment = resume
+                    new_index = _find_backwards(
+                        self._working_lines[i], text, position + len(text), ignore_case)
+
+                    if new_index is not None:
+                        return (i, Document(self._working_lines[i], new_index), segment)
+                    elif segment == _SEARCH_WRAPPED:
+                        return
+
+                    history_end = i
+
+                # No match, go back in the history. (Wrap around to the
+                # last entry.)
+                last = len(self._working_lines) - 1
+
+                for start, end, segment in [
+                        (0, history_end, _SEARCH_HISTORY),
+                        (last, last + 1, _SEARCH_WRAPPED)]:
+                    result = index.find_backwards(text, start, end, ignore_case)
+
+                    if result is not None:
+                        i, new_index = result
+                        return (i, Document(self._working_lines[i], new_index), segment)
+
+        # During an incremental search, the query grows one character at a
+        # time, while searching from the same position. The matches of the
+        # new query are a subset of the matches of the previous query, so we
+        # can continue from the previous match.
+        origin = (self.working_index, self.cursor_position, direction,
+                  ignore_case, include_current_position, index)
+        resume = None
+
+        if count == 1 and self._last_search is not None:
+            last_origin, last_text, last_input, last_result = self._last_search
+
+            if (last_origin == origin and last_input is self.text and
+                    text.startswith(last_text)):
+                if last_result is None:
+                    return  # The prefix was not found either.
+                resume = last_result
 
         # Do 'count' search iterations.
         working_index = self.working_index
         document = self.document
         for _ in range(count):
-            result = search_once(working_index, document)
+            result = search_once(working_index, document, resume)
+
+            if count == 1:
+                self._last_search = (origin, text, self.text, result and (
+                    result[0], result[1].cursor_position, result[2]))
+
             if result is None:
                 return  # Nothing found.
             else:
-                working_index, document = result
+                working_index, document, _ = result
 
         return (working_index, document.cursor_position)
 
@@ -1311,12 +1786,10 @@ class Buffer(object):
 
             # Keep selection, when `working_index` was not changed.
             if working_index == self.working_index:
-                selection = self.selection_state
+                return self.document._with_cursor_position(
+                    cursor_position, self.selection_state)
             else:
-                selection = None
-
-            return Document(self._working_lines[working_index],
-                            cursor_position, selection=selection)
+                return Document(self._working_lines[working_index], cursor_position)
 
     def get_search_position(self, search_state, include_current_position=True, count=1):
         """
@@ -1468,34 +1941,120 @@ class Buffer(object):
         @_only_one_at_a_time
         def async_completer(select_first=False, select_last=False,
                             insert_common_part=False, complete_event=None):
-            document = self.document
-            complete_event = complete_event or CompleteEvent(text_inserted=True)
-
             # Don't complete when we already have completions.
             if self.complete_state or not self.completer:
                 return
 
+            timing = start_timing('completion', self.completer)
+
+            try:
+                yield From(complete(
+                    timing, select_first=select_first, select_last=select_last,
+                    insert_common_part=insert_common_part,
+                    complete_event=complete_event))
+            except _Retry:
+                if timing is not None:
+                    timing.retried = True
+                raise
+            finally:
+                if timing is not None:
+                    timing.finish()
+                    timing.report()
+
+        def complete(timing, select_first=False, select_last=False,
+                     insert_common_part=False, complete_event=None):
+            document = self.document
+            complete_event = complete_event or CompleteEvent(text_inserted=True)
+
             # Create an empty CompletionState.
             complete_state = CompletionState(original_document=self.document)
             self.complete_state = complete_state
 
+            # Every request gets its own event, which is cancelled as soon as
+            # the request is superseded. (The given event could be cancelled
+            # already, when we retry.)
+            complete_event = CompleteEvent(
+                text_inserted=complete_event.text_inserted,
+                completion_requested=complete_event.completion_requested)
+            self._complete_event = complete_event
+
             def proceed():
                 """ Keep retrieving completions. Input text has not yet changed
                 while generating completions. """
                 return self.complete_state == complete_state
 
+            # The `on_completions_changed` event is fired once for a batch of
+            # completions: when the event loop has nothing else to do, or at
+            # the latest at the deadline of the batch.
+            batch_scheduled = [False]
+            first_batch_deadline = time.time() + self.completion_first_batch_time
+
+            def fire_batch():
+                " Fire the event for the completions received so far. "
+                if batch_scheduled[0]:
+                    batch_scheduled[0] = False
+                    if proceed():
+                        self.on_completions_changed.fire()
+
             def add_completion(completion):
                 " Got one completion from the asynchronous completion generator. "
                 complete_state.completions.append(completion)
-                self.on_completions_changed.fire()
 
-            yield From(consume_async_generator(
-                self.completer.get_completions_async(document, complete_event),
-                item_callback=add_completion,
-                cancel=lambda: not proceed()))
+                if timing is not None:
+                    timing.add_item()
+
+                if not batch_scheduled[0]:
+                    batch_scheduled[0] = True
+
+                    if len(complete_state.completions) == 1:
+                        deadline = first_batch_deadline
+                    else:
+                        deadline = time.time() + self.completion_batch_interval
+
+                    call_from_executor(fire_batch, _max_postpone_until=deadline)
+
+            # While typing, the completer can narrow down the previous
+            # completions, instead of computing them again.
+            # (Resolved once, a `DynamicCompleter` can return another
+            # completer every time.)
+            narrowing_completer = self.completer.get_narrowing_completer()
+
+            narrowed_completions = None
+            if complete_event.text_inserted and narrowing_completer is not None:
+                narrowed_completions = self._narrow_completions(
+                    narrowing_completer, document)
+
+            if narrowed_completions is None:
+                try:
+                    yield From(consume_async_generator(
+                        self.completer.get_completions_async(document, complete_event),
+                        item_callback=add_completion,
+                        cancel=lambda: not proceed()))
+                finally:
+                    if self._complete_event is complete_event:
+                        self._complete_event = None
+
+                if timing is not None:
+                    timing.cancelled = not proceed()
+
+                # Deliver the last batch.
+                fire_batch()
+            else:
+                complete_state.completions.extend(narrowed_completions)
+
+                if timing is not None:
+                    timing.add_item(len(narrowed_completions))
+                self.on_completions_changed.fire()
 
             completions = complete_state.completions
 
+            if proceed():
+                if narrowing_completer is not None:
+                    self._previous_completions = (
+                        narrowing_completer, document, list(completions))
+                else:
+                    self._previous_completions = None
+
             # When there is only one completion, which has nothing to add, ignore it.
             if (len(completions) == 1 and
                     completion_does_nothing(document, completions[0])):
@@ -1564,6 +2123,25 @@ class Buffer(object):
 
         return async_completer
 
+    def _narrow_completions(self, narrowing_completer, document):
+        """
+        Return the completions for `document`, narrowed down from the previous
+        completions by `narrowing_completer`, or `None`. (When the previous
+        completions came from the same completer, and the previous text
+        before the cursor was extended.)
+        """
+        if self._previous_completions is None:
+            return None
+
+        completer, previous_document, completions = self._previous_completions
+
+        if (completer is narrowing_completer and
+                document.cursor_position > previous_document.cursor_position and
+                document.text_after_cursor == previous_document.text_after_cursor and
+                document.text_before_cursor.startswith(previous_document.text_before_cursor)):
+            return narrowing_completer.narrow_completions(
+                document, previous_document, completions)
+
     def _create_auto_suggest_coroutine(self):
         """
         Create function for asynchronous auto suggestion.
@@ -1577,16 +2155,29 @@ class Buffer(object):
             if self.suggestion or not self.auto_suggest:
                 return
 
+            timing = start_timing('auto_suggest', self.auto_suggest)
+
             suggestion = yield From(self.auto_suggest.get_suggestion_future(
                     self, document))
 
+            if timing is not None:
+                if suggestion:
+                    timing.add_item()
+                timing.finish(cancelled=self.document != document)
+
             # Set suggestion only if the text was not yet changed.
             if self.document == document:
+                if timing is not None:
+                    timing.report()
+
                 # Set suggestion and redraw interface.
                 self.suggestion = suggestion
                 self.on_suggestion_set.fire()
             else:
                 # Otherwise, restart thread.
+                if timing is not None:
+                    timing.retried = True
+                    timing.report()
                 raise _Retry
         return async_suggestor
 
@@ -1657,12 +2248,14 @@ def indent(buffer, from_row, to_row, count=1):
 
     # Apply transformation.
     new_text = buffer.transform_lines(line_range, lambda l: '    ' * count + l)
-    buffer.document = Document(
-        new_text,
-        Document(new_text).translate_row_col_to_index(current_row, 0))
 
-    # Go to the start of the line.
-    buffer.cursor_position += buffer.document.get_start_of_line_position(after_whitespace=True)
+    with buffer.batch_edit():
+        buffer.document = Document(
+            new_text,
+            Document(new_text).translate_row_col_to_index(current_row, 0))
+
+        # Go to the start of the line.
+        buffer.cursor_position += buffer.document.get_start_of_line_position(after_whitespace=True)
 
 
 def unindent(buffer, from_row, to_row, count=1):
@@ -1681,12 +2274,14 @@ def unindent(buffer, from_row, to_row, count=1):
 
     # Apply transformation.
     new_text = buffer.transform_lines(line_range, transform)
-    buffer.document = Document(
-        new_text,
-        Document(new_text).translate_row_col_to_index(current_row, 0))
 
-    # Go to the start of the line.
-    buffer.cursor_position += buffer.document.get_start_of_line_position(after_whitespace=True)
+    with buffer.batch_edit():
+        buffer.document = Document(
+            new_text,
+            Document(new_text).translate_row_col_to_index(current_row, 0))
+
+        # Go to the start of the line.
+        buffer.cursor_position += buffer.document.get_start_of_line_position(after_whitespace=True)
 
 
 def reshape_text(buffer, from_row, to_row):
@@ -1729,6 +2324,7 @@ def reshape_text(buffer, from_row, to_row):
             reshaped_text.append('\n')
 
         # Apply result.
-        buffer.document = Document(
-            text=''.join(lines_before + reshaped_text + lines_after),
-            cursor_position=len(''.join(lines_before + reshaped_text)))
+        with buffer.batch_edit():
+            buffer.document = Document(
+                text=''.join(lines_before + reshaped_text + lines_after),
+                cursor_position=len(''.join(lines_before + reshaped_text)))
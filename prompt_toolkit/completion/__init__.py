@@ -1,6 +1,8 @@
 from __future__ import unicode_literals
 from .base import Completion, Completer, ThreadedCompleter, DummyCompleter, DynamicCompleter, CompleteEvent, merge_completers, get_common_complete_suffix
 from .filesystem import PathCompleter, ExecutableCompleter
+from .fuzzy_completer import FuzzyCompleter
+from .process_pool import ProcessPoolCompleter, CompleterProcessError
 from .word_completer import WordCompleter
 
 __all__ = [
@@ -20,4 +22,11 @@ __all__ = [
 
     # Word completer.
     'WordCompleter',
+
+    # Fuzzy completer.
+    'FuzzyCompleter',
+
+    # Process pool completer.
+    'ProcessPoolCompleter',
+    'CompleterProcessError',
 ]
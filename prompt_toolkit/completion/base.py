@@ -1,9 +1,13 @@
 """
 """
 from __future__ import unicode_literals
-from prompt_toolkit.eventloop import generator_to_async_generator, AsyncGeneratorItem
+from prompt_toolkit.eventloop import generator_to_async_generator, AsyncGeneratorItem, Future, From, ensure_future, consume_async_generator, call_from_executor
+from prompt_toolkit.eventloop.utils import WorkerPool, call_later
+from prompt_toolkit.metrics import start_timing, timed_iterable
 from abc import ABCMeta, abstractmethod
-from six import with_metaclass, text_type
+from itertools import islice
+from six import with_metaclass, text_type, get_unbound_function
+import time
 
 __all__ = [
     'Completion',
@@ -23,8 +27,9 @@ class Completion(object):
     :param start_position: Position relative to the cursor_position where the
         new text will start. The text will be inserted between the
         start_position and the original cursor position.
-    :param display: (optional string) If the completion has to be displayed
-        differently in the completion menu.
+    :param display: (optional string or formatted text) If the completion has
+        to be displayed differently in the completion menu. (For formatted
+        text, the `display` attribute is the text without the styling.)
     :param display_meta: (Optional string) Meta information about the
         completion, e.g. the path or source where it's coming from.
         This can also be a callable that returns a string.
@@ -36,7 +41,6 @@ class Completion(object):
                  style='', selected_style=''):
         assert isinstance(text, text_type)
         assert isinstance(start_position, int)
-        assert display is None or isinstance(display, text_type)
         assert display_meta is None or isinstance(display_meta, text_type)
         assert isinstance(style, text_type)
         assert isinstance(selected_style, text_type)
@@ -47,8 +51,15 @@ class Completion(object):
 
         if display is None:
             self.display = text
-        else:
+            self._display_fragments = None
+        elif isinstance(display, text_type):
             self.display = display
+            self._display_fragments = None
+        else:
+            # (Imported here, because of circular imports.)
+            from prompt_toolkit.formatted_text import to_formatted_text, fragment_list_to_text
+            self._display_fragments = to_formatted_text(display)
+            self.display = fragment_list_to_text(self._display_fragments)
 
         self.style = style
         self.selected_style = selected_style
@@ -87,6 +98,13 @@ class Completion(object):
 
         return meta
 
+    @property
+    def display_fragments(self):
+        " The `display` text as a list of (style, text) tuples. "
+        if self._display_fragments is None:
+            return [('', self.display)]
+        return self._display_fragments
+
     def new_completion_from_position(self, position):
         """
         (Only for internal use!)
@@ -98,7 +116,7 @@ class Completion(object):
 
         return Completion(
             text=self.text[position - self.start_position:],
-            display=self.display,
+            display=self._display_fragments or self.display,
             display_meta=self._display_meta)
 
 
@@ -115,6 +133,10 @@ class CompleteEvent(object):
     shows some completions when ``Tab`` has been pressed, but not
     automatically when the user presses a space. (Because of
     `complete_while_typing`.)
+
+    The event is cancelled when the completions are not needed anymore,
+    because the input changed. A completer that takes a lot of time can poll
+    `cancelled` and stop early.
     """
     def __init__(self, text_inserted=False, completion_requested=False):
         assert not (text_inserted and completion_requested)
@@ -125,6 +147,17 @@ class CompleteEvent(object):
         #: Used explicitly requested completion by pressing 'tab'.
         self.completion_requested = completion_requested
 
+        self._cancelled = False
+
+    @property
+    def cancelled(self):
+        " True when the completions for this event are not needed anymore. "
+        return self._cancelled
+
+    def cancel(self):
+        " Tell the completer to stop. (This can be called from any thread.) "
+        self._cancelled = True
+
     def __repr__(self):
         return '%s(text_inserted=%r, completion_requested=%r)' % (
             self.__class__.__name__, self.text_inserted, self.completion_requested)
@@ -167,6 +200,39 @@ class Completer(with_metaclass(ABCMeta, object)):
             assert isinstance(item, Completion)
             yield AsyncGeneratorItem(item)
 
+    def narrow_completions(self, document, previous_document, completions):
+        """
+        Return the completions for `document`, computed from the
+        `completions` for `previous_document`, or `None` when they have to be
+        retrieved again. (By default, this returns `None`.)
+
+        This is called while typing: the text before the cursor of `document`
+        extends the one of `previous_document`, and the text after the cursor
+        is the same. A completer for which typing can only remove completions
+        can override this, to filter the previous completions instead of
+        computing them again.
+
+        :param document: :class:`~prompt_toolkit.document.Document` instance.
+        :param previous_document: The previous
+            :class:`~prompt_toolkit.document.Document`.
+        :param completions: List of :class:`.Completion` instances for
+            `previous_document`.
+        """
+        return None
+
+    def get_narrowing_completer(self):
+        """
+        Return the completer of which `narrow_completions` is used for this
+        completer, or `None` when it doesn't narrow down completions. (The
+        buffer only keeps the previous completions in that case.)
+
+        This is `self` when `narrow_completions` is overridden. Wrappers
+        return the completer that they wrap.
+        """
+        if (get_unbound_function(type(self).narrow_completions) is not
+                get_unbound_function(Completer.narrow_completions)):
+            return self
+
 
 class ThreadedCompleter(Completer):
     """
@@ -177,11 +243,33 @@ class ThreadedCompleter(Completer):
 
     The completions will be displayed as soon as they are produced. The user
     can already select a completion, even if not all completions are displayed.
+
+    The threaded completers share a small pool of worker threads, unless
+    `max_workers` is given. When the input changes, the `CompleteEvent` is
+    cancelled and the thread stops before the next completion. A completer
+    that takes a lot of time for one completion has to poll
+    `complete_event.cancelled` itself. Otherwise, it keeps a worker thread
+    busy, and the completions for the new input wait for it when all the
+    threads are busy.
+
+    :param completer: A :class:`~.Completer` instance.
+    :param max_workers: When given, use a pool of this many threads for this
+        completer only. (For a slow completer that shouldn't hold up the
+        others.)
     """
-    def __init__(self, completer=None):
+    _shared_workers = WorkerPool(max_workers=4)
+
+    def __init__(self, completer=None, max_workers=None):
         assert isinstance(completer, Completer), 'Got %r' % (completer, )
+        assert max_workers is None or (isinstance(max_workers, int) and max_workers > 0)
+
         self.completer = completer
 
+        if max_workers is None:
+            self._workers = self._shared_workers
+        else:
+            self._workers = WorkerPool(max_workers=max_workers)
+
     def get_completions(self, document, complete_event):
         return self.completer.get_completions(document, complete_event)
 
@@ -190,13 +278,60 @@ class ThreadedCompleter(Completer):
         Asynchronous generator of completions.
         This yields both Future and Completion objects.
         """
+        def get_completions():
+            if complete_event.cancelled:
+                return
+
+            for completion in self.completer.get_completions(document, complete_event):
+                if complete_event.cancelled:
+                    return
+                yield completion
+
+        timing = start_timing('completer', self.completer)
+
+        if timing is None:
+            return generator_to_async_generator(get_completions, executor=self._workers)
+
+        created = [False]
+
+        def get_iterable():
+            created[0] = True
+            return timed_iterable(timing, get_completions(),
+                                  cancelled=lambda: complete_event.cancelled)
+
+        def run_in_executor(runner):
+            def run():
+                try:
+                    runner()
+                finally:
+                    # When the request was cancelled before it got a thread,
+                    # the completer wasn't called. Report that too.
+                    if not created[0]:
+                        timing.finish(cancelled=True)
+                        call_from_executor(timing.report)
+
+            return self._workers.run_in_executor(run)
+
         return generator_to_async_generator(
-            lambda: self.completer.get_completions(document, complete_event))
+            get_iterable, executor=_Executor(run_in_executor))
+
+    def narrow_completions(self, document, previous_document, completions):
+        return self.completer.narrow_completions(
+            document, previous_document, completions)
+
+    def get_narrowing_completer(self):
+        return self.completer.get_narrowing_completer()
 
     def __repr__(self):
         return 'ThreadedCompleter(%r)' % (self.completer, )
 
 
+class _Executor(object):
+    " Object with the given `run_in_executor` function. "
+    def __init__(self, run_in_executor):
+        self.run_in_executor = run_in_executor
+
+
 class DummyCompleter(Completer):
     """
     A completer that doesn't return any completion.
@@ -226,6 +361,15 @@ class DynamicCompleter(Completer):
         completer = self.get_completer() or DummyCompleter()
         return completer.get_completions_async(document, complete_event)
 
+    def narrow_completions(self, document, previous_document, completions):
+        completer = self.get_completer() or DummyCompleter()
+        return completer.narrow_completions(
+            document, previous_document, completions)
+
+    def get_narrowing_completer(self):
+        completer = self.get_completer() or DummyCompleter()
+        return completer.get_narrowing_completer()
+
     def __repr__(self):
         return 'DynamicCompleter(%r -> %r)' % (
             self.get_completer, self.get_completer())
@@ -235,30 +379,139 @@ class _MergedCompleter(Completer):
     """
     Combine several completers into one.
     """
-    def __init__(self, completers):
+    def __init__(self, completers, max_results=None, timeout=None):
         assert all(isinstance(c, Completer) for c in completers)
+        assert max_results is None or (isinstance(max_results, int) and max_results > 0)
+        assert timeout is None or isinstance(timeout, (int, float))
+
         self.completers = completers
+        self.max_results = max_results
+        self.timeout = timeout
 
     def get_completions(self, document, complete_event):
         # Get all completions from the other completers in a blocking way.
-        for completer in self.completers:
-            for c in completer.get_completions(document, complete_event):
-                yield c
-
-    def get_completions_async(self, document, complete_event):
-        # Get all completions from the other completers in a blocking way.
-        for completer in self.completers:
-            # Consume async generator -> item can be `AsyncGeneratorItem` or
-            # `Future`.
-            for item in completer.get_completions_async(document, complete_event):
-                yield item
+        completions = (c for completer in self.completers
+                       for c in completer.get_completions(document, complete_event))
 
+        for c in islice(completions, self.max_results):
+            yield c
 
-def merge_completers(completers):
+    def get_completions_async(self, document, complete_event):
+        # Consume the async generators of all completers at the same time.
+        # The completions that are received from every completer are kept
+        # until they are yielded.
+        count = len(self.completers)
+        received = [[] for _ in range(count)]
+        done = [False] * count
+        waiting = [None]  # The `Future` that we are waiting for.
+        quitting = [False]
+
+        def wake_up():
+            if waiting[0] is not None and not waiting[0].done():
+                waiting[0].set_result(None)
+
+        def consume(i, completer):
+            timing = start_timing('completer', completer)
+
+            def add_completion(completion):
+                received[i].append(completion)
+                if timing is not None:
+                    timing.add_item()
+                wake_up()
+
+            def completer_done(_):
+                if timing is not None:
+                    # (When it's done already, it was stopped.)
+                    timing.finish(cancelled=quitting[0] or done[i])
+                    timing.report()
+
+                done[i] = True
+                wake_up()
+
+            f = ensure_future(consume_async_generator(
+                completer.get_completions_async(document, complete_event),
+                cancel=lambda: quitting[0] or done[i],
+                item_callback=add_completion))
+            f.add_done_callback(completer_done)
+            return f
+
+        tasks = [consume(i, c) for i, c in enumerate(self.completers)]
+
+        if self.timeout is not None:
+            deadline = time.time() + self.timeout
+            call_later(self.timeout, wake_up)
+        else:
+            deadline = None
+
+        max_results = self.max_results
+        yielded = 0
+        current = 0  # The completer of which the completions are yielded.
+
+        try:
+            while True:
+                if deadline is not None and time.time() >= deadline:
+                    # Completers that are still running stop at their next
+                    # completion. (Those are ignored.)
+                    done[:] = [True] * count
+
+                for task in tasks:
+                    if task.done() and task.exception():
+                        raise task.exception()
+
+                if max_results is None:
+                    # Yield the completions as they arrive.
+                    for completions in received:
+                        for c in completions:
+                            yield AsyncGeneratorItem(c)
+                        del completions[:]
+
+                    if all(done):
+                        break
+                else:
+                    # Yield the completions in the order of the completers,
+                    # until we have `max_results`. (The completions of a
+                    # completer wait until the ones before it are done.)
+                    while current < count and yielded < max_results:
+                        completions = received[current]
+                        for c in completions[:max_results - yielded]:
+                            yield AsyncGeneratorItem(c)
+                            yielded += 1
+                        del completions[:]
+
+                        if not done[current]:
+                            break
+                        current += 1
+
+                    if current == count or yielded >= max_results:
+                        break
+
+                # Wait for more completions.
+                waiting[0] = Future()
+                yield From(waiting[0])
+        finally:
+            quitting[0] = True
+
+
+def merge_completers(completers, max_results=None, timeout=None):
     """
     Combine several completers into one.
+
+    The completers run at the same time, and the completions are displayed as
+    they arrive. (For this, the completers have to run in the background, like
+    a :class:`.ThreadedCompleter`.)
+
+    :param max_results: When given, return at most this many completions. The
+        completions of the first completers rank first. So, in this mode the
+        completions don't arrive as fast as the fastest completer: the
+        completions of a completer are held back until all the completers
+        before it are done (or stopped by the `timeout`).
+    :param timeout: When given, stop the completers that are not done after
+        this many seconds. Their completions so far are kept. This is one
+        deadline for the whole merge, not a separate one for every completer.
+        (Because they all start at the same time, every completer gets the
+        same time.)
     """
-    return _MergedCompleter(completers)
+    return _MergedCompleter(completers, max_results=max_results, timeout=timeout)
 
 
 def get_common_complete_suffix(document, completions):
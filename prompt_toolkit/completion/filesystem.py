@@ -1,7 +1,17 @@
 from __future__ import unicode_literals
 
+from bisect import bisect_left
+from collections import deque
 from prompt_toolkit.completion import Completer, Completion
 import os
+import stat
+import threading
+import time
+
+try:
+    from os import scandir as _scandir
+except ImportError:
+    _scandir = None  # Python 2.
 
 __all__ = [
     'PathCompleter',
@@ -19,9 +29,14 @@ class PathCompleter(Completer):
                         this file should show up in the completion. ``None``
                         when no filtering has to be done.
     :param min_input_len: Don't do autocompletion when the input string is shorter.
+    :param prefetch: When True, read the directories of `get_paths` in a
+                     background thread, so that the first completion is fast.
+
+    The directory listings are cached (and shared by all path completers), and
+    read again when the modification time of the directory changes.
     """
     def __init__(self, only_directories=False, get_paths=None, file_filter=None,
-                 min_input_len=0, expanduser=False):
+                 min_input_len=0, expanduser=False, prefetch=False):
         assert get_paths is None or callable(get_paths)
         assert file_filter is None or callable(file_filter)
         assert isinstance(min_input_len, int)
@@ -33,6 +48,9 @@ class PathCompleter(Completer):
         self.min_input_len = min_input_len
         self.expanduser = expanduser
 
+        if prefetch:
+            _directory_cache.prefetch(self.get_paths())
+
     def get_completions(self, document, complete_event):
         text = document.text_before_cursor
 
@@ -62,20 +80,21 @@ class PathCompleter(Completer):
             filenames = []
             for directory in directories:
                 # Look for matches in this directory.
-                if os.path.isdir(directory):
-                    for filename in os.listdir(directory):
-                        if filename.startswith(prefix):
-                            filenames.append((directory, filename))
+                listing = self._get_listing(directory)
+                if listing is not None:
+                    for i in self._find_prefix(listing, prefix):
+                        filenames.append((listing.names[i], directory, listing, i))
 
-            # Sort
-            filenames = sorted(filenames, key=lambda k: k[1])
+            # Sort. (Only needed for more than one directory, the listings are
+            # sorted already.)
+            filenames.sort(key=lambda k: k[0])
 
             # Yield them.
-            for directory, filename in filenames:
+            for filename, directory, listing, i in filenames:
                 completion = filename[len(prefix):]
                 full_name = os.path.join(directory, filename)
 
-                if os.path.isdir(full_name):
+                if listing.get_is_dir(i):
                     # For directories, add a slash to the filename.
                     # (We don't add them to the `completion`. Users can type it
                     # to trigger the autocompletion themselves.)
@@ -90,16 +109,229 @@ class PathCompleter(Completer):
         except OSError:
             pass
 
+    def _get_listing(self, directory):
+        " Return the `_DirectoryListing` in which we look for matches. "
+        return _directory_cache.get_listing(directory)
+
+    def _find_prefix(self, listing, prefix):
+        " Yield the positions of the matching names in `listing`. "
+        return listing.find_prefix(prefix)
+
 
 class ExecutableCompleter(PathCompleter):
     """
     Complete only executable files in the current path.
+
+    The executables in the directories of the path are indexed in a background
+    thread when the completer is created. (Until then, only the names that
+    match are checked.) A directory is indexed again when its modification
+    time changes. (Changing the permissions of a file doesn't change it.)
+
+    The index is shared by all executable completers, and kept apart from the
+    directory listings of the :class:`.PathCompleter`, so that browsing other
+    directories doesn't push it out of the cache.
+
+    :param prefetch: When False, don't index the path in the background.
     """
-    def __init__(self):
+    def __init__(self, prefetch=True):
         PathCompleter.__init__(
             self,
             only_directories=False,
             min_input_len=1,
             get_paths=lambda: os.environ.get('PATH', '').split(os.pathsep),
-            file_filter=lambda name: os.access(name, os.X_OK),
-            expanduser=True),
+            expanduser=True)
+
+        if prefetch:
+            _executable_cache.prefetch(self.get_paths(), executables=True)
+
+    def _get_listing(self, directory):
+        return _executable_cache.get_listing(directory)
+
+    def _find_prefix(self, listing, prefix):
+        for i in listing.find_prefix(prefix):
+            if listing.is_executable(i):
+                yield i
+
+
+class _DirectoryListing(object):
+    """
+    The sorted names in a directory, and whether they are directories.
+
+    (With `os.scandir`, the file types come with the names, without calling
+    `stat` for every file. Otherwise, `is_dir` is `None` until it's looked up
+    for a name that is completed.)
+    """
+    def __init__(self, directory, names, is_dir):
+        self.directory = directory
+        self.names = names
+        self.is_dir = is_dir
+
+        # Whether we have execute permission for the names. (`None` when it's
+        # not known yet.)
+        self._executable = [None] * len(names)
+
+    @classmethod
+    def read(cls, directory):
+        " Read the listing of `directory`. "
+        entries = []
+
+        if _scandir is not None:
+            for entry in _scandir(directory):
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                entries.append((entry.name, is_dir))
+        else:
+            for name in os.listdir(directory):
+                entries.append((name, None))
+
+        entries.sort()
+        return cls(directory,
+                   [name for name, is_dir in entries],
+                   [is_dir for name, is_dir in entries])
+
+    def is_executable(self, i):
+        """
+        True when we have execute permission for the name at position `i`.
+        (This is checked once.)
+        """
+        executable = self._executable[i]
+
+        if executable is None:
+            executable = os.access(os.path.join(self.directory, self.names[i]), os.X_OK)
+            self._executable[i] = executable
+
+        return executable
+
+    def index_executables(self):
+        " Check the execute permission of all names. "
+        for i in range(len(self.names)):
+            self.is_executable(i)
+
+    def get_is_dir(self, i):
+        """
+        True when the name at position `i` is a directory. (Look it up when
+        it's not known yet.)
+        """
+        is_dir = self.is_dir[i]
+
+        if is_dir is None:
+            is_dir = os.path.isdir(os.path.join(self.directory, self.names[i]))
+            self.is_dir[i] = is_dir
+
+        return is_dir
+
+    def find_prefix(self, prefix):
+        """
+        Yield the positions of the names that start with `prefix`, sorted by
+        name.
+        """
+        names = self.names
+        i = bisect_left(names, prefix)
+
+        while i < len(names) and names[i].startswith(prefix):
+            yield i
+            i += 1
+
+
+class _DirectoryCache(object):
+    """
+    Cache of directory listings. A listing is used again, as long as the
+    modification time of the directory didn't change.
+
+    (A directory that has been modified shortly before it was read is read
+    again. The modification time has a limited resolution, so another change
+    in that time would go unnoticed.)
+
+    :param maxsize: Maximum number of directories in the cache.
+    """
+    resolution = 2  # Seconds.
+
+    def __init__(self, maxsize=64):
+        assert isinstance(maxsize, int) and maxsize > 0
+
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._data = {}  # Maps path to (stat key, time of reading, listing).
+        self._keys = deque()
+        self._prefetching = set()  # Paths that are read in the background.
+
+    def get_listing(self, directory):
+        """
+        Return the `_DirectoryListing` for `directory`, or `None` when it's
+        not a directory.
+        """
+        try:
+            st = os.stat(directory)
+        except OSError:
+            return None
+
+        path = os.path.abspath(directory)
+
+        if not stat.S_ISDIR(st.st_mode):
+            return None
+
+        key = (st.st_mtime, st.st_ino, st.st_dev)
+
+        with self._lock:
+            cached = self._data.get(path)
+
+        if cached is not None and cached[0] == key and cached[1] - st.st_mtime > self.resolution:
+            return cached[2]
+
+        read_time = time.time()
+        listing = _DirectoryListing.read(path)
+
+        with self._lock:
+            if path not in self._data:
+                self._keys.append(path)
+            self._data[path] = (key, read_time, listing)
+
+            # Remove the oldest directory when the size is exceeded.
+            if len(self._data) > self.maxsize:
+                del self._data[self._keys.popleft()]
+
+        return listing
+
+    def prefetch(self, directories, executables=False):
+        """
+        Read these directories in a background thread. Directories that are
+        in the cache already, or that are being read, are skipped. Return the
+        thread, or `None` when there is nothing to read.
+
+        :param executables: When True, also find the executables.
+        """
+        with self._lock:
+            paths = []
+            for directory in directories:
+                path = os.path.abspath(directory)
+                if (path not in self._data and path not in self._prefetching and
+                        path not in paths):
+                    paths.append(path)
+
+            self._prefetching.update(paths)
+
+        if not paths:
+            return None
+
+        def run():
+            for path in paths:
+                try:
+                    listing = self.get_listing(path)
+                    if listing is not None and executables:
+                        listing.index_executables()
+                except OSError:
+                    pass
+                finally:
+                    with self._lock:
+                        self._prefetching.discard(path)
+
+        t = threading.Thread(target=run)
+        t.daemon = True
+        t.start()
+        return t
+
+
+_directory_cache = _DirectoryCache()
+_executable_cache = _DirectoryCache()
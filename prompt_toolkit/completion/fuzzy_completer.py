@@ -0,0 +1,199 @@
+from __future__ import unicode_literals
+
+from bisect import bisect_right
+from prompt_toolkit.document import Document
+
+from .base import Completer, Completion
+from .word_completer import WordCompleter
+
+import heapq
+import re
+
+__all__ = [
+    'FuzzyCompleter',
+]
+
+
+class FuzzyCompleter(Completer):
+    """
+    Fuzzy completion.
+    This wraps any other completer and turns it into a fuzzy completer.
+
+    If the list of words is: ["leopard" , "gorilla", "dinosaur", "cat", "bee"]
+    Then trying to complete "oar" would yield "leopard" and "dinosaur", but not
+    the others, because they match the regular expression 'o.*a.*r'.
+
+    The completions are ranked by how well they match: a match that spans
+    fewer characters comes first, and for an equal length, the match that
+    starts first. Only the best `max_results` completions are returned. The
+    matched characters are highlighted in the completion menu.
+
+    The completions of a :class:`.WordCompleter` with a list of words are
+    kept between keystrokes, because they don't change while typing a word.
+
+    :param completer: A :class:`~.Completer` instance.
+    :param WORD: When True, use WORD characters.
+    :param max_results: The maximum number of completions.
+    """
+    def __init__(self, completer, WORD=False, max_results=1000):
+        assert isinstance(completer, Completer)
+        assert isinstance(max_results, int) and max_results > 0
+
+        self.completer = completer
+        self.WORD = WORD
+        self.max_results = max_results
+
+        self._candidates = None  # (key, word index, _Candidates)
+
+    def get_completions(self, document, complete_event):
+        word_before_cursor = document.get_word_before_cursor(WORD=self.WORD)
+
+        # Get the completions of the wrapped completer, for the text without
+        # the word before the cursor. These are filtered by the word.
+        document2 = Document(
+            text=document.text[:document.cursor_position - len(word_before_cursor)],
+            cursor_position=document.cursor_position - len(word_before_cursor))
+
+        candidates = self._get_candidates(document2, complete_event)
+        completions = candidates.completions
+
+        if not word_before_cursor:
+            for completion in completions[:self.max_results]:
+                yield completion
+            return
+
+        matches = candidates.find_best_matches(word_before_cursor, self.max_results)
+
+        for length, start, i in matches:
+            completion = completions[i]
+
+            # Highlight the match, if the completion displays its text.
+            if completion.display == completion.text:
+                display = _get_display(completion.text, start, length, word_before_cursor)
+            else:
+                display = completion.display_fragments
+
+            yield Completion(
+                completion.text,
+                start_position=completion.start_position - len(word_before_cursor),
+                display=display,
+                display_meta=completion._display_meta,
+                style=completion.style,
+                selected_style=completion.selected_style)
+
+    def _get_candidates(self, document, complete_event):
+        """
+        Return the completions of the wrapped completer as `_Candidates`.
+        """
+        completer = self.completer
+
+        if isinstance(completer, WordCompleter) and not callable(completer.words):
+            # The index of the word completer is built again when the words
+            # change, also when the list is changed in place.
+            index = completer._get_index(completer.words)
+            key = (document.text, document.cursor_position)
+
+            if (index is not None and self._candidates is not None and
+                    self._candidates[0] == key and self._candidates[1] is index):
+                return self._candidates[2]
+
+            candidates = _Candidates(list(completer.get_completions(document, complete_event)))
+            self._candidates = (key, index, candidates)
+            return candidates
+
+        return _Candidates(list(completer.get_completions(document, complete_event)))
+
+
+class _Candidates(object):
+    """
+    The completions that are matched against the word before the cursor.
+
+    The texts of all completions are joined into one string, so that finding
+    the completions that match takes one regular expression search for every
+    match, rather than a search in every single completion.
+    """
+    separator = '\x00'
+
+    def __init__(self, completions):
+        self.completions = completions
+        self._joined = None  # (Joined texts, start of every text.)
+
+    def _get_joined(self):
+        if self._joined is None:
+            texts = [c.text for c in self.completions]
+            starts = [0]
+            for text in texts:
+                starts.append(starts[-1] + len(text) + 1)
+
+            self._joined = self.separator.join(texts), starts
+
+        return self._joined
+
+    def find_best_matches(self, pattern, count):
+        """
+        Return the `count` best matches of `pattern`, as (length, start,
+        index) tuples, best match first.
+        """
+        # When enough completions contain the pattern as a whole, no other
+        # match can be better.
+        matches = heapq.nsmallest(count, self._find_matches(pattern, fuzzy=False))
+
+        if len(matches) < count:
+            matches = heapq.nsmallest(count, self._find_matches(pattern))
+
+        return matches
+
+    def _find_matches(self, pattern, fuzzy=True):
+        """
+        Yield a (length, start, index) tuple for every completion that contains
+        the characters of `pattern` in order. (Case insensitive.) This is the
+        shortest match in the text of that completion. When `fuzzy` is False,
+        only yield the completions that contain `pattern` as a whole.
+        """
+        separator = self.separator
+
+        if separator in pattern or not pattern:
+            return
+
+        chars = [re.escape(c) for c in pattern]
+        gap = '[^%s]*?' % separator if fuzzy else ''
+        first_match = re.compile(gap.join(chars), re.IGNORECASE)
+        all_matches = re.compile(
+            '(?=(%s))' % '.*?'.join(chars), re.IGNORECASE | re.DOTALL)
+
+        joined, starts = self._get_joined()
+        match = first_match.search(joined)
+
+        while match:
+            i = bisect_right(starts, match.start()) - 1
+            length = match.end() - match.start()
+
+            if length == len(pattern):
+                # The first match is contiguous, there is no better one.
+                yield length, match.start() - starts[i], i
+            else:
+                text = self.completions[i].text
+                yield min((len(m.group(1)), m.start(), i) for m in all_matches.finditer(text))
+
+            # Continue at the next completion.
+            match = first_match.search(joined, starts[i + 1])
+
+
+def _get_display(text, start, length, pattern):
+    """
+    Return the formatted text for displaying `text`, in which
+    ``text[start:start + length]`` matches `pattern`.
+    """
+    fragments = [('class:fuzzymatch.outside', text[:start])]
+    chars = pattern.lower()
+    j = 0
+
+    for c in text[start:start + length]:
+        if j < len(chars) and c.lower() == chars[j]:
+            fragments.append(('class:fuzzymatch.inside.character', c))
+            j += 1
+        else:
+            fragments.append(('class:fuzzymatch.inside', c))
+
+    fragments.append(('class:fuzzymatch.outside', text[start + length:]))
+    return fragments
@@ -0,0 +1,319 @@
+"""
+Completer that runs another completer in worker processes.
+"""
+from __future__ import unicode_literals
+
+from six.moves.queue import Empty
+from threading import Condition
+from prompt_toolkit.document import Document
+from prompt_toolkit.eventloop import generator_to_async_generator
+from prompt_toolkit.eventloop.utils import WorkerPool
+from prompt_toolkit.metrics import start_timing, timed_iterable
+
+from .base import Completer, Completion, CompleteEvent
+
+import multiprocessing
+import time
+import traceback
+
+__all__ = [
+    'ProcessPoolCompleter',
+    'CompleterProcessError',
+]
+
+
+class CompleterProcessError(Exception):
+    """
+    Raised when the completer raised an exception in the worker process. The
+    message contains the traceback from the worker.
+    """
+
+
+class ProcessPoolCompleter(Completer):
+    """
+    Wrapper that runs the `get_completions` generator in a worker process.
+
+    (Use this for a completer that needs a lot of CPU, like fuzzy matching of
+    a big list of words. A :class:`.ThreadedCompleter` keeps the user
+    interface responsive, but because of the GIL, it still takes time from
+    the thread that renders the interface.)
+
+    The completer is sent to every worker process once, when the process is
+    started. So, the words, or anything else that the completer needs, are
+    loaded only once for every process. For every completion, only the text
+    and cursor position are sent over, and the completions are sent back in
+    batches, which are displayed as soon as they arrive.
+
+    When the input changes while completing, the worker stops before the next
+    completion. Completers that take a lot of time for one completion can poll
+    `complete_event.cancelled`, like in a thread. (A worker that doesn't stop
+    within a second is terminated, and a new one is started.)
+
+    An exception in the completer is sent back, and raised from
+    `get_completions` as a :class:`.CompleterProcessError`.
+
+    The completer has to be picklable when processes are spawned instead of
+    forked, like on Windows. (Then the main module should also be importable
+    without side effects. See the `multiprocessing` documentation.)
+
+    :param completer: A :class:`~.Completer` instance.
+    :param processes: Maximum number of worker processes. (These are started
+        when they are needed.)
+    :param batch_size: Maximum number of completions in a batch.
+    :param batch_interval: Send a batch after this many seconds, even if it's
+        not full.
+    """
+    def __init__(self, completer, processes=1, batch_size=100, batch_interval=.05):
+        assert isinstance(completer, Completer), 'Got %r' % (completer, )
+        assert isinstance(processes, int) and processes > 0
+        assert isinstance(batch_size, int) and batch_size > 0
+        assert isinstance(batch_interval, (int, float))
+
+        self.completer = completer
+        self.processes = processes
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+
+        self._condition = Condition()
+        self._workers = []  # All `_Worker` instances.
+        self._idle_workers = []
+
+        # The threads that wait for the completions of the workers.
+        self._readers = WorkerPool(max_workers=processes)
+
+    def get_completions(self, document, complete_event):
+        worker = self._acquire_worker()
+        completions = worker.get_completions(document, complete_event)
+
+        try:
+            for completion in completions:
+                yield completion
+        finally:
+            # (Let the worker finish before it's used again.)
+            completions.close()
+            self._release_worker(worker)
+
+    def get_completions_async(self, document, complete_event):
+        """
+        Asynchronous generator of completions.
+        This yields both Future and Completion objects.
+        """
+        timing = start_timing('completer', self.completer)
+
+        def get_iterable():
+            completions = self.get_completions(document, complete_event)
+
+            if timing is not None:
+                return timed_iterable(timing, completions,
+                                      cancelled=lambda: complete_event.cancelled)
+            return completions
+
+        return generator_to_async_generator(get_iterable, executor=self._readers)
+
+    def _acquire_worker(self):
+        " Take an idle worker. Start a new one, or wait if there is none. "
+        with self._condition:
+            while True:
+                # Don't use workers of which the process died.
+                self._idle_workers = [w for w in self._idle_workers if w.is_alive()]
+
+                if self._idle_workers:
+                    return self._idle_workers.pop()
+
+                self._workers = [w for w in self._workers if w.is_alive()]
+
+                if len(self._workers) < self.processes:
+                    worker = _Worker(self.completer, self.batch_size, self.batch_interval)
+                    self._workers.append(worker)
+                    return worker
+
+                self._condition.wait()
+
+    def _release_worker(self, worker):
+        with self._condition:
+            self._idle_workers.append(worker)
+            self._condition.notify()
+
+    def close(self):
+        """
+        Stop the worker processes. (They are started again for the next
+        completion.)
+        """
+        with self._condition:
+            for worker in self._workers:
+                worker.close()
+
+            self._workers = []
+            self._idle_workers = []
+
+    def __repr__(self):
+        return 'ProcessPoolCompleter(%r)' % (self.completer, )
+
+
+class _Worker(object):
+    """
+    One worker process, that handles one completion at a time.
+    """
+    poll_interval = .05
+
+    # Time to wait for the worker to stop, when the completions are not
+    # needed anymore.
+    stop_timeout = 1.
+
+    def __init__(self, completer, batch_size, batch_interval):
+        self.requests = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        self.cancelled = multiprocessing.Value('b', 0)
+
+        self.process = multiprocessing.Process(
+            target=_run_worker,
+            args=(completer, self.requests, self.results, self.cancelled,
+                  batch_size, batch_interval))
+        self.process.daemon = True
+        self.process.start()
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def get_completions(self, document, complete_event):
+        """
+        Send the document to the worker process, and yield the completions
+        when they arrive.
+        """
+        self.cancelled.value = 0
+        self.requests.put((document.text, document.cursor_position,
+                           complete_event.text_inserted,
+                           complete_event.completion_requested))
+        done = False
+
+        try:
+            while True:
+                batch = self._get_batch(complete_event)
+                if batch is None:
+                    done = True
+                    return
+
+                if isinstance(batch, _WorkerError):
+                    raise batch.to_exception()
+
+                if not complete_event.cancelled:
+                    for args in batch:
+                        yield Completion(*args)
+        finally:
+            # When we stop early, tell the worker to stop too, and wait for
+            # it. (Otherwise, the next completion receives these results.)
+            if not done:
+                self.cancelled.value = 1
+                self._wait_for_end()
+
+    def _get_batch(self, complete_event):
+        """
+        Wait for the next batch of completions. Return `None` at the end.
+        """
+        while True:
+            try:
+                return self.results.get(timeout=self.poll_interval)
+            except Empty:
+                # Tell the worker to stop when we don't need the completions
+                # anymore.
+                if complete_event.cancelled:
+                    self.cancelled.value = 1
+                if not self.process.is_alive():
+                    return None
+
+    def _wait_for_end(self):
+        """
+        Skip the remaining results of a cancelled completion. When the worker
+        doesn't stop in time, terminate it. (Then a new worker is started for
+        the next completion.)
+        """
+        deadline = time.time() + self.stop_timeout
+
+        while time.time() < deadline:
+            try:
+                if self.results.get(timeout=self.poll_interval) is None:
+                    return
+            except Empty:
+                if not self.process.is_alive():
+                    return
+
+        self.process.terminate()
+        self.process.join()
+
+    def close(self):
+        self.requests.put(None)
+
+
+class _WorkerError(object):
+    """
+    Exception in a worker process. Only the formatted traceback is sent back,
+    because the exception itself can't always be pickled.
+    """
+    def __init__(self, traceback):
+        self.traceback = traceback
+
+    def to_exception(self):
+        return CompleterProcessError(
+            'Exception in completer process:\n\n%s' % self.traceback)
+
+
+class _ProcessCompleteEvent(CompleteEvent):
+    """
+    `CompleteEvent` in a worker process, that is cancelled through a shared
+    value.
+    """
+    def __init__(self, cancelled, text_inserted=False, completion_requested=False):
+        super(_ProcessCompleteEvent, self).__init__(
+            text_inserted=text_inserted, completion_requested=completion_requested)
+        self._shared_cancelled = cancelled
+
+    @property
+    def cancelled(self):
+        return bool(self._shared_cancelled.value)
+
+
+def _run_worker(completer, requests, results, cancelled, batch_size, batch_interval):
+    """
+    Main function of a worker process: handle completion requests until
+    `None` is received.
+    """
+    while True:
+        request = requests.get()
+        if request is None:
+            return
+
+        text, cursor_position, text_inserted, completion_requested = request
+        document = Document(text, cursor_position)
+        complete_event = _ProcessCompleteEvent(
+            cancelled, text_inserted=text_inserted,
+            completion_requested=completion_requested)
+
+        batch = []
+        batch_time = time.time()
+        error = None
+
+        try:
+            for c in completer.get_completions(document, complete_event):
+                if complete_event.cancelled:
+                    break
+
+                # Send only the values that can be pickled. (A callable
+                # `display_meta` is called here.)
+                batch.append((c.text, c.start_position, c._display_fragments or c.display,
+                              c.display_meta, c.style, c.selected_style))
+
+                if len(batch) >= batch_size or time.time() - batch_time >= batch_interval:
+                    results.put(batch)
+                    batch = []
+                    batch_time = time.time()
+        except Exception:
+            error = _WorkerError(traceback.format_exc())
+
+        if batch and not complete_event.cancelled:
+            results.put(batch)
+
+        if error is not None:
+            results.put(error)
+
+        # End of the completions.
+        results.put(None)
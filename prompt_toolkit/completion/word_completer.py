@@ -1,8 +1,11 @@
 from __future__ import unicode_literals
 
-from six import string_types
+from bisect import bisect_left, bisect_right
+from six import string_types, unichr
 from prompt_toolkit.completion import Completer, Completion
 
+import sys
+
 __all__ = [
     'WordCompleter',
 ]
@@ -12,6 +15,10 @@ class WordCompleter(Completer):
     """
     Simple autocompletion on a list of words.
 
+    For a list of words, an index is built, so that a completion doesn't have
+    to go through every word. (When `words` is a callable, the index is built
+    once it returns the same list a second time.)
+
     :param words: List of words or callable that returns a list of words.
     :param ignore_case: If True, case-insensitive completion.
     :param meta_dict: Optional dict mapping words to their meta-information.
@@ -35,6 +42,60 @@ class WordCompleter(Completer):
         self.sentence = sentence
         self.match_middle = match_middle
 
+        self._index = None
+        self._last_words = None  # The list of words of the last completion.
+
+        if not callable(words):
+            self._get_index(words)
+
+    def _get_index(self, words):
+        """
+        Return the `_WordIndex` for this list of words, or `None` when we don't
+        have one. (The index keeps a copy of a list, so that it's built again
+        when the list has been changed in place.)
+        """
+        if not isinstance(words, (list, tuple)):
+            return None
+
+        index = self._index
+        if (index is not None and index.ignore_case == self.ignore_case and
+                (index.words is words or index.words == words)):
+            return index
+
+        # A callable can return a new list for every completion. Then going
+        # through the list once is faster than indexing it.
+        if callable(self.words) and words is not self._last_words:
+            self._last_words = words
+            return None
+
+        if isinstance(words, list):
+            words = list(words)
+
+        self._index = _WordIndex(words, ignore_case=self.ignore_case)
+        return self._index
+
+    def _get_word_before_cursor(self, document):
+        " Return the word/text before the cursor, which is completed. "
+        if self.sentence:
+            word_before_cursor = document.text_before_cursor
+        else:
+            word_before_cursor = document.get_word_before_cursor(WORD=self.WORD)
+
+        if self.ignore_case:
+            word_before_cursor = word_before_cursor.lower()
+
+        return word_before_cursor
+
+    def _word_matches(self, word, word_before_cursor):
+        """ True when the word before the cursor matches. """
+        if self.ignore_case:
+            word = word.lower()
+
+        if self.match_middle:
+            return word_before_cursor in word
+        else:
+            return word.startswith(word_before_cursor)
+
     def get_completions(self, document, complete_event):
         # Get list of words.
         words = self.words
@@ -42,25 +103,122 @@ class WordCompleter(Completer):
             words = words()
 
         # Get word/text before cursor.
-        if self.sentence:
-            word_before_cursor = document.text_before_cursor
+        word_before_cursor = self._get_word_before_cursor(document)
+
+        def word_matches(word):
+            return self._word_matches(word, word_before_cursor)
+
+        index = self._get_index(words)
+
+        if not word_before_cursor:
+            matches = words
+        elif index is None:
+            matches = (a for a in words if word_matches(a))
+        elif self.match_middle:
+            matches = (words[i] for i in index.find_middle(word_before_cursor))
         else:
-            word_before_cursor = document.get_word_before_cursor(WORD=self.WORD)
+            matches = (words[i] for i in index.find_prefix(word_before_cursor))
+
+        for a in matches:
+            display_meta = self.meta_dict.get(a, '')
+            yield Completion(a, -len(word_before_cursor), display_meta=display_meta)
+
+    def narrow_completions(self, document, previous_document, completions):
+        # A callable can return other words for the new text.
+        if callable(self.words):
+            return None
+
+        # Only when the typed text extends the previous word. (Otherwise, the
+        # completions are for another word.)
+        previous_word = self._get_word_before_cursor(previous_document)
+        word_before_cursor = self._get_word_before_cursor(document)
+        typed = document.text[previous_document.cursor_position:document.cursor_position]
 
         if self.ignore_case:
-            word_before_cursor = word_before_cursor.lower()
+            typed = typed.lower()
 
-        def word_matches(word):
-            """ True when the word before the cursor matches. """
-            if self.ignore_case:
-                word = word.lower()
-
-            if self.match_middle:
-                return word_before_cursor in word
-            else:
-                return word.startswith(word_before_cursor)
-
-        for a in words:
-            if word_matches(a):
-                display_meta = self.meta_dict.get(a, '')
-                yield Completion(a, -len(word_before_cursor), display_meta=display_meta)
+        if not previous_word or word_before_cursor != previous_word + typed:
+            return None
+
+        return [
+            Completion(c.text, -len(word_before_cursor),
+                       display_meta=self.meta_dict.get(c.text, ''))
+            for c in completions if self._word_matches(c.text, word_before_cursor)]
+
+
+class _WordIndex(object):
+    """
+    Index over a list of words, for finding the words that start with, or
+    contain a string. The positions of the matching words are returned in the
+    order of the list.
+
+    Prefixes are looked up with a binary search in the sorted words. For
+    strings in the middle of words, the words are joined into one string, so
+    that finding them takes a few `str.find` calls, rather than a check of
+    every single word. (That string is only built when it's used.)
+
+    :param words: List of words. (This should not be changed anymore.)
+    :param ignore_case: When True, index the lower case words. (The strings
+        that are looked up should be lower case too.)
+    """
+    separator = '\x00'
+
+    def __init__(self, words, ignore_case=False):
+        self.words = words
+        self.ignore_case = ignore_case
+
+        if ignore_case:
+            self.keys = [w.lower() for w in words]
+        else:
+            self.keys = list(words)
+
+        keys = self.keys
+        self._sorted_positions = sorted(range(len(keys)), key=keys.__getitem__)
+        self._sorted_keys = [keys[i] for i in self._sorted_positions]
+        self._joined = None  # (Joined keys, start of every key.)
+
+    def find_prefix(self, prefix):
+        " Return the positions of the words that start with `prefix`. "
+        keys = self._sorted_keys
+        start = bisect_left(keys, prefix)
+
+        # The words with this prefix come before the prefix in which the last
+        # character has been incremented.
+        last = ord(prefix[-1]) if prefix else sys.maxunicode
+
+        if last < sys.maxunicode:
+            end = bisect_left(keys, prefix[:-1] + unichr(last + 1), start)
+        else:
+            end = start
+            while end < len(keys) and keys[end].startswith(prefix):
+                end += 1
+
+        return sorted(self._sorted_positions[start:end])
+
+    def find_middle(self, text):
+        " Yield the positions of the words that contain `text`. "
+        if self.separator in text:
+            for i, key in enumerate(self.keys):
+                if text in key:
+                    yield i
+            return
+
+        joined, starts = self._get_joined()
+        position = joined.find(text)
+
+        while position >= 0:
+            i = bisect_right(starts, position) - 1
+            yield i
+
+            # Continue at the next word.
+            position = joined.find(text, starts[i + 1])
+
+    def _get_joined(self):
+        if self._joined is None:
+            starts = [0]
+            for key in self.keys:
+                starts.append(starts[-1] + len(key) + 1)
+
+            self._joined = self.separator.join(self.keys), starts
+
+        return self._joined
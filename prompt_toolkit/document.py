@@ -7,7 +7,9 @@ import bisect
 import re
 import six
 import string
+import threading
 import weakref
+from collections import OrderedDict
 from six.moves import range, map
 
 from .clipboard import ClipboardData
@@ -33,24 +35,134 @@ _FIND_BIG_WORD_RE = re.compile(r'([^\s]+)')
 _FIND_CURRENT_BIG_WORD_RE = re.compile(r'^([^\s]+)')
 _FIND_CURRENT_BIG_WORD_INCLUDE_TRAILING_WHITESPACE_RE = re.compile(r'^([^\s]+\s*)')
 
+# Regex for finding the brackets that `find_matching_bracket_position` matches.
+_FIND_BRACKET_RE = re.compile(r'[][(){}<>]')
+_OPENING_BRACKETS = {')': '(', ']': '[', '}': '{', '>': '<'}
+
 # Share the Document._cache between all Document instances.
 # (Document instances are considered immutable. That means that if another
 # `Document` is constructed with the same text, it should have the same
 # `_DocumentCache`.)
 _text_to_document_cache = weakref.WeakValueDictionary()  # Maps document.text to DocumentCache instance.
 
+# Maximum number of search queries for which we keep the search matches of a
+# text. (During incremental search, every key press creates a new query.)
+_SEARCH_MATCHES_CACHE_SIZE = 8
+
+
+_FIND_NEWLINE_RE = re.compile(r'\n')
+
+
+def _find_reversed(regex, text, end):
+    """
+    Search backwards through ``text[:end]``: yield the (start, end) spans of
+    the matches of `regex` in ``text[:end][::-1]``, the reversed text.
+
+    Only a window before `end` is reversed at a time. The window grows when
+    more text is needed, so that a search close to `end` doesn't copy the
+    whole text. (`regex` should match runs of characters, like the word
+    regexes. A match that reaches the end of the window can continue in the
+    text before it, and is searched again in the next window.)
+    """
+    offset = 0  # Position in the reversed text where the window starts.
+    size = 256
+
+    while True:
+        start = max(0, end - offset - size)
+        window = text[start:end - offset][::-1]
+
+        for match in regex.finditer(window):
+            if start > 0 and match.end() == len(window):
+                # This match can continue before the window.
+                offset += match.start()
+                break
+
+            yield offset + match.start(1), offset + match.end(1)
+        else:
+            if start == 0:
+                return
+
+            # The rest of the window is whitespace.
+            offset += len(window)
+
+        size *= 2
 
-class _ImmutableLineList(list):
+
+class _LineList(object):
     """
-    Some protection for our 'lines' list, which is assumed to be immutable in the cache.
-    (Useful for detecting obvious bugs.)
+    Immutable list of the lines of a text.
+
+    The lines are sliced out of the text when they are accessed, using the
+    line start indexes. This way, we don't have to create a string object for
+    every line of a big document, each time the text changes. Usually, only
+    the visible lines are accessed.
+
+    (This is not a `list`. Use ``list(document.lines)`` for a list.)
     """
+    __slots__ = ('_text', '_indexes')
+
+    def __init__(self, text, indexes):
+        self._text = text
+        self._indexes = indexes
+
+    def __len__(self):
+        return len(self._indexes)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self._indexes))
+
+            if step == 1:
+                return self._get_lines(start, stop)
+            else:
+                return self._get_lines(0, len(self._indexes))[index]
+
+        if index < 0:
+            index += len(self._indexes)
+
+        if not 0 <= index < len(self._indexes):
+            raise IndexError('list index out of range')
+
+        return self._text[self._indexes[index]:self._get_line_end(index)]
+
+    def _get_line_end(self, index):
+        " Return the end position of this line. (Without the line ending.) "
+        if index + 1 < len(self._indexes):
+            return self._indexes[index + 1] - 1
+        else:
+            return len(self._text)
+
+    def _get_lines(self, start, stop):
+        " Return a list of the lines from `start` until `stop`. "
+        if start >= stop:
+            return []
+        else:
+            return self._text[self._indexes[start]:self._get_line_end(stop - 1)].split('\n')
+
+    def __iter__(self):
+        return iter(self._get_lines(0, len(self._indexes)))
+
+    def __eq__(self, other):
+        if isinstance(other, _LineList):
+            return self._text == other._text
+        if isinstance(other, list):
+            return list(self) == other
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    __hash__ = None
+
     def _error(self, *a, **kw):
         raise NotImplementedError('Attempt to modify an immutable list.')
 
     __setitem__ = _error
+    __delitem__ = _error
     append = _error
-    clear = _error
     extend = _error
     insert = _error
     pop = _error
@@ -58,15 +170,45 @@ class _ImmutableLineList(list):
     reverse = _error
     sort = _error
 
+    def __repr__(self):
+        return repr(list(self))
+
 
 class _DocumentCache(object):
     def __init__(self):
-        #: List of lines for the Document text.
+        #: List of lines for the Document text. (A `_LineList`.)
         self.lines = None
 
         #: List of index positions, pointing to the start of all the lines.
         self.line_indexes = None
 
+        #: Search matches. Maps (search_text, ignore_case) to a tuple of
+        #: positions. (See `Document.get_search_matches`.)
+        self.search_matches = OrderedDict()
+
+        #: Lock for `search_matches`. (Searching in big documents happens in
+        #: a background thread.)
+        self.search_matches_lock = threading.Lock()
+
+        #: Dictionary that maps the position of each bracket to the position
+        #: of the matching bracket.
+        self.bracket_pairs = None
+
+
+def _create_document(text, cursor_position, selection, cache):
+    """
+    Create a :class:`.Document` that uses the given `_DocumentCache`. (The
+    caller makes sure that the cache belongs to this text.)
+    """
+    assert 0 <= cursor_position <= len(text)
+
+    document = Document.__new__(Document)
+    document._text = text
+    document._cursor_position = cursor_position
+    document._selection = selection
+    document._cache = cache
+    return document
+
 
 class Document(object):
     """
@@ -179,7 +321,7 @@ class Document(object):
         """
         # Cache, because this one is reused very often.
         if self._cache.lines is None:
-            self._cache.lines = _ImmutableLineList(self.text.split('\n'))
+            self._cache.lines = _LineList(self.text, self._line_start_indexes)
 
         return self._cache.lines
 
@@ -191,26 +333,62 @@ class Document(object):
         # Cache, because this is often reused. (If it is used, it's often used
         # many times. And this has to be fast for editing big documents!)
         if self._cache.line_indexes is None:
-            # Create list of line lengths.
-            line_lengths = map(len, self.lines)
-
-            # Calculate cumulative sums.
+            # Every line starts after a line ending. (Find the line endings
+            # directly in the text, without splitting it into lines.)
             indexes = [0]
-            append = indexes.append
-            pos = 0
-
-            for line_length in line_lengths:
-                pos += line_length + 1
-                append(pos)
-
-            # Remove the last item. (This is not a new line.)
-            if len(indexes) > 1:
-                indexes.pop()
+            indexes.extend(m.end() for m in _FIND_NEWLINE_RE.finditer(self.text))
 
             self._cache.line_indexes = indexes
 
         return self._cache.line_indexes
 
+    def _replace_range(self, start, end, data, cursor_position):
+        """
+        Return a new :class:`.Document` in which ``text[start:end]`` has been
+        replaced by `data`.
+
+        When the line indexes of this document are known, those of the new
+        document are derived from them: the indexes before the edit are kept,
+        and only the ones after the edit are shifted.
+        """
+        assert 0 <= start <= end <= len(self.text)
+
+        text = self.text
+
+        # The new text is not looked up in `_text_to_document_cache`. (That
+        # would hash the whole text.) It gets a cache of its own.
+        document = _create_document(
+            text[:start] + data + text[end:], cursor_position, None, _DocumentCache())
+
+        line_indexes = self._cache.line_indexes
+
+        if line_indexes is not None:
+            # Lines starting at or before `start` are not affected. The lines
+            # that started in the replaced range are gone.
+            first = bisect.bisect_right(line_indexes, start)
+            last = bisect.bisect_right(line_indexes, end)
+            shift = len(data) - (end - start)
+
+            indexes = line_indexes[:first]
+            indexes.extend(m.end() + start for m in _FIND_NEWLINE_RE.finditer(data))
+
+            if shift:
+                indexes.extend(i + shift for i in line_indexes[last:])
+            else:
+                indexes.extend(line_indexes[last:])
+
+            document._cache.line_indexes = indexes
+
+        return document
+
+    def _with_cursor_position(self, cursor_position, selection=None):
+        """
+        Return a new :class:`.Document` with the same text, and the given
+        cursor position and selection. It shares the cache of this document,
+        without looking it up by text.
+        """
+        return _create_document(self.text, cursor_position, selection, self._cache)
+
     @property
     def lines_from_current(self):
         """
@@ -380,10 +558,90 @@ class Document(object):
     def find_all(self, sub, ignore_case=False):
         """
         Find all occurrences of the substring. Return a list of absolute
-        positions in the document.
+        positions in the document. (The occurrences don't overlap. This is
+        computed from the cached search matches, so taking the length of this
+        list is a cheap way to display the number of matches.)
         """
-        flags = re.IGNORECASE if ignore_case else 0
-        return [a.start() for a in re.finditer(re.escape(sub), self.text, flags)]
+        result = []
+        end = 0
+
+        for position in self.get_search_matches(sub, ignore_case=ignore_case):
+            if position >= end:
+                result.append(position)
+                end = position + len(sub)
+
+        return result
+
+    def get_search_matches(self, sub, ignore_case=False):
+        """
+        Return a sorted tuple with the absolute positions of all occurrences of
+        the substring, including the ones that overlap.
+
+        The text is scanned only once for every search query. The result is
+        shared between all `Document` instances with the same text, so that
+        highlighting and navigating through the search results doesn't have
+        to search the text again. When the matches of a prefix of `sub` are
+        known (like during an incremental search), only those positions are
+        checked.
+        """
+        key = (sub, ignore_case)
+        search_matches = self._cache.search_matches
+        lock = self._cache.search_matches_lock
+
+        try:
+            with lock:
+                return search_matches[key]
+        except KeyError:
+            flags = re.IGNORECASE if ignore_case else 0
+            candidates = self._get_search_match_candidates(sub, ignore_case)
+
+            if candidates is None:
+                result = tuple(m.start() for m in re.finditer(
+                    '(?=%s)' % re.escape(sub), self.text, flags))
+            elif ignore_case:
+                match = re.compile(re.escape(sub), flags).match
+                text = self.text
+                result = tuple(p for p in candidates if match(text, p))
+            else:
+                startswith = self.text.startswith
+                result = tuple(p for p in candidates if startswith(sub, p))
+
+            with lock:
+                search_matches[key] = result
+
+                # Remove the oldest queries when the size is exceeded.
+                while len(search_matches) > _SEARCH_MATCHES_CACHE_SIZE:
+                    search_matches.popitem(last=False)
+
+            return result
+
+    def _get_search_match_candidates(self, sub, ignore_case):
+        """
+        Return the cached matches of the longest prefix of `sub`, or `None`
+        when scanning the whole text is cheaper. (Every occurrence of `sub` is
+        also an occurrence of its prefixes.)
+        """
+        best = None
+
+        with self._cache.search_matches_lock:
+            items = list(self._cache.search_matches.items())
+
+        for (s, i), matches in items:
+            if i == ignore_case and s and sub.startswith(s):
+                if best is None or len(s) > len(best[0]):
+                    best = s, matches
+
+        # Checking a candidate is much slower than scanning a character.
+        if best is not None and len(best[1]) * 32 < len(self.text):
+            return best[1]
+
+    def has_cached_search_matches(self, sub, ignore_case=False):
+        """
+        `True` when the search matches for this query were computed already.
+        (Calling `get_search_matches` is cheap in that case.)
+        """
+        with self._cache.search_matches_lock:
+            return (sub, ignore_case) in self._cache.search_matches
 
     def find_backwards(self, sub, in_current_line=False, ignore_case=False, count=1):
         """
@@ -412,29 +670,25 @@ class Document(object):
         Give the word before the cursor.
         If we have whitespace before the cursor this returns an empty string.
         """
-        if self.text_before_cursor[-1:].isspace():
+        if self.char_before_cursor.isspace():
             return ''
         else:
-            return self.text_before_cursor[self.find_start_of_previous_word(WORD=WORD):]
+            start = self.find_start_of_previous_word(WORD=WORD)
+            if start is None:
+                start = -self.cursor_position
+            return self.text[self.cursor_position + start:self.cursor_position]
 
     def find_start_of_previous_word(self, count=1, WORD=False):
         """
         Return an index relative to the cursor position pointing to the start
         of the previous word. Return `None` if nothing was found.
         """
-        # Reverse the text before the cursor, in order to do an efficient
-        # backwards search.
-        text_before_cursor = self.text_before_cursor[::-1]
-
         regex = _FIND_BIG_WORD_RE if WORD else _FIND_WORD_RE
-        iterator = regex.finditer(text_before_cursor)
+        iterator = _find_reversed(regex, self.text, self.cursor_position)
 
-        try:
-            for i, match in enumerate(iterator):
-                if i + 1 == count:
-                    return - match.end(1)
-        except StopIteration:
-            pass
+        for i, (start, end) in enumerate(iterator):
+            if i + 1 == count:
+                return - end
 
     def find_boundaries_of_current_word(self, WORD=False, include_leading_whitespace=False,
                                         include_trailing_whitespace=False):
@@ -492,18 +746,16 @@ class Document(object):
             return self.find_previous_word_beginning(count=-count, WORD=WORD)
 
         regex = _FIND_BIG_WORD_RE if WORD else _FIND_WORD_RE
-        iterator = regex.finditer(self.text_after_cursor)
+        position = self.cursor_position
+        iterator = regex.finditer(self.text, position)
 
-        try:
-            for i, match in enumerate(iterator):
-                # Take first match, unless it's the word on which we're right now.
-                if i == 0 and match.start(1) == 0:
-                    count += 1
+        for i, match in enumerate(iterator):
+            # Take first match, unless it's the word on which we're right now.
+            if i == 0 and match.start(1) == position:
+                count += 1
 
-                if i + 1 == count:
-                    return match.start(1)
-        except StopIteration:
-            pass
+            if i + 1 == count:
+                return match.start(1) - position
 
     def find_next_word_ending(self, include_current_position=False, count=1, WORD=False):
         """
@@ -513,26 +765,17 @@ class Document(object):
         if count < 0:
             return self.find_previous_word_ending(count=-count, WORD=WORD)
 
-        if include_current_position:
-            text = self.text_after_cursor
-        else:
-            text = self.text_after_cursor[1:]
-
-        regex = _FIND_BIG_WORD_RE if WORD else _FIND_WORD_RE
-        iterable = regex.finditer(text)
+        position = self.cursor_position
 
-        try:
-            for i, match in enumerate(iterable):
-                if i + 1 == count:
-                    value = match.end(1)
+        if not include_current_position:
+            position += 1
 
-                    if include_current_position:
-                        return value
-                    else:
-                        return value + 1
+        regex = _FIND_BIG_WORD_RE if WORD else _FIND_WORD_RE
+        iterable = regex.finditer(self.text, position)
 
-        except StopIteration:
-            pass
+        for i, match in enumerate(iterable):
+            if i + 1 == count:
+                return match.end(1) - self.cursor_position
 
     def find_previous_word_beginning(self, count=1, WORD=False):
         """
@@ -543,14 +786,11 @@ class Document(object):
             return self.find_next_word_beginning(count=-count, WORD=WORD)
 
         regex = _FIND_BIG_WORD_RE if WORD else _FIND_WORD_RE
-        iterator = regex.finditer(self.text_before_cursor[::-1])
+        iterator = _find_reversed(regex, self.text, self.cursor_position)
 
-        try:
-            for i, match in enumerate(iterator):
-                if i + 1 == count:
-                    return - match.end(1)
-        except StopIteration:
-            pass
+        for i, (start, end) in enumerate(iterator):
+            if i + 1 == count:
+                return - end
 
     def find_previous_word_ending(self, count=1, WORD=False):
         """
@@ -560,21 +800,18 @@ class Document(object):
         if count < 0:
             return self.find_next_word_ending(count=-count, WORD=WORD)
 
-        text_before_cursor = self.text_after_cursor[:1] + self.text_before_cursor[::-1]
-
+        # Search backwards, starting at the character under the cursor.
         regex = _FIND_BIG_WORD_RE if WORD else _FIND_WORD_RE
-        iterator = regex.finditer(text_before_cursor)
+        iterator = _find_reversed(
+            regex, self.text, min(self.cursor_position + 1, len(self.text)))
 
-        try:
-            for i, match in enumerate(iterator):
-                # Take first match, unless it's the word on which we're right now.
-                if i == 0 and match.start(1) == 0:
-                    count += 1
+        for i, (start, end) in enumerate(iterator):
+            # Take first match, unless it's the word on which we're right now.
+            if i == 0 and start == 0:
+                count += 1
 
-                if i + 1 == count:
-                    return -match.start(1) + 1
-        except StopIteration:
-            pass
+            if i + 1 == count:
+                return -start + 1
 
     def find_next_matching_line(self, match_func, count=1):
         """
@@ -714,21 +951,68 @@ class Document(object):
             if stack == 0:
                 return i - self.cursor_position
 
+    @property
+    def _bracket_pairs(self):
+        """
+        Dictionary that maps the position of every bracket that has a matching
+        bracket to the position of that matching bracket.
+        """
+        # Cache, because this is built in one pass over the whole text. After
+        # that, finding a matching bracket is a dictionary lookup.
+        if self._cache.bracket_pairs is None:
+            pairs = {}
+            stacks = dict((c, []) for c in _OPENING_BRACKETS.values())
+
+            # Every type of brackets is matched independently of the others.
+            for match in _FIND_BRACKET_RE.finditer(self.text):
+                c = match.group()
+                position = match.start()
+
+                if c in stacks:
+                    stacks[c].append(position)
+                else:
+                    stack = stacks[_OPENING_BRACKETS[c]]
+                    if stack:
+                        left_position = stack.pop()
+                        pairs[left_position] = position
+                        pairs[position] = left_position
+
+            self._cache.bracket_pairs = pairs
+
+        return self._cache.bracket_pairs
+
     def find_matching_bracket_position(self, start_pos=None, end_pos=None):
         """
         Return relative cursor position of matching [, (, { or < bracket.
 
         When `start_pos` or `end_pos` are given. Don't look past the positions.
+        (Without these, the brackets of the whole text are indexed, which is
+        done once for every text. With these, only the text in between is
+        scanned, unless the index exists already.)
         """
+        current_char = self.current_char
+
+        # (At the end of the text, the current character is ''.)
+        if not current_char or current_char not in '()[]{}<>':
+            return 0
+
+        if self._cache.bracket_pairs is None and (start_pos is not None or end_pos is not None):
+            for A, B in '()', '[]', '{}', '<>':
+                if current_char == A:
+                    return self.find_enclosing_bracket_right(A, B, end_pos=end_pos) or 0
+                elif current_char == B:
+                    return self.find_enclosing_bracket_left(A, B, start_pos=start_pos) or 0
 
-        # Look for a match.
-        for A, B in '()', '[]', '{}', '<>':
-            if self.current_char == A:
-                return self.find_enclosing_bracket_right(A, B, end_pos=end_pos) or 0
-            elif self.current_char == B:
-                return self.find_enclosing_bracket_left(A, B, start_pos=start_pos) or 0
+        position = self._bracket_pairs.get(self.cursor_position)
+
+        if position is None:
+            return 0
+        if start_pos is not None and position < start_pos:
+            return 0
+        if end_pos is not None and position >= end_pos:
+            return 0
 
-        return 0
+        return position - self.cursor_position
 
     def get_start_of_document_position(self):
         """ Relative position for the start of the document. """
@@ -37,7 +37,7 @@ class AsyncGeneratorItem(object):
         return 'AsyncGeneratorItem(%r)' % (self.value, )
 
 
-def generator_to_async_generator(get_iterable):
+def generator_to_async_generator(get_iterable, executor=None):
     """
     Turn a generator or iterable into an async generator.
 
@@ -47,6 +47,9 @@ def generator_to_async_generator(get_iterable):
 
     :param get_iterable: Function that returns a generator or iterable when
         called.
+    :param executor: (Optional) Object with a `run_in_executor` method, like
+        a :class:`~prompt_toolkit.eventloop.utils.WorkerPool`, that runs the
+        generator. By default, a new daemon thread is started.
     """
     q = Queue()
     f = Future()
@@ -59,7 +62,13 @@ def generator_to_async_generator(get_iterable):
         When items are received, they'll be pushed to the queue and the
         Future is set.
         """
-        for item in get_iterable():
+        # Don't start when we were cancelled while waiting for a thread.
+        if quitting:
+            iterable = []
+        else:
+            iterable = get_iterable()
+
+        for item in iterable:
             with l:
                 q.put(item)
                 if not f.done():
@@ -74,7 +83,10 @@ def generator_to_async_generator(get_iterable):
                 f.set_result(None)
 
     # Start background thread.
-    done_f = run_in_executor(runner, _daemon=True)
+    if executor is None:
+        done_f = run_in_executor(runner, _daemon=True)
+    else:
+        done_f = executor.run_in_executor(runner)
 
     try:
         while not done_f.done():
@@ -90,7 +102,7 @@ def generator_to_async_generator(get_iterable):
 
         # Yield final items.
         while not q.empty():
-            yield q.get()
+            yield AsyncGeneratorItem(q.get())
 
     finally:
         # When this async generator is closed (GeneratorExit exception, stop
@@ -1,10 +1,17 @@
 from __future__ import unicode_literals
+from six.moves.queue import Queue, Empty
+import heapq
+import itertools
 import threading
+import time
 from .future import Future
 from .context import get_context_id, context
+from .defaults import call_from_executor
 
 __all__ = [
     'ThreadWithFuture',
+    'WorkerPool',
+    'call_later',
 ]
 
 
@@ -40,3 +47,134 @@ class ThreadWithFuture(object):
         if self.daemon:
             t.daemon = True
         t.start()
+
+
+class WorkerPool(object):
+    """
+    A bounded number of daemon threads, that run the functions which are
+    handed to them in order. Threads are only started when they are needed,
+    and wait for new functions when they're done.
+
+    (Unlike starting a thread for every function, the number of threads stays
+    the same, however many functions are submitted.)
+
+    :param max_workers: Maximum number of threads.
+    :param idle_timeout: A thread that didn't receive a function for this many
+        seconds stops. (`None` to keep the threads.)
+    """
+    def __init__(self, max_workers=2, idle_timeout=10):
+        assert isinstance(max_workers, int) and max_workers > 0
+        assert idle_timeout is None or isinstance(idle_timeout, (int, float))
+
+        self.max_workers = max_workers
+        self.idle_timeout = idle_timeout
+        self._queue = Queue()
+        self._lock = threading.Lock()
+        self._thread_count = 0
+        self._idle_count = 0  # Threads waiting for a function.
+        self._pending_count = 0  # Functions waiting for a thread.
+
+    def run_in_executor(self, callback):
+        """
+        Run `callback` in one of the threads. Return a `Future` that is set
+        when it's done.
+
+        (Like `EventLoop.run_in_executor`, the function is handed to a thread
+        once the event loop is idle.)
+        """
+        future = Future()
+        ctx_id = get_context_id()
+
+        def submit():
+            with self._lock:
+                self._pending_count += 1
+
+                if (self._pending_count > self._idle_count and
+                        self._thread_count < self.max_workers):
+                    self._thread_count += 1
+                    t = threading.Thread(target=self._work)
+                    t.daemon = True
+                    t.start()
+
+            self._queue.put((callback, future, ctx_id))
+
+        call_from_executor(submit)
+        return future
+
+    def _work(self):
+        while True:
+            with self._lock:
+                self._idle_count += 1
+
+            try:
+                callback, future, ctx_id = self._queue.get(timeout=self.idle_timeout)
+            except Empty:
+                with self._lock:
+                    # Stop, unless a function was submitted in the meantime
+                    # that needs this thread.
+                    if self._pending_count < self._idle_count:
+                        self._idle_count -= 1
+                        self._thread_count -= 1
+                        return
+                continue
+
+            with self._lock:
+                self._idle_count -= 1
+                self._pending_count -= 1
+
+            with context(ctx_id):
+                try:
+                    result = callback()
+                except BaseException as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+
+
+class _Timer(object):
+    """
+    Calls functions from the event loop at a given time. One daemon thread
+    waits for all of them. (Instead of a sleeping thread for every function.)
+    """
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._heap = []  # (time, counter, callback) tuples.
+        self._counter = itertools.count()  # (For callbacks at the same time.)
+        self._thread = None
+
+    def call_at(self, when, callback):
+        with self._condition:
+            heapq.heappush(self._heap, (when, next(self._counter), callback))
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._heap:
+                    self._condition.wait()
+
+                delay = self._heap[0][0] - time.time()
+                if delay > 0:
+                    # Wait, unless an earlier callback is added.
+                    self._condition.wait(delay)
+                    continue
+
+                _, _, callback = heapq.heappop(self._heap)
+
+            call_from_executor(callback)
+
+
+_timer = _Timer()
+
+
+def call_later(delay, callback):
+    """
+    Call `callback` from the event loop after `delay` seconds.
+    """
+    _timer.call_at(time.time() + delay, callback)
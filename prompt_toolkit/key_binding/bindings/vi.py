@@ -604,14 +604,20 @@ def load_vi_bindings():
     @handle('J', filter=vi_navigation_mode & ~is_read_only)
     def _(event):
         " Join lines. "
-        for i in range(event.arg):
-            event.current_buffer.join_next_line()
+        buff = event.current_buffer
+
+        with buff.batch_edit():
+            for i in range(event.arg):
+                buff.join_next_line()
 
     @handle('g', 'J', filter=vi_navigation_mode & ~is_read_only)
     def _(event):
         " Join lines without space. "
-        for i in range(event.arg):
-            event.current_buffer.join_next_line(separator='')
+        buff = event.current_buffer
+
+        with buff.batch_edit():
+            for i in range(event.arg):
+                buff.join_next_line(separator='')
 
     @handle('J', filter=vi_selection_mode & ~is_read_only)
     def _(event):
@@ -973,14 +979,15 @@ def load_vi_bindings():
             start, end = text_object.operator_range(buff.document)
 
             if start < end:
-                # Transform.
-                buff.transform_region(
-                    buff.cursor_position + start,
-                    buff.cursor_position + end,
-                    transform_func)
-
-                # Move cursor
-                buff.cursor_position += (text_object.end or text_object.start)
+                with buff.batch_edit():
+                    # Transform.
+                    buff.transform_region(
+                        buff.cursor_position + start,
+                        buff.cursor_position + end,
+                        transform_func)
+
+                    # Move cursor
+                    buff.cursor_position += (text_object.end or text_object.start)
 
     for k, f, func in vi_transform_functions:
         create_transform_handler(f, func, *k)
@@ -53,6 +53,11 @@ class KeyPress(object):
         return self.key == other.key and self.data == other.data
 
 
+def _is_character(key_press):
+    " True when this `KeyPress` is a single character that was typed. "
+    return len(key_press.key) == 1 and key_press.key == key_press.data
+
+
 """
 Helper object to indicate flush operation in the KeyProcessor.
 NOTE: the implementation is very similar to the VT100 parser.
@@ -270,7 +275,10 @@ class KeyProcessor(object):
                 self.before_key_press.fire()
 
             try:
-                self._process_coroutine.send(key_press)
+                # Handle a run of inserted characters at once. Otherwise, feed
+                # the key into the state machine.
+                if is_flush or is_cpr or not self._process_self_insert_run(key_press):
+                    self._process_coroutine.send(key_press)
             except Exception:
                 # If for some reason something goes wrong in the parser, (maybe
                 # an exception was raised) restart the processor for next time.
@@ -290,6 +298,75 @@ class KeyProcessor(object):
         if not is_flush:
             self._start_timeout()
 
+    def _get_handler_for_key(self, key_press):
+        """
+        Return the handler that the state machine would call for this single
+        key, when no other keys are pending. (Or `None`.)
+        """
+        matches = self._get_matches([key_press])
+        eager_matches = [m for m in matches if m.eager()]
+
+        if eager_matches:
+            return eager_matches[-1]
+        elif matches and not self._is_prefix_of_longer_match([key_press]):
+            return matches[-1]
+
+    def _process_self_insert_run(self, key_press):
+        """
+        When `key_press` starts a run of characters in the input queue that
+        are all handled by the 'self-insert' command, insert the rest of the
+        run at once, by calling the handler once for all of them. (This is
+        what happens when text is pasted in a terminal that doesn't support
+        bracketed paste.) Return `True` when this was done.
+        """
+        queue = self.input_queue
+
+        if (self.key_buffer or self.arg is not None or not queue or
+                not _is_character(key_press) or not _is_character(queue[0])):
+            return False
+
+        from .bindings.named_commands import get_by_name
+        self_insert = get_by_name('self-insert')
+
+        def get_self_insert_handler(key_press):
+            handler = self._get_handler_for_key(key_press)
+            if handler is not None and handler.handler == self_insert:
+                return handler
+
+        handler = get_self_insert_handler(key_press)
+        if handler is None:
+            return False
+
+        # Insert the first character on its own. Inserting text changes the
+        # state that the filters see (the completion, selection and
+        # validation state are reset, and `on_text_insert` handlers run), so
+        # the handlers for the rest of the run are only looked up after this.
+        self._call_handler(handler, key_sequence=[key_press])
+
+        # From here on, the state doesn't change anymore while the run is
+        # collected, so the filters are evaluated once for every distinct
+        # character in the run.
+        handlers = {}
+
+        def is_self_insert(key_press):
+            try:
+                handler = handlers[key_press.key]
+            except KeyError:
+                handler = handlers[key_press.key] = get_self_insert_handler(key_press)
+            return handler is not None
+
+        first = queue[0]
+        data = []
+
+        while queue and _is_character(queue[0]) and is_self_insert(queue[0]):
+            data.append(queue.popleft().data)
+
+        # Call the handler with one key press, containing all the text.
+        if data:
+            self._call_handler(handlers[first.key],
+                               key_sequence=[KeyPress(first.key, ''.join(data))])
+        return True
+
     def empty_queue(self):
         """
         Empty the input queue. Return the unprocessed input.
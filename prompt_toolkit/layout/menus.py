@@ -1,8 +1,10 @@
 from __future__ import unicode_literals
 
-from six.moves import zip_longest, range
+from six.moves import range
 from prompt_toolkit.application.current import get_app
+from prompt_toolkit.cache import SimpleCache
 from prompt_toolkit.filters import has_completions, is_done, Condition, to_filter
+from prompt_toolkit.formatted_text.utils import fragment_list_width
 from prompt_toolkit.mouse_events import MouseEventType
 from prompt_toolkit.utils import get_cwidth
 
@@ -34,6 +36,15 @@ class CompletionsMenuControl(UIControl):
     # of 1.)
     MIN_WIDTH = 7
 
+    def __init__(self):
+        self._widths = _CompletionWidths()
+
+        # Fragments of the menu items that were rendered before. Maps
+        # (index, is_current, menu_width, menu_meta_width) to fragments.
+        # (Cleared when the completion state changes.)
+        self._line_cache = SimpleCache(maxsize=500)
+        self._line_cache_state = None
+
     def has_focus(self):
         return False
 
@@ -68,7 +79,13 @@ class CompletionsMenuControl(UIControl):
             menu_meta_width = self._get_menu_meta_width(width - menu_width, complete_state)
             show_meta = self._show_meta(complete_state)
 
-            def get_line(i):
+            # Only reuse the fragments that were created for this completion
+            # state.
+            if self._line_cache_state is not complete_state:
+                self._line_cache.clear()
+                self._line_cache_state = complete_state
+
+            def create_line(i):
                 c = completions[i]
                 is_current_completion = (i == index)
                 result = self._get_menu_item_fragments(c, is_current_completion, menu_width)
@@ -77,6 +94,11 @@ class CompletionsMenuControl(UIControl):
                     result += self._get_menu_item_meta_fragments(c, is_current_completion, menu_meta_width)
                 return result
 
+            def get_line(i):
+                # (`show_meta` only depends on `menu_meta_width`.)
+                key = (i, i == index, menu_width, menu_meta_width)
+                return self._line_cache.get(key, lambda: create_line(i))
+
             return UIContent(get_line=get_line,
                              cursor_position=Point(x=0, y=index or 0),
                              line_count=len(completions))
@@ -87,22 +109,21 @@ class CompletionsMenuControl(UIControl):
         """
         Return ``True`` if we need to show a column with meta information.
         """
-        return any(c.display_meta for c in complete_state.completions)
+        return self._widths.get_meta_width(complete_state) > 0
 
     def _get_menu_width(self, max_width, complete_state):
         """
         Return the width of the main column.
         """
-        return min(max_width, max(self.MIN_WIDTH, max(get_cwidth(c.display)
-                   for c in complete_state.completions) + 2))
+        return min(max_width, max(self.MIN_WIDTH,
+                   self._widths.get_display_width(complete_state) + 2))
 
     def _get_menu_meta_width(self, max_width, complete_state):
         """
         Return the width of the meta column.
         """
         if self._show_meta(complete_state):
-            return min(max_width, max(get_cwidth(c.display_meta)
-                       for c in complete_state.completions) + 2)
+            return min(max_width, self._widths.get_meta_width(complete_state) + 2)
         else:
             return 0
 
@@ -113,9 +134,10 @@ class CompletionsMenuControl(UIControl):
         else:
             style_str = 'class:completion-menu.completion ' + completion.style
 
-        text, tw = _trim_text(completion.display, width - 2)
+        fragments, tw = _trim_formatted_text(completion.display_fragments, width - 2)
         padding = ' ' * (width - 2 - tw)
-        return [(style_str, ' %s%s ' % (text, padding))]
+
+        return _get_item_fragments(style_str, fragments, ' ', padding + ' ')
 
     def _get_menu_item_meta_fragments(self, completion, is_current_completion, width):
         if is_current_completion:
@@ -147,6 +169,53 @@ class CompletionsMenuControl(UIControl):
             b.complete_previous(count=3, disable_wrap_around=True)
 
 
+class _CompletionWidths(object):
+    """
+    Keep track of the maximum width of the `display` and `display_meta`
+    texts of the completions in a :class:`~prompt_toolkit.buffer.CompletionState`.
+
+    Completions are only appended to the completion state while they are
+    streaming in, so we only have to measure the new ones each time. When
+    another completion state is passed in, or when completions were removed,
+    everything is measured again.
+    """
+    def __init__(self):
+        self._complete_state = None
+        self._count = 0
+        self._display_width = 0
+        self._meta_width = 0
+
+    def _update(self, complete_state):
+        completions = complete_state.completions
+
+        if complete_state is not self._complete_state or len(completions) < self._count:
+            self._complete_state = complete_state
+            self._count = 0
+            self._display_width = 0
+            self._meta_width = 0
+
+        if len(completions) > self._count:
+            new_completions = completions[self._count:]
+            self._count = len(completions)
+
+            self._display_width = max(
+                self._display_width,
+                max(get_cwidth(c.display) for c in new_completions))
+            self._meta_width = max(
+                self._meta_width,
+                max(get_cwidth(c.display_meta) for c in new_completions))
+
+    def get_display_width(self, complete_state):
+        " Return the width of the widest `display` text. "
+        self._update(complete_state)
+        return self._display_width
+
+    def get_meta_width(self, complete_state):
+        " Return the width of the widest `display_meta` text. "
+        self._update(complete_state)
+        return self._meta_width
+
+
 def _trim_text(text, max_width):
     """
     Trim the text to `max_width`, append dots when the text is too long.
@@ -175,6 +244,64 @@ def _trim_text(text, max_width):
         return text, width
 
 
+def _trim_formatted_text(fragments, max_width):
+    """
+    Like `_trim_text`, but for a list of (style, text) tuples.
+    Returns (fragments, width) tuple.
+    """
+    if len(fragments) == 1:
+        style, text = fragments[0]
+        text, width = _trim_text(text, max_width)
+        return [(style, text)], width
+
+    width = fragment_list_width(fragments)
+
+    # When the text is too wide, trim it.
+    if width > max_width:
+        result = []
+        remaining_width = max_width - 3
+
+        for style, text in fragments:
+            for c in text:
+                char_width = get_cwidth(c)
+                if char_width > remaining_width:
+                    break
+                result.append((style, c))
+                remaining_width -= char_width
+            else:
+                continue
+            break
+
+        dots = '...'[:max_width]
+        result.append(('', dots))
+
+        return result, max(0, max_width - 3 - remaining_width) + len(dots)
+    else:
+        return fragments, width
+
+
+def _get_item_fragments(style_str, fragments, before, after):
+    """
+    Return the fragments for a menu item: `fragments` between the `before`
+    and `after` text, with `style_str` applied. (Consecutive fragments with
+    the same style are joined.)
+    """
+    result = [(style_str, before)]
+
+    for style, text in fragments + [('', after)]:
+        if style:
+            style = '%s %s' % (style_str, style)
+        else:
+            style = style_str
+
+        if style == result[-1][0]:
+            result[-1] = (style, result[-1][1] + text)
+        else:
+            result.append((style, text))
+
+    return result
+
+
 class CompletionsMenu(ConditionalContainer):
     # NOTE: We use a pretty big z_index by default. Menus are supposed to be
     #       above anything else. We also want to make sure that the content is
@@ -230,12 +357,13 @@ class MultiColumnCompletionMenuControl(UIControl):
         self.min_rows = min_rows
         self.suggested_max_column_width = suggested_max_column_width
         self.scroll = 0
+        self._widths = _CompletionWidths()
 
         # Info of last rendering.
         self._rendered_rows = 0
         self._rendered_columns = 0
+        self._rendered_column_width = 1
         self._total_columns = 0
-        self._render_pos_to_completion = {}
         self._render_left_arrow = False
         self._render_right_arrow = False
         self._render_width = 0
@@ -253,14 +381,16 @@ class MultiColumnCompletionMenuControl(UIControl):
         """
         complete_state = get_app().current_buffer.complete_state
         column_width = self._get_column_width(complete_state)
-        result = int(column_width * math.ceil(len(complete_state.completions) / float(self.min_rows)))
+        column_count = int(math.ceil(len(complete_state.completions) / float(self.min_rows)))
 
         # When the desired width is still more than the maximum available,
         # reduce by removing columns until we are less than the available
-        # width.
-        while result > column_width and result > max_available_width - self._required_margin:
-            result -= column_width
-        return result + self._required_margin
+        # width. (But keep at least one column.)
+        available_columns = (max_available_width - self._required_margin) // column_width
+        if column_count > 1:
+            column_count = max(1, min(column_count, available_columns))
+
+        return column_width * column_count + self._required_margin
 
     def preferred_height(self, width, max_available_height, wrap_lines):
         """
@@ -275,100 +405,93 @@ class MultiColumnCompletionMenuControl(UIControl):
     def create_content(self, width, height):
         """
         Create a UIContent object for this menu.
+
+        The completions are laid out column by column: the completion at
+        position (column, row) is ``completions[column * height + row]``. Only
+        the columns that are visible are rendered.
         """
         complete_state = get_app().current_buffer.complete_state
-        column_width = self._get_column_width(complete_state)
-        self._render_pos_to_completion = {}
 
-        def grouper(n, iterable, fillvalue=None):
-            " grouper(3, 'ABCDEFG', 'x') --> ABC DEF Gxx "
-            args = [iter(iterable)] * n
-            return zip_longest(fillvalue=fillvalue, *args)
+        if not complete_state:
+            return UIContent()
 
-        def is_current_completion(completion):
-            " Returns True when this completion is the currently selected one. "
-            return complete_state.complete_index is not None and c == complete_state.current_completion
+        completions = complete_state.completions
+        complete_index = complete_state.complete_index  # Can be None!
+        column_width = self._get_column_width(complete_state)
 
         # Space required outside of the regular columns, for displaying the
         # left and right arrow.
         HORIZONTAL_MARGIN_REQUIRED = 3
 
-        if complete_state:
-            # There should be at least one column, but it cannot be wider than
-            # the available width.
-            column_width = min(width - HORIZONTAL_MARGIN_REQUIRED, column_width)
-
-            # However, when the columns tend to be very wide, because there are
-            # some very wide entries, shrink it anyway.
-            if column_width > self.suggested_max_column_width:
-                # `column_width` can still be bigger that `suggested_max_column_width`,
-                # but if there is place for two columns, we divide by two.
-                column_width //= (column_width // self.suggested_max_column_width)
+        # There should be at least one column, but it cannot be wider than
+        # the available width.
+        column_width = min(width - HORIZONTAL_MARGIN_REQUIRED, column_width)
 
-            visible_columns = max(1, (width - self._required_margin) // column_width)
+        # However, when the columns tend to be very wide, because there are
+        # some very wide entries, shrink it anyway.
+        if column_width > self.suggested_max_column_width:
+            # `column_width` can still be bigger that `suggested_max_column_width`,
+            # but if there is place for two columns, we divide by two.
+            column_width //= (column_width // self.suggested_max_column_width)
 
-            columns_ = list(grouper(height, complete_state.completions))
-            rows_ = list(zip(*columns_))
+        visible_columns = max(1, (width - self._required_margin) // column_width)
+        total_columns = int(math.ceil(len(completions) / float(height)))
 
-            # Make sure the current completion is always visible: update scroll offset.
-            selected_column = (complete_state.complete_index or 0) // height
-            self.scroll = min(selected_column, max(self.scroll, selected_column - visible_columns + 1))
+        # Make sure the current completion is always visible: update scroll offset.
+        selected_column = (complete_index or 0) // height
+        self.scroll = min(selected_column, max(self.scroll, selected_column - visible_columns + 1))
 
-            render_left_arrow = self.scroll > 0
-            render_right_arrow = self.scroll < len(rows_[0]) - visible_columns
+        render_left_arrow = self.scroll > 0
+        render_right_arrow = self.scroll < total_columns - visible_columns
 
-            # Write completions to screen.
-            fragments_for_line = []
+        # Range of completion indexes that are visible.
+        rendered_columns = max(0, min(visible_columns, total_columns - self.scroll))
+        first_visible = self.scroll * height
+        last_visible = min(len(completions), first_visible + rendered_columns * height)
 
-            for row_index, row in enumerate(rows_):
-                fragments = []
-                middle_row = row_index == len(rows_) // 2
-
-                # Draw left arrow if we have hidden completions on the left.
-                if render_left_arrow:
-                    fragments += [('class:scrollbar', '<' if middle_row else ' ')]
+        def get_line(row_index):
+            fragments = []
+            middle_row = row_index == height // 2
 
-                # Draw row content.
-                for column_index, c in enumerate(row[self.scroll:][:visible_columns]):
-                    if c is not None:
-                        fragments += self._get_menu_item_fragments(c, is_current_completion(c), column_width)
+            # Draw left arrow if we have hidden completions on the left.
+            if render_left_arrow:
+                fragments.append(('class:scrollbar', '<' if middle_row else ' '))
 
-                        # Remember render position for mouse click handler.
-                        for x in range(column_width):
-                            self._render_pos_to_completion[(column_index * column_width + x, row_index)] = c
-                    else:
-                        fragments += [('class:completion', ' ' * column_width)]
+            # Draw row content.
+            for column_index in range(rendered_columns):
+                i = first_visible + column_index * height + row_index
 
-                # Draw trailing padding. (_get_menu_item_fragments only returns padding on the left.)
-                fragments += [('class:completion', ' ')]
+                if i < last_visible:
+                    fragments.extend(self._get_menu_item_fragments(
+                        completions[i], i == complete_index, column_width))
+                else:
+                    fragments.append(('class:completion', ' ' * column_width))
 
-                # Draw right arrow if we have hidden completions on the right.
-                if render_right_arrow:
-                    fragments += [('class:scrollbar', '>' if middle_row else ' ')]
+            # Draw trailing padding. (_get_menu_item_fragments only returns padding on the left.)
+            fragments.append(('class:completion', ' '))
 
-                # Newline.
-                fragments_for_line.append(fragments)
+            # Draw right arrow if we have hidden completions on the right.
+            if render_right_arrow:
+                fragments.append(('class:scrollbar', '>' if middle_row else ' '))
 
-        else:
-            fragments = []
+            return fragments
 
+        # Remember the layout for the mouse handler.
         self._rendered_rows = height
         self._rendered_columns = visible_columns
-        self._total_columns = len(columns_)
+        self._rendered_column_width = column_width
+        self._total_columns = total_columns
         self._render_left_arrow = render_left_arrow
         self._render_right_arrow = render_right_arrow
         self._render_width = column_width * visible_columns + render_left_arrow + render_right_arrow + 1
 
-        def get_line(i):
-            return fragments_for_line[i]
-
-        return UIContent(get_line=get_line, line_count=len(rows_))
+        return UIContent(get_line=get_line, line_count=height if completions else 0)
 
     def _get_column_width(self, complete_state):
         """
         Return the width of each column.
         """
-        return max(get_cwidth(c.display) for c in complete_state.completions) + 1
+        return self._widths.get_display_width(complete_state) + 1
 
     def _get_menu_item_fragments(self, completion, is_current_completion, width):
         if is_current_completion:
@@ -377,10 +500,10 @@ class MultiColumnCompletionMenuControl(UIControl):
         else:
             style_str = 'class:completion-menu.completion ' + completion.style
 
-        text, tw = _trim_text(completion.display, width)
+        fragments, tw = _trim_formatted_text(completion.display_fragments, width)
         padding = ' ' * (width - tw - 1)
 
-        return [(style_str, ' %s%s' % (text, padding))]
+        return _get_item_fragments(style_str, fragments, ' ', padding)
 
     def mouse_handler(self, mouse_event):
         """
@@ -418,10 +541,24 @@ class MultiColumnCompletionMenuControl(UIControl):
 
             # Mouse click on completion.
             else:
-                completion = self._render_pos_to_completion.get((x, y))
+                completion = self._get_completion_at_position(b.complete_state, x, y)
                 if completion:
                     b.apply_completion(completion)
 
+    def _get_completion_at_position(self, complete_state, x, y):
+        """
+        Return the completion that was rendered at this position, or `None`.
+        """
+        if not complete_state:
+            return None
+
+        column_index = (x - self._render_left_arrow) // self._rendered_column_width
+
+        if 0 <= column_index < self._rendered_columns and 0 <= y < self._rendered_rows:
+            i = (self.scroll + column_index) * self._rendered_rows + y
+            if i < len(complete_state.completions):
+                return complete_state.completions[i]
+
     def get_key_bindings(self):
         """
         Expose key bindings that handle the left/right arrow keys when the menu
@@ -490,9 +627,12 @@ class MultiColumnCompletionsMenu(HSplit):
         # we are returning the input.
         full_filter = has_completions & ~is_done & extra_filter
 
+        meta_control = _SelectedCompletionMetaControl()
+
         @Condition
         def any_completion_has_meta():
-            return any(c.display_meta for c in get_app().current_buffer.complete_state.completions)
+            complete_state = get_app().current_buffer.complete_state
+            return meta_control.get_meta_width(complete_state) > 0
 
         # Create child windows.
         completions_window = ConditionalContainer(
@@ -505,7 +645,7 @@ class MultiColumnCompletionsMenu(HSplit):
             filter=full_filter)
 
         meta_window = ConditionalContainer(
-            content=Window(content=_SelectedCompletionMetaControl()),
+            content=Window(content=meta_control),
             filter=show_meta & full_filter & any_completion_has_meta)
 
         # Initialise split.
@@ -519,6 +659,9 @@ class _SelectedCompletionMetaControl(UIControl):
     """
     Control that shows the meta information of the selected completion.
     """
+    def __init__(self):
+        self._widths = _CompletionWidths()
+
     def preferred_width(self, max_available_width):
         """
         Report the width of the longest meta text as the preferred width of this control.
@@ -530,10 +673,17 @@ class _SelectedCompletionMetaControl(UIControl):
         app = get_app()
         if app.current_buffer.complete_state:
             state = app.current_buffer.complete_state
-            return 2 + max(get_cwidth(c.display_meta) for c in state.completions)
+            return 2 + self.get_meta_width(state)
         else:
             return 0
 
+    def get_meta_width(self, complete_state):
+        """
+        Return the width of the longest meta text of the given completion
+        state. (Measured incrementally.)
+        """
+        return self._widths.get_meta_width(complete_state)
+
     def preferred_height(self, width, max_available_height, wrap_lines):
         return 1
 
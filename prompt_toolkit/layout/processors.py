@@ -13,6 +13,7 @@ from six.moves import range
 from prompt_toolkit.application.current import get_app
 from prompt_toolkit.cache import SimpleCache
 from prompt_toolkit.document import Document
+from prompt_toolkit.eventloop import run_in_executor
 from prompt_toolkit.filters import to_filter, vi_insert_multiple_mode
 from prompt_toolkit.formatted_text import to_formatted_text
 from prompt_toolkit.formatted_text.utils import fragment_list_len, fragment_list_to_text
@@ -21,6 +22,7 @@ from prompt_toolkit.utils import to_int, to_str
 
 from .utils import explode_text_fragments
 
+from bisect import bisect_left, bisect_right
 import re
 
 __all__ = [
@@ -102,13 +104,67 @@ class Transformation(object):
         transformed string.
     :param display_to_source: Cursor position transformed from source string to
         original string.
-    """
-    def __init__(self, fragments, source_to_display=None, display_to_source=None):
+    :param position_mapping: List that maps each position in the source
+        fragments (up to and including the position right after the last
+        character) to a position in the transformed fragments. This list has
+        to be non-decreasing. When given, `source_to_display` and
+        `display_to_source` are derived from it, and
+        :func:`.merge_processors` can compose the mappings of consecutive
+        processors into one lookup table.
+    """
+    def __init__(self, fragments, source_to_display=None, display_to_source=None,
+                 position_mapping=None):
+        assert position_mapping is None or (
+            len(position_mapping) > 0 and
+            source_to_display is None and display_to_source is None)
+
+        if position_mapping is not None:
+            source_to_display, display_to_source = _position_mapping_to_functions(
+                position_mapping)
+
+        # True when the cursor positions are not transformed.
+        self._is_identity = source_to_display is None and display_to_source is None
+
         self.fragments = fragments
+        self.position_mapping = position_mapping
         self.source_to_display = source_to_display or (lambda i: i)
         self.display_to_source = display_to_source or (lambda i: i)
 
 
+def _position_mapping_to_functions(position_mapping):
+    """
+    Create the `source_to_display` and `display_to_source` functions for a
+    position mapping. Positions beyond the mapping are extrapolated.
+    """
+    last = len(position_mapping) - 1
+
+    def source_to_display(i):
+        if 0 <= i <= last:
+            return position_mapping[i]
+        elif i > last:
+            return position_mapping[last] + i - last
+        else:
+            return position_mapping[0] + i
+
+    def display_to_source(i):
+        # Take the last source position that is displayed at or before this
+        # position.
+        if i > position_mapping[last]:
+            return last + i - position_mapping[last]
+        else:
+            return max(0, bisect_right(position_mapping, i) - 1)
+
+    return source_to_display, display_to_source
+
+
+def _shift_position_mapping(fragments, shift_position):
+    """
+    Position mapping for a processor that inserts `shift_position` characters
+    before the given fragments.
+    """
+    return list(range(shift_position, shift_position + fragment_list_len(fragments) + 1))
+
+
 class DummyProcessor(Processor):
     """
     A `Processor` that doesn't do anything.
@@ -128,12 +184,76 @@ class HighlightSearchProcessor(Processor):
     _classname = 'search'
     _classname_current = 'search.current'
 
+    # Documents that are bigger than this (number of characters) are searched
+    # in a background thread. Until the search matches are known, only the
+    # visible lines are searched.
+    _background_search_size = 100000
+
     def _get_search_text(self, buffer_control):
         """
         The text we are searching for.
         """
         return buffer_control.search_state.text
 
+    def _get_search_matches(self, document, search_text, ignore_case):
+        """
+        Return the positions of all search matches in the document, or `None`
+        if they are still being computed.
+        """
+        if (len(document.text) < self._background_search_size or
+                document.has_cached_search_matches(search_text, ignore_case=ignore_case)):
+            return document.get_search_matches(search_text, ignore_case=ignore_case)
+
+        # (Don't keep the text in this set. The cache belongs to the text.)
+        key = (id(document._cache), search_text, ignore_case)
+
+        # The searches that are running. (Created here, because subclasses
+        # don't always call `__init__`.)
+        searching = getattr(self, '_searching', None)
+        if searching is None:
+            searching = self._searching = set()
+
+        if key not in searching:
+            searching.add(key)
+            app = get_app()
+
+            def search():
+                document.get_search_matches(search_text, ignore_case=ignore_case)
+
+            def done(_):
+                searching.discard(key)
+                app.invalidate()
+
+            run_in_executor(search).add_done_callback(done)
+
+    def _get_line_matches(self, document, lineno, search_text, ignore_case):
+        """
+        Return the (start, end) columns of the search matches at this line.
+        """
+        line = document.lines[lineno]
+        matches = self._get_search_matches(document, search_text, ignore_case)
+
+        # Search matches not yet available. Search in this line only.
+        if matches is None:
+            flags = re.IGNORECASE if ignore_case else 0
+            return [(m.start(), m.end()) for m in re.finditer(
+                re.escape(search_text), line, flags=flags)]
+
+        # Take the matches that start in this line. (Skip the overlapping
+        # ones.)
+        line_start = document.translate_row_col_to_index(lineno, 0)
+        result = []
+        end = 0
+
+        for i in range(bisect_left(matches, line_start),
+                       bisect_right(matches, line_start + len(line) - len(search_text))):
+            start = matches[i] - line_start
+            if start >= end:
+                end = start + len(search_text)
+                result.append((start, end))
+
+        return result
+
     def apply_transformation(self, transformation_input):
         buffer_control, document, lineno, source_to_display, fragments, _, _ = transformation_input.unpack()
 
@@ -143,32 +263,28 @@ class HighlightSearchProcessor(Processor):
 
         if search_text and not get_app().is_done:
             # For each search match, replace the style string.
-            line_text = fragment_list_to_text(fragments)
             fragments = explode_text_fragments(fragments)
-
-            if buffer_control.search_state.ignore_case():
-                flags = re.IGNORECASE
-            else:
-                flags = 0
+            ignore_case = buffer_control.search_state.ignore_case()
 
             # Get cursor column.
             if document.cursor_position_row == lineno:
-                cursor_column = source_to_display(document.cursor_position_col)
+                cursor_column = document.cursor_position_col
             else:
                 cursor_column = None
 
-            for match in re.finditer(re.escape(search_text), line_text, flags=flags):
+            for start, end in self._get_line_matches(document, lineno, search_text, ignore_case):
                 if cursor_column is not None:
-                    on_cursor = match.start() <= cursor_column < match.end()
+                    on_cursor = start <= cursor_column < end
                 else:
                     on_cursor = False
 
-                for i in range(match.start(), match.end()):
-                    old_fragment, text = fragments[i]
-                    if on_cursor:
-                        fragments[i] = (old_fragment + searchmatch_current_fragment, fragments[i][1])
-                    else:
-                        fragments[i] = (old_fragment + searchmatch_fragment, fragments[i][1])
+                for i in range(source_to_display(start), source_to_display(end)):
+                    if i < len(fragments):
+                        old_fragment, text = fragments[i]
+                        if on_cursor:
+                            fragments[i] = (old_fragment + searchmatch_current_fragment, text)
+                        else:
+                            fragments[i] = (old_fragment + searchmatch_fragment, text)
 
         return Transformation(fragments)
 
@@ -252,7 +368,8 @@ class HighlightMatchingBracketProcessor(Processor):
         cursor is within this distance. (From inside a `Processor`, we can't
         know which lines will be visible on the screen. But we also don't want
         to scan the whole document for matching brackets on each key press, so
-        we limit to this value.)
+        we limit to this value.) `None` means no limit: then the brackets of
+        the whole document are indexed, once for every text.
     """
     _closing_braces = '])}>'
 
@@ -262,24 +379,27 @@ class HighlightMatchingBracketProcessor(Processor):
 
         self._positions_cache = SimpleCache(maxsize=8)
 
+    def _find_matching_bracket_position(self, document):
+        if self.max_cursor_distance is None:
+            return document.find_matching_bracket_position()
+        else:
+            return document.find_matching_bracket_position(
+                start_pos=document.cursor_position - self.max_cursor_distance,
+                end_pos=document.cursor_position + self.max_cursor_distance)
+
     def _get_positions_to_highlight(self, document):
         """
         Return a list of (row, col) tuples that need to be highlighted.
         """
         # Try for the character under the cursor.
         if document.current_char and document.current_char in self.chars:
-            pos = document.find_matching_bracket_position(
-                    start_pos=document.cursor_position - self.max_cursor_distance,
-                    end_pos=document.cursor_position + self.max_cursor_distance)
+            pos = self._find_matching_bracket_position(document)
 
         # Try for the character before the cursor.
         elif (document.char_before_cursor and document.char_before_cursor in
               self._closing_braces and document.char_before_cursor in self.chars):
             document = Document(document.text, document.cursor_position - 1)
-
-            pos = document.find_matching_bracket_position(
-                    start_pos=document.cursor_position - self.max_cursor_distance,
-                    end_pos=document.cursor_position + self.max_cursor_distance)
+            pos = self._find_matching_bracket_position(document)
         else:
             pos = None
 
@@ -377,16 +497,13 @@ class BeforeInput(Processor):
             fragments_before = to_formatted_text(self.text, self.style)
             fragments = fragments_before + ti.fragments
 
-            shift_position = fragment_list_len(fragments_before)
-            source_to_display = lambda i: i + shift_position
-            display_to_source = lambda i: i - shift_position
+            position_mapping = _shift_position_mapping(
+                ti.fragments, fragment_list_len(fragments_before))
         else:
             fragments = ti.fragments
-            source_to_display = None
-            display_to_source = None
+            position_mapping = None
 
-        return Transformation(fragments, source_to_display=source_to_display,
-                              display_to_source=display_to_source)
+        return Transformation(fragments, position_mapping=position_mapping)
 
     def __repr__(self):
         return 'BeforeInput(%r, %r)' % (self.text, self.style)
@@ -567,12 +684,12 @@ class TabsProcessor(Processor):
         # Transform fragments.
         fragments = explode_text_fragments(ti.fragments)
 
-        position_mappings = {}
+        position_mapping = []
         result_fragments = []
         pos = 0
 
-        for i, fragment_and_text in enumerate(fragments):
-            position_mappings[i] = pos
+        for fragment_and_text in fragments:
+            position_mapping.append(pos)
 
             if fragment_and_text[1] == '\t':
                 # Calculate how many characters we have to insert.
@@ -588,30 +705,11 @@ class TabsProcessor(Processor):
                 result_fragments.append(fragment_and_text)
                 pos += 1
 
-        position_mappings[len(fragments)] = pos
-        # Add `pos+1` to mapping, because the cursor can be right after the
-        # line as well.
-        position_mappings[len(fragments) + 1] = pos + 1
-
-        def source_to_display(from_position):
-            " Maps original cursor position to the new one. "
-            return position_mappings[from_position]
-
-        def display_to_source(display_pos):
-            " Maps display cursor position to the original one. "
-            position_mappings_reversed = dict((v, k) for k, v in position_mappings.items())
+        # Add the position after the line. (The cursor can be there as well.
+        # Positions after that one are extrapolated.)
+        position_mapping.append(pos)
 
-            while display_pos >= 0:
-                try:
-                    return position_mappings_reversed[display_pos]
-                except KeyError:
-                    display_pos -= 1
-            return 0
-
-        return Transformation(
-            result_fragments,
-            source_to_display=source_to_display,
-            display_to_source=display_to_source)
+        return Transformation(result_fragments, position_mapping=position_mapping)
 
 
 class ReverseSearchProcessor(Processor):
@@ -712,16 +810,13 @@ class ReverseSearchProcessor(Processor):
                 ('', "': "),
             ] + line_fragments
 
-            shift_position = fragment_list_len(fragments_before)
-            source_to_display = lambda i: i + shift_position
-            display_to_source = lambda i: i - shift_position
+            position_mapping = _shift_position_mapping(
+                ti.fragments, fragment_list_len(fragments_before))
         else:
-            source_to_display = None
-            display_to_source = None
+            position_mapping = None
             fragments = ti.fragments
 
-        return Transformation(fragments, source_to_display=source_to_display,
-                              display_to_source=display_to_source)
+        return Transformation(fragments, position_mapping=position_mapping)
 
 
 class ConditionalProcessor(Processor):
@@ -796,6 +891,13 @@ class _MergedProcessor(Processor):
         display_to_source_functions = []
         fragments = ti.fragments
 
+        # The position mappings of consecutive processors are composed into
+        # one lookup table, as long as every processor that transforms the
+        # positions provides a `position_mapping`. Processors that don't
+        # transform the positions are skipped altogether.
+        position_mapping = None
+        compiled = True
+
         def source_to_display(i):
             """ Translate x position from the buffer to the x position in the
             processor fragments list. """
@@ -808,8 +910,29 @@ class _MergedProcessor(Processor):
                 ti.buffer_control, ti.document, ti.lineno,
                 source_to_display, fragments, ti.width, ti.height))
             fragments = transformation.fragments
-            display_to_source_functions.append(transformation.display_to_source)
-            source_to_display_functions.append(transformation.source_to_display)
+
+            if transformation._is_identity:
+                continue
+
+            if compiled and transformation.position_mapping is not None:
+                if position_mapping is None:
+                    position_mapping = transformation.position_mapping
+                else:
+                    f = transformation.source_to_display
+                    position_mapping = [f(i) for i in position_mapping]
+
+                # Replace the functions by a lookup in the composed mapping.
+                s2d, d2s = _position_mapping_to_functions(position_mapping)
+                source_to_display_functions[1:] = [s2d]
+                display_to_source_functions[:] = [d2s]
+            else:
+                compiled = False
+                display_to_source_functions.append(transformation.display_to_source)
+                source_to_display_functions.append(transformation.source_to_display)
+
+        # Everything could be composed (or nothing was transformed).
+        if compiled:
+            return Transformation(fragments, position_mapping=position_mapping)
 
         def display_to_source(i):
             for f in reversed(display_to_source_functions):
@@ -0,0 +1,130 @@
+"""
+Timing of the operations that run in the background while typing:
+completion, auto suggestion and validation.
+
+Pass a `metrics_handler` to the :class:`~prompt_toolkit.application.Application`
+in order to receive a :class:`.Timing` for every operation. (For instance, to
+forward them to a monitoring system.)::
+
+    def handler(timing):
+        print(timing.kind, timing.duration, timing.item_count)
+
+    app = Application(..., metrics_handler=handler)
+
+When there is no handler, nothing is measured.
+"""
+from __future__ import unicode_literals
+from prompt_toolkit.eventloop import call_from_executor
+import time
+
+__all__ = [
+    'Timing',
+]
+
+
+class Timing(object):
+    """
+    Timing of one completion, auto suggestion or validation.
+
+    :param kind: What was timed. One of:
+
+        - 'completion': Retrieving the completions of a
+          :class:`~prompt_toolkit.buffer.Buffer`.
+        - 'completer': Retrieving the completions of a completer in a
+          wrapper, like a :class:`~prompt_toolkit.completion.ThreadedCompleter`
+          or the completers of `merge_completers`.
+        - 'auto_suggest': Retrieving an auto suggestion.
+        - 'validation': Validating the input while typing.
+
+    :param source: The completer, auto suggest or validator.
+    """
+    def __init__(self, kind, source, handler=None):
+        assert handler is None or callable(handler)
+
+        self.kind = kind
+        self.source = source
+        self.handler = handler
+
+        #: `time.time` values.
+        self.start_time = time.time()
+        self.first_item_time = None
+        self.end_time = None
+
+        #: Number of completions. (Or 1 for a suggestion.)
+        self.item_count = 0
+
+        #: True when the result was not needed anymore, because the input
+        #: changed.
+        self.cancelled = False
+
+        #: True when the completion or auto suggestion is restarted for the new
+        #: input, because it was cancelled. (A validation that is cancelled
+        #: is started again as a new operation, with its own timing.)
+        self.retried = False
+
+    def __repr__(self):
+        return '%s(kind=%r, source=%r, duration=%r, item_count=%r)' % (
+            self.__class__.__name__, self.kind, self.source, self.duration,
+            self.item_count)
+
+    def add_item(self, count=1):
+        " Call this when `count` items are received. "
+        if self.first_item_time is None:
+            self.first_item_time = time.time()
+        self.item_count += count
+
+    @property
+    def time_to_first_item(self):
+        " Seconds until the first item was received, or `None`. "
+        if self.first_item_time is not None:
+            return self.first_item_time - self.start_time
+
+    @property
+    def duration(self):
+        " Seconds until the operation finished, or `None`. "
+        if self.end_time is not None:
+            return self.end_time - self.start_time
+
+    def finish(self, cancelled=None):
+        " Call this when the operation is done. "
+        self.end_time = time.time()
+
+        if cancelled is not None:
+            self.cancelled = cancelled
+
+    def report(self):
+        " Pass this timing to the handler. "
+        if self.handler is not None:
+            self.handler(self)
+
+
+def start_timing(kind, source):
+    """
+    Return a new :class:`.Timing`, or `None` when the running application has
+    no `metrics_handler`. (That way, nothing is measured when it's not needed.)
+    """
+    # (Imported here, because of circular imports.)
+    from prompt_toolkit.application.current import get_app
+
+    app = get_app(return_none=True)
+
+    if app is not None and app.metrics_handler is not None:
+        return Timing(kind, source, handler=app.metrics_handler)
+
+
+def timed_iterable(timing, iterable, cancelled=lambda: False):
+    """
+    Yield the items of `iterable`, and count them in `timing`. The timing is
+    reported from the event loop when it's done. (The iterable can be consumed
+    in another thread.)
+
+    :param cancelled: Callable that returns True when the result is not
+        needed anymore.
+    """
+    try:
+        for item in iterable:
+            timing.add_item()
+            yield item
+    finally:
+        timing.finish(cancelled=cancelled())
+        call_from_executor(timing.report)
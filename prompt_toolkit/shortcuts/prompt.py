@@ -310,6 +310,9 @@ class PromptSession(object):
                 value = locals()[name]
                 setattr(self, name, value)
 
+        # The `ThreadedCompleter` for `completer`. (See `_get_completer`.)
+        self._threaded_completer = None
+
         # Create buffers, layout and Application.
         self.history = history
         self.default_buffer = self._create_default_buffer()
@@ -356,15 +359,28 @@ class PromptSession(object):
             validate_while_typing=dyncond('validate_while_typing'),
             enable_history_search=dyncond('enable_history_search'),
             validator=DynamicValidator(lambda: self.validator),
-            completer=DynamicCompleter(lambda:
-                ThreadedCompleter(self.completer)
-                if self.complete_in_thread and self.completer
-                else self.completer),
+            completer=DynamicCompleter(self._get_completer),
             history=self.history,
             auto_suggest=DynamicAutoSuggest(lambda: self.auto_suggest),
             accept_handler=accept,
             tempfile_suffix=lambda: self.tempfile_suffix)
 
+    def _get_completer(self):
+        """
+        Return the completer for the default buffer. (With
+        `complete_in_thread`, the `ThreadedCompleter` is created once for
+        every completer.)
+        """
+        completer = self.completer
+
+        if self.complete_in_thread and completer:
+            threaded = self._threaded_completer
+            if threaded is None or threaded.completer is not completer:
+                threaded = self._threaded_completer = ThreadedCompleter(completer)
+            return threaded
+
+        return completer
+
     def _create_search_buffer(self):
         return Buffer(name=SEARCH_BUFFER)
 
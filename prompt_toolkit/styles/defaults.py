@@ -79,6 +79,13 @@ PROMPT_TOOLKIT_STYLE = [
     ('completion-menu.meta.completion.current', 'bg:#aaaaaa #000000'),
     ('completion-menu.multi-column-meta',       'bg:#aaaaaa #000000'),
 
+    # Fuzzy matches in completion menu. (For `FuzzyCompleter`.)
+    ('completion-menu.completion fuzzymatch.outside',         'fg:#444444'),
+    ('completion-menu.completion fuzzymatch.inside',          'bold'),
+    ('completion-menu.completion fuzzymatch.inside.character', 'underline'),
+    ('completion-menu.completion.current fuzzymatch.outside', 'fg:default'),
+    ('completion-menu.completion.current fuzzymatch.inside',  'nobold'),
+
     # Scrollbars.
     ('scrollbar.background',                     'bg:#aaaaaa'),
     ('scrollbar.button',                         'bg:#444444'),
@@ -0,0 +1,221 @@
+"""
+Undo stack that stores the edits between the states, instead of a copy of the
+text for every state.
+"""
+from __future__ import unicode_literals
+from collections import deque
+
+__all__ = [
+    'UndoStack',
+]
+
+
+class UndoStack(object):
+    """
+    Stack of (text, cursor_position) states.
+
+    Only the text of the most recent state is kept as a whole. Every older
+    state is stored as the edit that turns the state above it back into it:
+    a `(start, end, text, cursor_position)` tuple, meaning that the text of
+    that state is ``next_text[:start] + text + next_text[end:]``. The memory
+    use is proportional to what was edited, not to the size of the document.
+    (When the text was replaced as a whole, the edit holds a full copy of the
+    previous text.)
+
+    :param max_size: Maximum number of characters that the stored edits can
+        take. Every edit counts as its removed text plus `edit_overhead`
+        characters, so that edits which only insert text are bounded too.
+        When this is exceeded, the oldest states are dropped.
+    :param group_inserts: When True, consecutive insertions of text in the
+        same word are grouped into one state. (Undoing them happens at once.)
+    """
+    #: Size of an edit, apart from its text. (This accounts for the tuple.)
+    edit_overhead = 32
+
+    def __init__(self, max_size=10000000, group_inserts=False):
+        assert max_size is None or (isinstance(max_size, int) and max_size >= 0)
+
+        self.max_size = max_size
+        self.group_inserts = group_inserts
+
+        self._edits = deque()
+        self._size = 0  # Total size of `_edits`. (See `_edit_size`.)
+        self._text = None  # Text of the top state.
+        self._cursor_position = None  # Cursor position of the top state.
+
+    def __repr__(self):
+        return '%s(len=%r, size=%r)' % (
+            self.__class__.__name__, len(self), self._size)
+
+    def __len__(self):
+        if self._text is None:
+            return 0
+        else:
+            return len(self._edits) + 1
+
+    def __bool__(self):
+        return self._text is not None
+
+    __nonzero__ = __bool__  # For Python 2.
+
+    @property
+    def text(self):
+        " The text of the top state. (`None` when the stack is empty.) "
+        return self._text
+
+    def clear(self):
+        " Remove all states. "
+        self._edits.clear()
+        self._size = 0
+        self._text = None
+        self._cursor_position = None
+
+    def push(self, text, cursor_position):
+        """
+        Push a new state. When `text` equals the text of the top state, only
+        the cursor position of the top state is updated.
+        """
+        top_text = self._text
+
+        if top_text is None:
+            self._text = text
+            self._cursor_position = cursor_position
+            return
+
+        # Same text as the top state? Only update the cursor position.
+        if len(text) == len(top_text) and text == top_text:
+            self._cursor_position = cursor_position
+            return
+
+        # Turn the top state into an edit that restores it from the new text.
+        start = _common_prefix_length(top_text, text)
+        suffix = _common_suffix_length(top_text, text, start)
+        end = len(text) - suffix
+        removed = top_text[start:len(top_text) - suffix]
+
+        if self.group_inserts and not removed and self._extends_insert(start, text[start:end]):
+            # Extend the insert that restores the state below the top state,
+            # and drop the top state itself.
+            previous_start, previous_end, _, cursor = self._edits.pop()
+            self._edits.append((previous_start, end, '', cursor))
+        else:
+            self._edits.append((start, end, removed, self._cursor_position))
+            self._size += self._edit_size(removed)
+
+        self._text = text
+        self._cursor_position = cursor_position
+
+        self._compact()
+
+    def _extends_insert(self, position, inserted):
+        """
+        True when inserting `inserted` at `position` in the top text continues
+        the insertion that the top edit restores. (Only within the same word,
+        so that undo still happens per word.)
+        """
+        if not self._edits:
+            return False
+
+        start, end, removed, _ = self._edits[-1]
+
+        if removed or start == end or end != position or '\n' in inserted:
+            return False
+
+        # Starting a new word after whitespace starts a new group.
+        return not (self._text[end - 1].isspace() and not inserted[0].isspace())
+
+    def pop(self):
+        """
+        Remove the top state and return its `(text, cursor_position)`.
+        """
+        if self._text is None:
+            raise IndexError('pop from empty undo stack')
+
+        result = self._text, self._cursor_position
+
+        if self._edits:
+            start, end, text, cursor_position = self._edits.pop()
+            self._size -= self._edit_size(text)
+            self._text = self._text[:start] + text + self._text[end:]
+            self._cursor_position = cursor_position
+        else:
+            self._text = None
+            self._cursor_position = None
+
+        return result
+
+    def _compact(self):
+        " Drop the oldest states until the edits fit in `max_size`. "
+        if self.max_size is not None:
+            edits = self._edits
+
+            while edits and self._size > self.max_size:
+                self._size -= self._edit_size(edits.popleft()[2])
+
+    def _edit_size(self, removed):
+        " Size of an edit that restores the text `removed`. "
+        return len(removed) + self.edit_overhead
+
+
+def _common_prefix_length(a, b):
+    """
+    Return the length of the common prefix of the strings `a` and `b`.
+    (Compare slices that grow, so that a long common prefix is compared by
+    a few string comparisons, instead of character by character.)
+    """
+    limit = min(len(a), len(b))
+    start = 0
+    size = 64
+
+    while True:
+        if start >= limit:
+            return limit
+
+        end = min(start + size, limit)
+        if a[start:end] != b[start:end]:
+            break
+
+        start = end
+        size *= 2
+
+    # The first difference is in `a[start:end]`, do a binary search.
+    while end - start > 1:
+        middle = (start + end) // 2
+        if a[start:middle] == b[start:middle]:
+            start = middle
+        else:
+            end = middle
+
+    return start
+
+
+def _common_suffix_length(a, b, prefix_length=0):
+    """
+    Return the length of the common suffix of the strings `a` and `b`, not
+    overlapping with the first `prefix_length` characters.
+    """
+    len_a = len(a)
+    len_b = len(b)
+    limit = min(len_a, len_b) - prefix_length
+    start = 0
+    size = 64
+
+    while True:
+        if start >= limit:
+            return limit
+
+        end = min(start + size, limit)
+        if a[len_a - end:len_a - start] != b[len_b - end:len_b - start]:
+            break
+
+        start = end
+        size *= 2
+
+    while end - start > 1:
+        middle = (start + end) // 2
+        if a[len_a - middle:len_a - start] == b[len_b - middle:len_b - start]:
+            start = middle
+        else:
+            end = middle
+
+    return start
@@ -1,6 +1,10 @@
 from __future__ import unicode_literals
 from prompt_toolkit.eventloop import consume_async_generator
 from prompt_toolkit.eventloop import get_event_loop, ensure_future, From, AsyncGeneratorItem, Future, generator_to_async_generator
+from prompt_toolkit.eventloop.utils import WorkerPool, call_later
+
+import threading
+import time
 
 
 def _async_generator():
@@ -75,3 +79,50 @@ def test_generator_to_async_generator():
 
     # Check that `consume_async_generator` didn't fail.
     assert f.result() is None
+
+
+def test_worker_pool_runs_functions_at_the_same_time():
+    """
+    Functions that are submitted together run in different threads, as long
+    as there are threads left.
+    """
+    pool = WorkerPool(max_workers=2)
+    second_started = threading.Event()
+
+    # Start with one idle thread.
+    get_event_loop().run_until_complete(pool.run_in_executor(lambda: None))
+    while pool._idle_count == 0:
+        time.sleep(.01)
+
+    f1 = pool.run_in_executor(lambda: second_started.wait(5))
+    f2 = pool.run_in_executor(second_started.set)
+
+    get_event_loop().run_until_complete(f1)
+    assert f1.result()
+    assert pool._thread_count == 2
+
+
+def test_call_later():
+    " The callbacks are called in the order of their time. "
+    called = []
+    done = Future()
+
+    call_later(.2, lambda: done.set_result(called.append(2)))
+    call_later(.1, lambda: called.append(1))
+
+    get_event_loop().run_until_complete(done)
+    assert called == [1, 2]
+
+
+def test_worker_pool_idle_timeout():
+    " Idle threads stop. "
+    pool = WorkerPool(max_workers=2, idle_timeout=.05)
+
+    get_event_loop().run_until_complete(pool.run_in_executor(lambda: None))
+    while pool._thread_count:
+        time.sleep(.01)
+
+    # And new threads are started when needed.
+    f = pool.run_in_executor(lambda: 1)
+    get_event_loop().run_until_complete(f)
+    assert f.result() == 1
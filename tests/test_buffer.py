@@ -1,8 +1,23 @@
 from __future__ import unicode_literals
 
-from prompt_toolkit.buffer import Buffer
+from prompt_toolkit.application import Application
+from prompt_toolkit.application.current import set_app
+from prompt_toolkit.auto_suggest import AutoSuggest, Suggestion
+from prompt_toolkit.buffer import Buffer, indent, reshape_text
+from prompt_toolkit.completion import CompleteEvent, Completer, Completion, DynamicCompleter, ThreadedCompleter, WordCompleter
+from prompt_toolkit.document import Document
+from prompt_toolkit.eventloop import Future, call_from_executor, consume_async_generator, ensure_future, get_event_loop
+from prompt_toolkit.eventloop.utils import call_later
+from prompt_toolkit.history import InMemoryHistory
+from prompt_toolkit.input import DummyInput
+from prompt_toolkit.metrics import start_timing
+from prompt_toolkit.output import DummyOutput
+from prompt_toolkit.search import SearchDirection, SearchState
+from prompt_toolkit.validation import Validator
 
 import pytest
+import threading
+import time
 
 
 @pytest.fixture
@@ -110,3 +125,371 @@ def test_swap_characters_before_cursor(_buffer):
     _buffer.swap_characters_before_cursor()
 
     assert _buffer.text == 'hello wrold'
+
+
+def test_line_indexes_follow_edits(_buffer):
+    _buffer.insert_text('line 1\nline 2\nline 3')
+    assert _buffer.document.lines[2] == 'line 3'
+
+    def assert_line_indexes(expected):
+        # The indexes are derived from the previous document, and equal the
+        # ones computed from the text.
+        assert _buffer.document._cache.line_indexes == expected
+        assert [0] + [i + 1 for i, c in enumerate(_buffer.text) if c == '\n'] == expected
+
+    _buffer.cursor_position = 8
+    _buffer.insert_text('a\nb\n')
+    assert_line_indexes([0, 7, 10, 12, 18])
+    assert _buffer.document.lines == ['line 1', 'la', 'b', 'ine 2', 'line 3']
+
+    _buffer.cursor_position = 4
+    _buffer.insert_text('XXXX\n', overwrite=True)
+    assert _buffer.text == 'lineXXXX\n\nla\nb\nine 2\nline 3'
+    assert_line_indexes([0, 9, 10, 13, 15, 21])
+
+    _buffer.cursor_position = 11
+    _buffer.delete(3)
+    assert_line_indexes([0, 9, 10, 12, 18])
+
+    _buffer.delete_before_cursor(3)
+    assert _buffer.text == 'lineXXXX\nine 2\nline 3'
+    assert_line_indexes([0, 9, 15])
+
+
+def test_documents_share_cache_of_text(_buffer):
+    _buffer.insert_text('line 1\nline 2')
+    document = _buffer.document
+    document.lines
+
+    # Moving the cursor creates a new document with the same cache.
+    _buffer.cursor_position = 3
+    assert _buffer.document is not document
+    assert _buffer.document._cache is document._cache
+    assert _buffer.document.cursor_position == 3
+
+    # Changing the text gives a new cache.
+    _buffer.insert_text('x')
+    assert _buffer.document._cache is not document._cache
+    assert _buffer.document.lines == ['linxe 1', 'line 2']
+
+    # Setting the text as a whole too.
+    _buffer.text = 'line 1\nline 2'
+    assert _buffer.document._cache is not document._cache
+    assert _buffer.document.lines == ['line 1', 'line 2']
+
+
+def test_search_history():
+    history = InMemoryHistory()
+    for string in ['echo Hello', 'ls', 'echo world', 'cd']:
+        history.append_string(string)
+
+    buff = Buffer(history=history)
+    backward = SearchState('echo', direction=SearchDirection.BACKWARD)
+    assert buff._search(backward) == (2, 0)
+    assert buff._search(backward, count=2) == (0, 0)
+
+    # Case insensitive.
+    assert buff._search(SearchState(
+        'hello', direction=SearchDirection.BACKWARD, ignore_case=True)) == (0, 5)
+    assert buff._search(SearchState(
+        'hello', direction=SearchDirection.BACKWARD)) is None
+
+    # Edited history entries are searched.
+    buff.working_index = 1
+    buff.text = 'echo again'
+    buff.working_index = 4
+    assert buff._search(backward) == (2, 0)
+    assert buff._search(backward, count=2) == (1, 0)
+
+    # Going forward wraps around to the first entry.
+    buff.working_index = 2
+    assert buff._search(SearchState('echo')) == (0, 0)
+
+
+def test_working_lines_read_from_history():
+    history = InMemoryHistory()
+    for string in ['a', 'b', 'c']:
+        history.append_string(string)
+
+    buff = Buffer(history=history)
+    lines = buff._working_lines
+    assert list(lines) == ['a', 'b', 'c', '']
+
+    # Only edited lines are stored.
+    buff.insert_text('d')
+    buff.working_index = 1
+    buff.text = 'B'
+    assert list(lines) == ['a', 'B', 'c', 'd']
+    assert lines[1:] == ['B', 'c', 'd']
+    assert lines[-1] == 'd'
+    assert history.get_strings() == ['a', 'b', 'c']
+    assert len(lines._edited) == 2
+
+    # Strings that are loaded later are inserted at the start.
+    history.get_strings().insert(0, 'z')
+    history.get_item_loaded_event().fire()
+    assert list(lines) == ['z', 'a', 'B', 'c', 'd']
+    assert buff.working_index == 2
+
+    # Appended strings are not.
+    history.append_string('e')
+    assert list(lines) == ['z', 'a', 'B', 'c', 'd']
+
+    buff.reset()
+    assert list(buff._working_lines) == ['z', 'a', 'b', 'c', 'e', '']
+
+
+def test_incremental_search_narrows_matches():
+    history = InMemoryHistory()
+    for string in ['abc', 'abd', 'xab']:
+        history.append_string(string)
+
+    buff = Buffer(history=history)
+
+    def search(text):
+        return buff._search(SearchState(text, direction=SearchDirection.BACKWARD),
+                            include_current_position=True)
+
+    assert search('a') == (2, 1)
+    assert search('ab') == (2, 1)
+    assert search('abc') == (0, 0)
+    assert search('abcd') is None
+
+    # Removing a character searches again.
+    assert search('ab') == (2, 1)
+    assert search('abd') == (1, 0)
+
+
+def test_batch_edit(_buffer):
+    events = []
+    _buffer.on_text_changed += lambda sender: events.append('text')
+    _buffer.on_cursor_position_changed += lambda sender: events.append('cursor')
+    _buffer.on_text_insert += lambda sender: events.append('insert')
+
+    _buffer.insert_text('abc')
+    assert events == ['text', 'cursor', 'insert']
+    del events[:]
+
+    with _buffer.batch_edit():
+        for i in range(3):
+            _buffer.insert_text('\nline %i' % i)
+
+        with _buffer.batch_edit():
+            _buffer.cursor_position = 0
+            _buffer.delete()
+
+        assert events == []
+
+    assert events == ['text', 'cursor', 'insert']
+    assert _buffer.text == 'bc\nline 0\nline 1\nline 2'
+
+    # The batch is one undo step.
+    _buffer.undo()
+    assert _buffer.text == 'abc'
+
+
+def test_transformations_are_one_undo_step():
+    def check(transform):
+        buff = Buffer(multiline=True)
+        buff.document = Document('one two\nthree four\nfive', 4)
+        transform(buff)
+        assert buff.text != 'one two\nthree four\nfive'
+
+        buff.undo()
+        assert buff.text == 'one two\nthree four\nfive'
+        assert buff.cursor_position == 4
+
+    check(lambda b: b.transform_region(0, 7, lambda text: text.upper()))
+    check(lambda b: b.transform_current_line(lambda text: text.upper()))
+    check(lambda b: indent(b, 0, 2))
+    check(lambda b: reshape_text(b, 0, 2))
+
+
+def test_completions_narrowed_while_typing():
+    calls = []
+
+    class CountingCompleter(WordCompleter):
+        def get_completions(self, document, complete_event):
+            calls.append(document.text)
+            return super(CountingCompleter, self).get_completions(document, complete_event)
+
+    buff = Buffer(completer=CountingCompleter(['abc', 'abcd', 'abd', 'xyz']))
+
+    def complete(text):
+        buff.insert_text(text)
+        get_event_loop().run_until_complete(ensure_future(buff._async_completer()))
+        return [c.text for c in buff.complete_state.completions]
+
+    assert complete('a') == ['abc', 'abcd', 'abd']
+    assert complete('b') == ['abc', 'abcd', 'abd']
+    assert complete('c') == ['abc', 'abcd']
+    assert calls == ['a']
+
+    # The completions are retrieved again for another word.
+    assert complete(' x') == ['xyz']
+    assert calls == ['a', 'abc x']
+
+    # Also through a `DynamicCompleter` that returns a new wrapper every time.
+    del calls[:]
+    completer = CountingCompleter(['abc', 'abcd', 'abd', 'xyz'])
+    buff = Buffer(completer=DynamicCompleter(lambda: ThreadedCompleter(completer)))
+    assert complete('a') == ['abc', 'abcd', 'abd']
+    assert complete('bc') == ['abc', 'abcd']
+    assert calls == ['a']
+
+    # The previous completions are only kept when they can be narrowed down.
+    class PlainCompleter(Completer):
+        def get_completions(self, document, complete_event):
+            yield Completion('abc', -1)
+
+    buff = Buffer(completer=ThreadedCompleter(PlainCompleter()))
+    assert complete('a') == ['abc']
+    assert buff._previous_completions is None
+
+
+def test_completions_delivered_in_batches():
+    events = []
+    words = ['word%i' % i for i in range(1000)]
+    buff = Buffer(completer=WordCompleter(words),
+                  on_completions_changed=lambda sender: events.append(
+                      len(sender.complete_state.completions)))
+
+    buff.insert_text('w')
+    get_event_loop().run_until_complete(ensure_future(buff._async_completer()))
+
+    # One event for the completions that were received at once.
+    assert events == [1000]
+
+
+def test_superseded_completions_are_cancelled():
+    events = []
+
+    class SlowCompleter(Completer):
+        def get_completions(self, document, complete_event):
+            events.append(complete_event)
+
+            if len(events) == 1:
+                # Type another character while completing.
+                call_from_executor(lambda: buff.insert_text('b'))
+
+                while not complete_event.cancelled:
+                    time.sleep(.01)
+                yield Completion('abc (too late)', -1)
+            else:
+                yield Completion('abc', -2)
+
+    buff = Buffer(completer=ThreadedCompleter(SlowCompleter()))
+    buff.insert_text('a')
+    get_event_loop().run_until_complete(ensure_future(buff._async_completer()))
+
+    # The completions are retrieved again for the new text.
+    assert [c.text for c in buff.complete_state.completions] == ['abc']
+    assert events[0].cancelled and not events[1].cancelled
+    assert buff.completer._workers._thread_count <= buff.completer._workers.max_workers
+
+
+def test_threaded_completions_dont_start_threads():
+    # A new `ThreadedCompleter` for every completion (like a
+    # `DynamicCompleter` can return) still uses the same threads.
+    buff = Buffer(completer=DynamicCompleter(
+        lambda: ThreadedCompleter(WordCompleter(['abc', 'abd']))))
+
+    def complete():
+        buff.reset()
+        buff.insert_text('a')
+        get_event_loop().run_until_complete(ensure_future(buff._async_completer()))
+        assert len(buff.complete_state.completions) == 2
+
+    complete()
+    thread_count = threading.active_count()
+
+    for i in range(50):
+        complete()
+
+    assert threading.active_count() <= thread_count + ThreadedCompleter._shared_workers.max_workers
+
+
+def test_completion_timing():
+    timings = []
+    app = Application(input=DummyInput(), output=DummyOutput(),
+                      metrics_handler=timings.append)
+    buff = Buffer(completer=ThreadedCompleter(WordCompleter(['abc', 'abd', 'x'])))
+
+    with set_app(app):
+        buff.insert_text('a')
+        get_event_loop().run_until_complete(ensure_future(buff._async_completer()))
+
+    # One timing for the buffer, and one for the completer in the thread.
+    timings.sort(key=lambda t: t.kind)
+    assert [t.kind for t in timings] == ['completer', 'completion']
+
+    for timing in timings:
+        assert timing.item_count == 2
+        assert 0 <= timing.time_to_first_item <= timing.duration
+        assert not timing.cancelled and not timing.retried
+
+    # Nothing is measured without a handler.
+    assert start_timing('completion', buff.completer) is None
+
+
+def test_completer_timing_when_cancelled_before_start():
+    timings = []
+    reported = Future()
+
+    def handler(timing):
+        timings.append(timing)
+        if len(timings) == 2:
+            reported.set_result(None)
+
+    app = Application(input=DummyInput(), output=DummyOutput(),
+                      metrics_handler=handler)
+    completer = ThreadedCompleter(WordCompleter(['abc']))
+
+    with set_app(app):
+        # A request that is closed before it gets a thread.
+        cancelled = completer.get_completions_async(Document('a', 1), CompleteEvent())
+        next(cancelled)
+        cancelled.close()
+
+        ensure_future(consume_async_generator(
+            completer.get_completions_async(Document('a', 1), CompleteEvent()),
+            cancel=lambda: False, item_callback=lambda c: None))
+
+        # (Don't wait forever when a timing is missing.)
+        call_later(5, lambda: reported.done() or reported.set_result(None))
+        get_event_loop().run_until_complete(reported)
+
+    assert sorted((t.cancelled, t.item_count) for t in timings) == [(False, 1), (True, 0)]
+
+
+def test_auto_suggest_and_validation_timing():
+    timings = []
+    app = Application(input=DummyInput(), output=DummyOutput(),
+                      metrics_handler=timings.append)
+
+    class ChangingAutoSuggest(AutoSuggest):
+        " Type another character, the first time. "
+        def get_suggestion(self, buffer, document):
+            if buffer.text == 'a':
+                buffer.insert_text('b')
+            return Suggestion('c')
+
+    class ChangingValidator(Validator):
+        def validate(self, document):
+            if buff.text == 'ab':
+                buff.insert_text('c')
+
+    buff = Buffer(auto_suggest=ChangingAutoSuggest(), validator=ChangingValidator())
+
+    with set_app(app):
+        buff.insert_text('a')
+        get_event_loop().run_until_complete(ensure_future(buff._async_suggester()))
+        get_event_loop().run_until_complete(buff._validate_async())
+
+    def get(kind):
+        return [(t.cancelled, t.retried) for t in timings if t.kind == kind]
+
+    # Only the auto suggestion is retried. (A validation for the new input is
+    # timed separately.)
+    assert get('auto_suggest') == [(True, True), (False, False)]
+    assert get('validation') == [(True, False), (False, False)]
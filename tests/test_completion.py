@@ -2,13 +2,17 @@ from __future__ import unicode_literals, absolute_import, print_function
 
 import os
 import shutil
+import pytest
 import tempfile
+import threading
+import time
 
 from contextlib import contextmanager
 from six import text_type
 
-from prompt_toolkit.completion import CompleteEvent, PathCompleter, WordCompleter
+from prompt_toolkit.completion import CompleteEvent, Completer, CompleterProcessError, Completion, ExecutableCompleter, FuzzyCompleter, PathCompleter, ProcessPoolCompleter, ThreadedCompleter, WordCompleter, merge_completers
 from prompt_toolkit.document import Document
+from prompt_toolkit.eventloop import consume_async_generator, ensure_future, get_event_loop
 
 
 @contextmanager
@@ -251,6 +255,135 @@ def test_pathcompleter_get_paths_constrains_path():
     shutil.rmtree(test_dir)
 
 
+def test_pathcompleter_caches_directory_listings():
+    test_dir = tempfile.mkdtemp()
+    write_test_files(test_dir, ['a1', 'a2', 'b1'])
+    os.mkdir(os.path.join(test_dir, 'a3'))
+
+    def complete(text):
+        completions = completer.get_completions(Document(text), CompleteEvent())
+        return [c.display for c in completions]
+
+    # A directory that was modified long ago.
+    os.utime(test_dir, (1000000000, 1000000000))
+
+    completer = PathCompleter(get_paths=lambda: [test_dir], prefetch=True)
+    assert complete('a') == ['a1', 'a2', 'a3/']
+
+    # The listing is used again while the modification time is the same.
+    write_test_files(test_dir, ['a4'])
+    os.utime(test_dir, (1000000000, 1000000000))
+    assert complete('a') == ['a1', 'a2', 'a3/']
+
+    os.utime(test_dir, (1000000100, 1000000100))
+    assert complete('a') == ['a1', 'a2', 'a3/', 'a4']
+
+    # cleanup
+    shutil.rmtree(test_dir)
+
+
+def test_pathcompleter_without_scandir(monkeypatch):
+    from prompt_toolkit.completion import filesystem
+
+    test_dir = tempfile.mkdtemp()
+    write_test_files(test_dir, ['a1', 'b1', 'b2'])
+    os.mkdir(os.path.join(test_dir, 'a2'))
+
+    # Without `os.scandir`, (Python 2), only the completed names are checked
+    # for being a directory.
+    checked = []
+    real_isdir = os.path.isdir
+
+    def isdir(path):
+        checked.append(os.path.basename(path))
+        return real_isdir(path)
+
+    monkeypatch.setattr(filesystem, '_scandir', None)
+    monkeypatch.setattr(filesystem.os.path, 'isdir', isdir)
+
+    try:
+        completer = PathCompleter(get_paths=lambda: [test_dir])
+        completions = completer.get_completions(Document('a'), CompleteEvent())
+        assert [c.display for c in completions] == ['a1', 'a2/']
+        assert sorted(checked) == ['a1', 'a2']
+    finally:
+        monkeypatch.undo()
+        shutil.rmtree(test_dir)
+
+
+def test_executable_completer_completes_executables_in_path():
+    test_dir = tempfile.mkdtemp()
+    write_test_files(test_dir, ['ab', 'ac', 'ad', 'b'])
+    os.chmod(os.path.join(test_dir, 'ab'), 0o755)
+    os.chmod(os.path.join(test_dir, 'ac'), 0o755)
+    os.mkdir(os.path.join(test_dir, 'ae'))
+
+    orig_path = os.environ.get('PATH', '')
+    os.environ['PATH'] = os.pathsep.join([test_dir, os.path.join(test_dir, 'missing')])
+
+    try:
+        completer = ExecutableCompleter()
+        completions = completer.get_completions(Document('a'), CompleteEvent())
+        assert [c.display for c in completions] == ['ab', 'ac', 'ae/']
+    finally:
+        os.environ['PATH'] = orig_path
+
+    # cleanup
+    shutil.rmtree(test_dir)
+
+
+def test_executable_completer_prefetches_once(monkeypatch):
+    from prompt_toolkit.completion import filesystem
+
+    test_dir = tempfile.mkdtemp()
+    write_test_files(test_dir, ['ab'])
+    monkeypatch.setenv('PATH', test_dir)
+
+    try:
+        cache = filesystem._executable_cache
+        thread = cache.prefetch([test_dir], executables=True)
+        assert thread is not None
+
+        # While it's being read, or once it's cached, it's not read again.
+        assert cache.prefetch([test_dir], executables=True) is None
+        thread.join()
+        assert cache.prefetch([test_dir], executables=True) is None
+
+        # The executables are kept apart from the other listings.
+        assert os.path.abspath(test_dir) not in filesystem._directory_cache._data
+    finally:
+        monkeypatch.undo()
+        shutil.rmtree(test_dir)
+
+
+def test_executable_completer_checks_only_matches(monkeypatch):
+    from prompt_toolkit.completion import filesystem
+
+    test_dir = tempfile.mkdtemp()
+    write_test_files(test_dir, ['ab', 'ac', 'b', 'c'])
+    os.chmod(os.path.join(test_dir, 'ab'), 0o755)
+
+    # Without indexing in the background, only the matching names are checked.
+    checked = []
+    real_access = os.access
+
+    def access(path, mode):
+        checked.append(os.path.basename(path))
+        return real_access(path, mode)
+
+    monkeypatch.setattr(filesystem.os, 'access', access)
+    monkeypatch.setenv('PATH', test_dir)
+
+    try:
+        completer = ExecutableCompleter(prefetch=False)
+        completions = completer.get_completions(Document('a'), CompleteEvent())
+        assert [c.display for c in completions] == ['ab']
+        assert checked == ['ab', 'ac']
+    finally:
+        monkeypatch.undo()
+        shutil.rmtree(test_dir)
+
+
 def test_word_completer_static_word_list():
     completer = WordCompleter(['abc', 'def', 'aaa'])
 
@@ -314,3 +447,198 @@ def test_word_completer_dynamic_word_list():
     completions = completer.get_completions(Document('a'), CompleteEvent())
     assert [c.text for c in completions] == ['abc', 'aaa']
     assert called[0] == 2
+
+
+def test_word_completer_index():
+    words = ['abc', 'ABD', 'xab', 'ab', 'b\x00ab']
+    get_words = lambda: words
+
+    def complete(completer, text):
+        completions = completer.get_completions(Document(text), CompleteEvent())
+        return [c.text for c in completions]
+
+    completer = WordCompleter(get_words, ignore_case=True)
+    assert complete(completer, 'ab') == ['abc', 'ABD', 'ab']
+    assert completer._index is None
+
+    # The index is built when the same list is returned again.
+    assert complete(completer, 'AB') == ['abc', 'ABD', 'ab']
+    assert completer._index is not None
+
+    # And built again when the list changed.
+    words.append('abe')
+    assert complete(completer, 'abd') == ['ABD']
+    assert complete(completer, 'abe') == ['abe']
+
+    completer = WordCompleter(words, match_middle=True)
+    assert complete(completer, 'ab') == ['abc', 'xab', 'ab', 'b\x00ab', 'abe']
+    assert complete(completer, 'b\x00') == ['b\x00ab']
+
+    # A list that is changed in place.
+    completer = WordCompleter(words)
+    assert complete(completer, 'ab') == ['abc', 'ab', 'abe']
+    words[0] = 'xyz'
+    assert complete(completer, 'ab') == ['ab', 'abe']
+    assert complete(completer, 'xy') == ['xyz']
+
+
+def test_fuzzy_completer():
+    completer = FuzzyCompleter(WordCompleter(
+        ['leopard', 'gorilla', 'dinosaur', 'cat', 'bee', 'oar']))
+
+    completions = list(completer.get_completions(Document('x oar'), CompleteEvent()))
+
+    # Ranked by the length of the match, then by its start.
+    assert [c.text for c in completions] == ['oar', 'leopard', 'dinosaur']
+    assert [c.start_position for c in completions] == [-3, -3, -3]
+
+    # The matched characters are highlighted.
+    assert completions[2].display == 'dinosaur'
+    assert completions[2].display_fragments == [
+        ('class:fuzzymatch.outside', 'din'),
+        ('class:fuzzymatch.inside.character', 'o'),
+        ('class:fuzzymatch.inside', 's'),
+        ('class:fuzzymatch.inside.character', 'a'),
+        ('class:fuzzymatch.inside', 'u'),
+        ('class:fuzzymatch.inside.character', 'r'),
+        ('class:fuzzymatch.outside', ''),
+    ]
+
+    # Case insensitive, and only the best `max_results`.
+    completer.max_results = 2
+    completions = completer.get_completions(Document('OA'), CompleteEvent())
+    assert [c.text for c in completions] == ['oar', 'leopard']
+
+
+def test_fuzzy_completer_words_changed_in_place():
+    words = ['apple', 'banana']
+    completer = FuzzyCompleter(WordCompleter(words))
+
+    def complete(text):
+        return [c.text for c in completer.get_completions(Document(text), CompleteEvent())]
+
+    assert complete('a') == ['apple', 'banana']
+    words[1] = 'avocado'
+    assert complete('a') == ['apple', 'avocado']
+
+
+def test_process_pool_completer():
+    completer = ProcessPoolCompleter(WordCompleter(
+        ['abc', 'abd', 'xyz'], meta_dict={'abd': 'meta'}), batch_size=1)
+
+    try:
+        completions = list(completer.get_completions(Document('a'), CompleteEvent()))
+        assert [c.text for c in completions] == ['abc', 'abd']
+        assert [c.display_meta for c in completions] == ['', 'meta']
+
+        # When we stop early, the worker can be used again.
+        completions = completer.get_completions(Document('a'), CompleteEvent())
+        assert next(completions).text == 'abc'
+        completions.close()
+
+        completions = completer.get_completions(Document('x'), CompleteEvent())
+        assert [c.text for c in completions] == ['xyz']
+        assert len(completer._workers) == 1
+    finally:
+        completer.close()
+
+
+class _FailingCompleter(Completer):
+    def get_completions(self, document, complete_event):
+        if document.text == 'fail':
+            raise ValueError('Completer failed.')
+        yield Completion('ok')
+
+
+class _StuckCompleter(Completer):
+    " Completer that doesn't poll `complete_event.cancelled`. "
+    def get_completions(self, document, complete_event):
+        yield Completion('a')
+        time.sleep(60)
+        yield Completion('b')
+
+
+def test_process_pool_completer_error():
+    completer = ProcessPoolCompleter(_FailingCompleter())
+
+    try:
+        with pytest.raises(CompleterProcessError) as e:
+            list(completer.get_completions(Document('fail'), CompleteEvent()))
+        assert 'Completer failed.' in str(e.value)
+
+        # The worker is still used for the next completion.
+        completions = completer.get_completions(Document('x'), CompleteEvent())
+        assert [c.text for c in completions] == ['ok']
+        assert len(completer._workers) == 1
+    finally:
+        completer.close()
+
+
+def test_process_pool_completer_stuck_worker():
+    completer = ProcessPoolCompleter(_StuckCompleter(), batch_size=1)
+
+    try:
+        completions = completer.get_completions(Document(), CompleteEvent())
+        assert next(completions).text == 'a'
+
+        # The worker doesn't stop, so it's terminated.
+        start = time.time()
+        completions.close()
+        assert time.time() - start < 10
+        assert not completer._workers[0].is_alive()
+
+        # And a new worker is started.
+        completions = completer.get_completions(Document(), CompleteEvent())
+        assert next(completions).text == 'a'
+        completions.close()
+    finally:
+        completer.close()
+
+
+def test_merge_completers_runs_completers_at_the_same_time():
+    class WaitingCompleter(Completer):
+        " Wait for an event before yielding the words in `wait_before`. "
+        def __init__(self, words, wait_before=None):
+            self.words = words
+            self.wait_before = wait_before or {}
+
+        def get_completions(self, document, complete_event):
+            for word in self.words:
+                if word in self.wait_before:
+                    assert self.wait_before[word].wait(10)
+                yield Completion(word)
+
+    def complete(completer, received=None):
+        result = []
+
+        def item_callback(c):
+            result.append(c.text)
+            if received is not None and c.text in received:
+                received[c.text].set()
+
+        get_event_loop().run_until_complete(ensure_future(consume_async_generator(
+            completer.get_completions_async(Document(), CompleteEvent()),
+            cancel=lambda: False, item_callback=item_callback)))
+        return result
+
+    # The completions are received as they arrive. (The first completer waits
+    # until the completions of the second one are received.)
+    b2_received = threading.Event()
+    slow = ThreadedCompleter(WaitingCompleter(['a1', 'a2'], {'a1': b2_received}))
+    fast = ThreadedCompleter(WaitingCompleter(['b1', 'b2']))
+    assert complete(merge_completers([slow, fast]),
+                    received={'b2': b2_received}) == ['b1', 'b2', 'a1', 'a2']
+
+    # The first completers rank first.
+    slow = ThreadedCompleter(WaitingCompleter(['a1', 'a2']))
+    assert complete(merge_completers([slow, fast], max_results=3)) == ['a1', 'a2', 'b1']
+
+    # Slow completers are stopped.
+    release = threading.Event()
+    slow = ThreadedCompleter(WaitingCompleter(['a1', 'a2'], {'a2': release}))
+
+    try:
+        result = complete(merge_completers([slow, fast], timeout=.5))
+        assert sorted(result) == ['a1', 'b1', 'b2']
+    finally:
+        release.set()
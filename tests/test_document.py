@@ -1,6 +1,8 @@
 from __future__ import unicode_literals
 
 import pytest
+import sys
+import threading
 
 from prompt_toolkit.document import Document
 
@@ -78,3 +80,134 @@ def test_translate_index_to_position(document):
 def test_is_cursor_at_the_end(document):
     assert Document('hello', 5).is_cursor_at_the_end
     assert not Document('hello', 4).is_cursor_at_the_end
+
+
+def test_search_matches():
+    d = Document('aaaa Aa\naa', 0)
+
+    # Overlapping matches are included.
+    assert d.get_search_matches('aa') == (0, 1, 2, 8)
+    assert d.get_search_matches('aa', ignore_case=True) == (0, 1, 2, 5, 8)
+    assert d.find_all('aa') == [0, 2, 8]
+
+    # The matches are shared with other documents that have the same text.
+    assert Document('aaaa Aa\naa', 3).has_cached_search_matches('aa')
+    assert not Document('aaaa Aa\naa', 3).has_cached_search_matches('aaa')
+
+
+def test_find_matching_bracket_position():
+    text = 'f(a[0], (b)) ] {'
+
+    assert Document(text, 1).find_matching_bracket_position() == 10
+    assert Document(text, 11).find_matching_bracket_position() == -10
+    assert Document(text, 3).find_matching_bracket_position() == 2
+    assert Document(text, 8).find_matching_bracket_position() == 2
+
+    # Brackets without a match.
+    assert Document(text, 13).find_matching_bracket_position() == 0
+    assert Document(text, 15).find_matching_bracket_position() == 0
+
+    # Don't look past `start_pos`/`end_pos`.
+    assert Document(text, 1).find_matching_bracket_position(end_pos=12) == 10
+    assert Document(text, 1).find_matching_bracket_position(end_pos=11) == 0
+
+    # With bounds, the brackets in between are scanned, without an index.
+    text = '(a[0]) ] [x'
+    document = Document(text, 5)
+    assert document.find_matching_bracket_position(start_pos=0) == -5
+    assert document.find_matching_bracket_position(start_pos=1) == 0
+    assert Document(text, 7).find_matching_bracket_position(start_pos=0) == 0
+    assert Document(text, 9).find_matching_bracket_position(end_pos=11) == 0
+    assert document._cache.bracket_pairs is None
+
+    # At the end of the text, there is no bracket to index.
+    document = Document(text, len(text))
+    assert document.find_matching_bracket_position() == 0
+    assert document._cache.bracket_pairs is None
+
+
+def test_lines_are_sliced_from_text(document):
+    lines = document.lines
+
+    assert lines[1] == 'line 2'
+    assert lines[-1] == ''
+    assert lines[1:3] == ['line 2', 'line 3']
+    assert lines[3:] == ['line 4', '']
+    assert lines[2:2] == []
+    assert lines[::-1] == ['', 'line 4', 'line 3', 'line 2', 'line 1']
+    assert list(lines) == document.text.split('\n')
+
+    with pytest.raises(IndexError):
+        lines[5]
+
+    # Compares like a list, but can't be modified.
+    assert lines == document.text.split('\n')
+    assert lines != tuple(lines)
+    assert lines.__eq__(5) is NotImplemented
+
+    with pytest.raises(NotImplementedError):
+        lines[0] = 'x'
+
+
+def test_search_matches_narrowed_from_prefix():
+    document = Document('x' * 1000 + 'ab ac abc Abd')
+    assert document.get_search_matches('a') == (1000, 1003, 1006)
+
+    # The candidates come from the matches of the prefix.
+    assert document._get_search_match_candidates('ab', False) == (1000, 1003, 1006)
+    assert document.get_search_matches('ab') == (1000, 1006)
+    assert document.get_search_matches('abc') == (1006, )
+    assert document.get_search_matches('ab', ignore_case=True) == (1000, 1006, 1010)
+
+
+def test_search_matches_during_background_search():
+    document = Document('x' * 1000 + 'ab ac abc Abd')
+    stop = threading.Event()
+
+    def background_search():
+        # Other queries on the same text, which fill up the cache.
+        i = 0
+        while not stop.is_set():
+            document.get_search_matches('x' * (i % 20 + 1))
+            i += 1
+
+    # Switch between the threads often.
+    switch_interval = getattr(sys, 'getswitchinterval', lambda: None)()
+    if switch_interval is not None:
+        sys.setswitchinterval(1e-6)
+
+    thread = threading.Thread(target=background_search)
+    thread.start()
+
+    try:
+        for _ in range(2000):
+            for query, expected in [('a', (1000, 1003, 1006)), ('ab', (1000, 1006)),
+                                    ('abc', (1006, ))]:
+                # (Looking for the matches of a prefix goes through the cache.)
+                document._get_search_match_candidates(query, False)
+                assert document.get_search_matches(query) == expected
+    finally:
+        stop.set()
+        thread.join()
+
+        if switch_interval is not None:
+            sys.setswitchinterval(switch_interval)
+
+
+def test_word_motions_in_windows():
+    # Words that are longer than the first window before the cursor.
+    text = 'a' * 1000 + ' ' * 1000 + 'b' * 300 + '.' * 300 + ' c'
+    document = Document(text, len(text) - 1)
+
+    assert document.find_start_of_previous_word() == -301
+    assert document.find_previous_word_beginning(count=2) == -601
+    assert document.find_previous_word_beginning(count=3) == -len(text) + 1
+    assert document.find_previous_word_beginning(count=4) is None
+    assert document.find_previous_word_beginning(WORD=True) == -601
+    assert document.find_previous_word_ending(count=2) == -301
+    assert document.get_word_before_cursor() == ''
+
+    document = Document(text, 0)
+    assert document.find_next_word_beginning() == 2000
+    assert document.find_next_word_beginning(count=2, WORD=True) == len(text) - 1
+    assert document.find_next_word_ending(count=2) == 2300
@@ -2,11 +2,15 @@ from __future__ import unicode_literals
 
 from prompt_toolkit.application import Application
 from prompt_toolkit.application.current import set_app
+from prompt_toolkit.buffer import Buffer
+from prompt_toolkit.filters import Condition
 from prompt_toolkit.input.defaults import create_pipe_input
+from prompt_toolkit.key_binding.bindings.named_commands import get_by_name
 from prompt_toolkit.key_binding.key_bindings import KeyBindings
 from prompt_toolkit.key_binding.key_processor import KeyProcessor, KeyPress
 from prompt_toolkit.keys import Keys
 from prompt_toolkit.layout import Window, Layout
+from prompt_toolkit.layout.controls import BufferControl
 from prompt_toolkit.output import DummyOutput
 
 import pytest
@@ -182,3 +186,53 @@ def test_previous_key_sequence(processor):
         assert events[1].previous_key_sequence[0].data == 'a'
         assert events[1].previous_key_sequence[1].key == 'a'
         assert events[1].previous_key_sequence[1].data == 'a'
+
+
+def test_self_insert_run():
+    buff = Buffer()
+    app = Application(
+        layout=Layout(Window(BufferControl(buffer=buff))),
+        output=DummyOutput(),
+        input=create_pipe_input())
+
+    with set_app(app):
+        inserts = []
+        buff.on_text_insert += lambda sender: inserts.append(buff.text)
+
+        bindings = KeyBindings()
+        bindings.add(Keys.Any)(get_by_name('self-insert'))
+        bindings.add('x')(lambda event: event.current_buffer.insert_text('X'))
+        processor = KeyProcessor(bindings)
+
+        # Pasted text is inserted at once, until a key with another handler.
+        processor.feed_multiple([KeyPress(c) for c in 'hello xworld'])
+        processor.process_keys()
+
+        assert buff.text == 'hello Xworld'
+        assert inserts == ['h', 'hello ', 'hello X', 'hello Xw', 'hello Xworld']
+
+
+def test_self_insert_run_filters_after_insert():
+    buff = Buffer()
+    app = Application(
+        layout=Layout(Window(BufferControl(buffer=buff))),
+        output=DummyOutput(),
+        input=create_pipe_input())
+
+    with set_app(app):
+        buff.text = 'abc'
+        buff.start_selection()
+
+        bindings = KeyBindings()
+        bindings.add(Keys.Any)(get_by_name('self-insert'))
+
+        # Only active without selection. (Inserting text clears it.)
+        @bindings.add('x', filter=Condition(lambda: buff.selection_state is None))
+        def _(event):
+            event.current_buffer.insert_text('X')
+
+        processor = KeyProcessor(bindings)
+        processor.feed_multiple([KeyPress(c) for c in 'axx'])
+        processor.process_keys()
+
+        assert buff.text == 'aXXabc'
@@ -0,0 +1,73 @@
+from __future__ import unicode_literals
+
+from prompt_toolkit.application import Application
+from prompt_toolkit.application.current import set_app
+from prompt_toolkit.buffer import Buffer, CompletionState
+from prompt_toolkit.completion import Completion
+from prompt_toolkit.document import Document
+from prompt_toolkit.input.defaults import create_pipe_input
+from prompt_toolkit.layout import Layout
+from prompt_toolkit.layout.containers import Window
+from prompt_toolkit.layout.controls import BufferControl
+from prompt_toolkit.layout.menus import CompletionsMenuControl, MultiColumnCompletionMenuControl
+from prompt_toolkit.output import DummyOutput
+
+import pytest
+
+
+@pytest.fixture
+def buff():
+    buff = Buffer()
+    app = Application(
+        layout=Layout(Window(BufferControl(buffer=buff))),
+        input=create_pipe_input(),
+        output=DummyOutput())
+
+    with set_app(app):
+        buff.complete_state = CompletionState(Document())
+        yield buff
+
+
+def test_completions_menu_width_follows_streamed_completions(buff):
+    control = CompletionsMenuControl()
+    completions = buff.complete_state.completions
+
+    completions.append(Completion('abc'))
+    assert control.preferred_width(100) == CompletionsMenuControl.MIN_WIDTH
+
+    completions.append(Completion('abcdefghij', display_meta='meta'))
+    assert control.preferred_width(100) == 12 + 6
+
+    content = control.create_content(30, 5)
+    assert content.line_count == 2
+    assert content.get_line(1) == [
+        ('class:completion-menu.completion ', ' abcdefghij '),
+        ('class:completion-menu.meta.completion', ' meta '),
+    ]
+
+    # A new completion state is measured again.
+    buff.complete_state = CompletionState(
+        Document(), completions=[Completion('a')])
+    assert control.preferred_width(100) == CompletionsMenuControl.MIN_WIDTH
+
+
+def test_multi_column_menu_renders_visible_columns(buff):
+    buff.complete_state = CompletionState(
+        Document(), completions=[Completion('%05i' % i) for i in range(10000)])
+    control = MultiColumnCompletionMenuControl()
+
+    # Columns of 6 characters, 3 rows: four visible columns and a right arrow.
+    content = control.create_content(width=31, height=3)
+    assert content.line_count == 3
+    assert ''.join(text for _, text in content.get_line(1)) == \
+        ' 00001 00004 00007 00010 >'
+
+    # Select a completion further away: the menu scrolls.
+    buff.go_to_completion(20)
+    content = control.create_content(width=31, height=3)
+    assert control.scroll == 3
+    assert ''.join(text for _, text in content.get_line(1)) == \
+        '< 00010 00013 00016 00019 >'
+
+    # Mouse positions map to the rendered completions.
+    assert control._get_completion_at_position(buff.complete_state, 8, 0).text == '00012'
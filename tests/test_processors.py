@@ -0,0 +1,65 @@
+from __future__ import unicode_literals
+
+from prompt_toolkit.document import Document
+from prompt_toolkit.formatted_text.utils import fragment_list_to_text
+from prompt_toolkit.layout.processors import BeforeInput, HighlightSearchProcessor, TabsProcessor, Transformation, TransformationInput, Processor, merge_processors
+
+
+def _transform(processor, text):
+    document = Document(text)
+    return processor.apply_transformation(TransformationInput(
+        None, document, 0, lambda i: i, [('', text)], 80, 24))
+
+
+def test_merged_position_mappings():
+    processor = merge_processors([
+        BeforeInput('>>'),
+        TabsProcessor(tabstop=8, char1='.', char2='.'),
+        BeforeInput('$ '),
+    ])
+    transformation = _transform(processor, 'a\tb')
+
+    assert fragment_list_to_text(transformation.fragments) == '$ >>a.....b'
+
+    # The positions are composed into one lookup table.
+    assert transformation.position_mapping == [4, 5, 10, 11]
+    assert [transformation.source_to_display(i) for i in range(5)] == [4, 5, 10, 11, 12]
+    assert [transformation.display_to_source(i) for i in range(13)] == \
+        [0, 0, 0, 0, 0, 1, 1, 1, 1, 1, 2, 3, 4]
+
+
+def test_merged_position_mappings_with_functions():
+    class ShiftProcessor(Processor):
+        " Processor that only provides the position functions. "
+        def apply_transformation(self, ti):
+            return Transformation(
+                [('', '#')] + ti.fragments,
+                source_to_display=lambda i: i + 1,
+                display_to_source=lambda i: i - 1)
+
+    processor = merge_processors([
+        BeforeInput('>>'),
+        ShiftProcessor(),
+        BeforeInput('$ '),
+    ])
+    transformation = _transform(processor, 'abc')
+
+    assert fragment_list_to_text(transformation.fragments) == '$ #>>abc'
+    assert transformation.position_mapping is None
+    assert transformation.source_to_display(1) == 6
+    assert transformation.display_to_source(6) == 1
+
+
+def test_search_processor_subclass_without_init():
+    class SearchProcessor(HighlightSearchProcessor):
+        _background_search_size = 10
+
+        def __init__(self):
+            pass  # (Doesn't call `HighlightSearchProcessor.__init__`.)
+
+    processor = SearchProcessor()
+    document = Document('abc ' * 10)
+
+    # The big document is searched in the background.
+    assert processor._get_search_matches(document, 'b', False) is None
+    assert len(processor._searching) == 1
@@ -0,0 +1,77 @@
+from __future__ import unicode_literals
+
+from prompt_toolkit.buffer import Buffer
+from prompt_toolkit.undo import UndoStack
+
+
+def test_undo_stack():
+    stack = UndoStack()
+    stack.push('hello', 0)
+    stack.push('hello', 5)
+    stack.push('hello world', 11)
+    stack.push('hi world', 2)
+
+    # Only the edits are stored.
+    assert len(stack) == 3
+    assert stack._edits[-1] == (1, 2, 'ello', 11)
+
+    assert stack.pop() == ('hi world', 2)
+    assert stack.pop() == ('hello world', 11)
+    assert stack.pop() == ('hello', 5)
+    assert not stack
+
+
+def test_undo_stack_max_size():
+    stack = UndoStack(max_size=10 + 2 * UndoStack.edit_overhead)
+    stack.push('a' * 8, 0)
+    stack.push('', 0)
+    stack.push('b' * 6, 0)
+    stack.push('', 0)
+
+    # The oldest state was dropped.
+    assert [stack.pop()[0] for _ in range(len(stack))] == ['', 'b' * 6, '']
+
+
+def test_undo_stack_max_size_inserts():
+    # Edits that only insert text count too.
+    stack = UndoStack(max_size=3 * UndoStack.edit_overhead)
+    for i in range(10):
+        stack.push('a' * i, i)
+
+    assert len(stack) == 4
+    assert stack.pop() == ('a' * 9, 9)
+
+
+def _type(buff, text):
+    for c in text:
+        buff.save_to_undo_stack()
+        buff.insert_text(c)
+
+
+def test_undo_groups_inserts():
+    buff = Buffer()
+    _type(buff, 'hello world')
+
+    buff.undo()
+    assert buff.text == 'hello '
+    buff.undo()
+    assert buff.text == ''
+
+    buff.redo()
+    assert buff.text == 'hello '
+    buff.redo()
+    assert buff.text == 'hello world'
+
+
+def test_undo_after_delete():
+    buff = Buffer()
+    _type(buff, 'abc')
+    buff.save_to_undo_stack()
+    buff.delete_before_cursor(2)
+    _type(buff, 'xy')
+
+    buff.undo()
+    assert buff.text == 'a'
+    buff.undo()
+    assert buff.text == 'abc'
+    assert buff.cursor_position == 3